@@ -0,0 +1,339 @@
+'''
+Condition activation matrix
+Each condition is passed once through each document and per word results are stored as boolean arrays,
+so any subset of conditions can be scored by bitwise reduction without rescanning of words
+'''
+
+import json
+import os
+import numpy as np
+import conditions
+import token_corpus
+from typing import List, Optional, Sequence
+
+
+def condition_activations(cond, words: Sequence[str], classes: Optional[conditions.token_classes] = None) -> np.ndarray:
+    """
+    Pass the words through the condition and return per word results.
+
+    :param cond: Condition object (conditions.condition_base)
+    :param words: Sequence of words
+    :param classes: Optional token classes of the words shared between conditions
+    :return: Boolean array with one element per word
+    """
+    return cond.check_words(words, classes)
+
+
+class activation_matrix():
+    def __init__(self, list_of_conditions: List[object], list_of_words: Sequence[Sequence[str]], list_of_labels: Optional[Sequence[bool]] = None, top_level_operation: str = 'and', keyword_automaton=None, deduplicate: bool = True):
+        """
+        Build activation matrix of the conditions over the documents.
+
+        :param list_of_conditions: List of condition objects
+        :param list_of_words: List of preprocessed documents (each one is a sequence of words) or token_corpus.token_corpus
+        :param list_of_labels: Optional list of labels (True/False) for each document, required by errors()
+        :param top_level_operation: Top level operation of the model ('and' or 'or')
+        :param keyword_automaton: Optional automaton of keyword conditions (conditions.compile_keyword_conditions),
+                                  compiled from list_of_conditions if it is not provided
+        :param deduplicate: If True, documents with identical words are evaluated once and counted with weights
+        """
+        if top_level_operation not in ('and', 'or'):
+            raise Exception(f'Unknown top level operation {top_level_operation}')
+        if list_of_labels is not None and len(list_of_labels) != len(list_of_words):
+            raise Exception('Length of list_of_words and list_of_labels must be equal')
+        self.top_level_operation = top_level_operation
+        self.n_conditions = len(list_of_conditions)
+        self.n_documents = len(list_of_words)
+        if keyword_automaton is None:
+            keyword_automaton = conditions.compile_keyword_conditions(list_of_conditions)
+        # Documents of token_corpus are referred to by their indexes and evaluated on token ids
+        interned = isinstance(list_of_words, token_corpus.token_corpus)
+        documents = range(self.n_documents) if interned else list_of_words
+        # Index of the unique document for each document
+        if deduplicate:
+            unique_index = {}
+            unique_words = []
+            document_index = []
+            for words in documents:
+                key = list_of_words.document_key(words) if interned else tuple(words)
+                i = unique_index.get(key)
+                if i is None:
+                    i = unique_index[key] = len(unique_words)
+                    unique_words.append(words)
+                document_index.append(i)
+            self.document_index = np.array(document_index, dtype=np.int64)
+        else:
+            unique_words = documents
+            self.document_index = np.arange(self.n_documents, dtype=np.int64)
+        self.n_unique = len(unique_words)
+        columns = []
+        offsets = [0]
+        for words in unique_words:
+            classes = list_of_words.token_classes(words) if interned else None
+            doc_matrix = np.empty((self.n_conditions, len(classes.ids) if interned else len(words)), dtype=bool)
+            for i, row in enumerate(conditions.check_words_all(list_of_conditions, None if interned else words, keyword_automaton, classes=classes)):
+                doc_matrix[i] = row
+            # Words with equal activations of all conditions are indistinguishable for any subset of conditions
+            if doc_matrix.shape[1] > 1:
+                doc_matrix = np.unique(doc_matrix, axis=1)
+            columns.append(doc_matrix)
+            offsets.append(offsets[-1] + doc_matrix.shape[1])
+        if columns:
+            self.columns = np.concatenate(columns, axis=1)
+        else:
+            self.columns = np.zeros((self.n_conditions, 0), dtype=bool)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.nonempty = np.diff(self.offsets) > 0
+        # Per unique document: condition is true at least on one word
+        self.any_active = np.zeros((self.n_unique, self.n_conditions), dtype=bool)
+        for i in range(self.n_unique):
+            self.any_active[i] = self.columns[:, self.offsets[i]:self.offsets[i + 1]].any(axis=1)
+        self.labels = None if list_of_labels is None else np.array(list_of_labels, dtype=bool)
+        # Per unique document: number of its copies labeled True and False,
+        # error of the unique document is weight_false if it is accepted and weight_true otherwise
+        if self.labels is not None:
+            self.weight_true = np.bincount(self.document_index[self.labels], minlength=self.n_unique).astype(np.int64)
+            self.weight_false = np.bincount(self.document_index[~self.labels], minlength=self.n_unique).astype(np.int64)
+
+    @classmethod
+    def from_model(cls, model, list_of_words: Sequence[Sequence[str]], list_of_labels: Optional[Sequence[bool]] = None, deduplicate: bool = True):
+        """
+        Build activation matrix of all conditions of cbtbc_model.
+
+        :param model: cbtbc_model instance
+        :param list_of_words: List of preprocessed documents
+        :param list_of_labels: Optional list of labels
+        :param deduplicate: If True, documents with identical words are evaluated once and counted with weights
+        :return: activation_matrix
+        """
+        return cls(model.conditions, list_of_words, list_of_labels, model.top_level_operation, model.compile_keywords(), deduplicate)
+
+    def subset(self, document_indices: Sequence[int]) -> 'activation_matrix':
+        """
+        Activation matrix of a subset of the documents (e.g. a fold of cross-validation) sliced from this one
+        without rescanning of words.
+
+        :param document_indices: Indices of documents (duplicates are counted as copies)
+        :return: activation_matrix with labels of the selected documents (if this one has labels)
+        """
+        document_indices = np.asarray(document_indices, dtype=np.int64)
+        unique, document_index = np.unique(self.document_index[document_indices], return_inverse=True)
+        result = activation_matrix.__new__(activation_matrix)
+        result.top_level_operation = self.top_level_operation
+        result.n_conditions = self.n_conditions
+        result.n_documents = len(document_indices)
+        result.document_index = document_index.astype(np.int64)
+        result.n_unique = len(unique)
+        lengths = self.offsets[unique + 1] - self.offsets[unique]
+        result.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        # Word columns of the selected unique documents
+        words = np.repeat(self.offsets[unique] - result.offsets[:-1], lengths) + np.arange(result.offsets[-1])
+        result.columns = self.columns[:, words]
+        result.nonempty = lengths > 0
+        result.any_active = self.any_active[unique]
+        result.labels = None if self.labels is None else self.labels[document_indices]
+        if result.labels is not None:
+            result.weight_true = np.bincount(result.document_index[result.labels], minlength=result.n_unique).astype(np.int64)
+            result.weight_false = np.bincount(result.document_index[~result.labels], minlength=result.n_unique).astype(np.int64)
+        return result
+
+    def save(self, dirname: str):
+        """
+        Save the matrix to a directory, one .npy file per array, so it can be memory mapped by load.
+
+        :param dirname: Name of the directory (created if it does not exist)
+        """
+        os.makedirs(dirname, exist_ok=True)
+        arrays = {'document_index': self.document_index, 'columns': self.columns, 'offsets': self.offsets,
+                  'nonempty': self.nonempty, 'any_active': self.any_active}
+        if self.labels is not None:
+            arrays.update({'labels': self.labels, 'weight_true': self.weight_true, 'weight_false': self.weight_false})
+        for name, array in arrays.items():
+            np.save(os.path.join(dirname, name + '.npy'), array)
+        # Meta file is written last, directories without it are incomplete
+        with open(os.path.join(dirname, 'matrix.json'), 'w') as f:
+            json.dump({'top_level_operation': self.top_level_operation, 'n_conditions': self.n_conditions,
+                       'n_documents': self.n_documents, 'n_unique': self.n_unique, 'labels': self.labels is not None}, f)
+
+    @classmethod
+    def load(cls, dirname: str, mmap: bool = True) -> 'activation_matrix':
+        """
+        Load the matrix saved by save.
+
+        :param dirname: Name of the directory
+        :param mmap: If True, arrays are memory mapped instead of being read into memory
+        :return: activation_matrix
+        """
+        with open(os.path.join(dirname, 'matrix.json')) as f:
+            meta = json.load(f)
+        result = cls.__new__(cls)
+        result.top_level_operation = meta['top_level_operation']
+        result.n_conditions = meta['n_conditions']
+        result.n_documents = meta['n_documents']
+        result.n_unique = meta['n_unique']
+        names = ['document_index', 'columns', 'offsets', 'nonempty', 'any_active']
+        if meta['labels']:
+            names += ['labels', 'weight_true', 'weight_false']
+        else:
+            result.labels = None
+        for name in names:
+            setattr(result, name, np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r' if mmap else None))
+        return result
+
+    def _per_document_any(self, word_results: np.ndarray) -> np.ndarray:
+        cumsum = np.concatenate(([0], np.cumsum(word_results, dtype=np.int64)))
+        return (cumsum[self.offsets[1:]] - cumsum[self.offsets[:-1]]) > 0
+
+    def predict_unique(self, conditions_switches: Sequence[bool]) -> np.ndarray:
+        """
+        Compute model results for unique documents with the given subset of conditions.
+
+        :param conditions_switches: List of booleans to enable/disable specific conditions
+        :return: Boolean array with one result per unique document
+        """
+        selected = np.flatnonzero(np.asarray(conditions_switches, dtype=bool)[:self.n_conditions])
+        if self.top_level_operation == 'or':
+            return self.any_active[:, selected].any(axis=1)
+        if len(selected) == 0:
+            # all() of empty list is True, so any non empty document is accepted
+            return self.nonempty.copy()
+        return self._per_document_any(self.columns[selected].all(axis=0))
+
+    def predict(self, conditions_switches: Sequence[bool]) -> np.ndarray:
+        """
+        Compute model results for all documents with the given subset of conditions, same as cbtbc_model.run.
+
+        :param conditions_switches: List of booleans to enable/disable specific conditions
+        :return: Boolean array with one result per document
+        """
+        return self.predict_unique(conditions_switches)[self.document_index]
+
+    def weighted_errors(self, unique_predictions: np.ndarray) -> int:
+        """
+        Number of misclassified documents given results of unique documents.
+
+        :param unique_predictions: Boolean array with one result per unique document
+        :return: Number of misclassified documents
+        """
+        if self.labels is None:
+            raise Exception('activation_matrix was built without labels')
+        return int(self.weight_false[unique_predictions].sum() + self.weight_true[~unique_predictions].sum())
+
+    def errors(self, conditions_switches: Sequence[bool]) -> int:
+        """
+        Number of documents where model results differ from labels.
+
+        :param conditions_switches: List of booleans to enable/disable specific conditions
+        :return: Number of misclassified documents
+        """
+        if self.labels is None:
+            raise Exception('activation_matrix was built without labels')
+        return self.weighted_errors(self.predict_unique(conditions_switches))
+
+    def _bound_tables(self):
+        """
+        Per document tables of lower_bound, computed once: for 'and' results of the model with all conditions on,
+        for 'or' per document any of conditions i.. (column i, column n_conditions is all False).
+        """
+        tables = getattr(self, '_bound_cache', None)
+        if tables is None:
+            if self.top_level_operation == 'and':
+                tables = self.predict_unique(np.ones(self.n_conditions, dtype=bool))
+            else:
+                tables = np.zeros((self.n_unique, self.n_conditions + 1), dtype=bool)
+                tables[:, :self.n_conditions] = np.logical_or.accumulate(self.any_active[:, ::-1], axis=1)[:, ::-1]
+            self._bound_cache = tables
+        return tables
+
+    def lower_bound(self, prefix: Sequence[bool]) -> int:
+        """
+        Admissible lower bound of errors of all switch vectors starting with prefix.
+        Adding a condition can only reject more documents under 'and' and accept more documents under 'or',
+        so every completion accepts at least the documents accepted by the largest ('and') / smallest ('or') completion
+        and at most the ones accepted by the other one. Only per document activations are used, never per word ones,
+        so the bound is cheaper than errors: under 'and' the smallest completion is relaxed to documents where each
+        switched on condition of the prefix is true on some word, and the largest one to documents accepted with all conditions on.
+
+        :param prefix: Switches of the first conditions
+        :return: Lower bound of the number of misclassified documents
+        """
+        if self.labels is None:
+            raise Exception('activation_matrix was built without labels')
+        prefix = prefix[:self.n_conditions]
+        if len(prefix) == self.n_conditions:
+            return self.errors(prefix)  # The only completion
+        selected = [i for i, switch in enumerate(prefix) if switch]
+        tables = self._bound_tables()
+        if self.top_level_operation == 'and':
+            # all() of empty selection is True, so without switched on conditions any non empty document may be accepted
+            most_accepted = self.any_active[:, selected].all(axis=1) & self.nonempty if selected else self.nonempty
+            least_accepted = tables
+        else:
+            least_accepted = self.any_active[:, selected].any(axis=1)
+            most_accepted = least_accepted | tables[:, len(prefix)]
+        # Accepted by every completion and labeled False, rejected by every completion and labeled True
+        return int(self.weight_false[least_accepted].sum() + self.weight_true[~most_accepted].sum())
+
+    def incremental(self, conditions_switches: Optional[Sequence[bool]] = None):
+        """
+        Create incremental state of the model results, updated when one condition is switched on/off.
+
+        :param conditions_switches: Initial list of booleans (all conditions are off by default)
+        :return: incremental_state
+        """
+        return incremental_state(self, conditions_switches)
+
+
+class incremental_state():
+    def __init__(self, matrix: activation_matrix, conditions_switches: Optional[Sequence[bool]] = None):
+        """
+        Model results (per unique document) and number of errors for the current subset of conditions.
+        For 'and' model it keeps per word number of switched on conditions which are true,
+        for 'or' model per document number of switched on conditions which are true at least on one word.
+
+        :param matrix: activation_matrix with labels
+        :param conditions_switches: Initial list of booleans (all conditions are off by default)
+        """
+        if matrix.labels is None:
+            raise Exception('activation_matrix was built without labels')
+        self.matrix = matrix
+        if conditions_switches is None:
+            self.switches = np.zeros(matrix.n_conditions, dtype=bool)
+        else:
+            self.switches = np.array(conditions_switches, dtype=bool)[:matrix.n_conditions]
+        if matrix.top_level_operation == 'and':
+            self.counts = matrix.columns[self.switches].sum(axis=0, dtype=np.int32)
+            self.n_active = int(np.count_nonzero(self.switches))
+        else:
+            self.counts = matrix.any_active[:, self.switches].sum(axis=1, dtype=np.int32)
+        self.predictions = matrix.predict_unique(self.switches)
+        self.value = matrix.weighted_errors(self.predictions)
+
+    def flip(self, i: int) -> int:
+        """
+        Switch condition i on/off and update the number of errors.
+
+        :param i: Index of the condition
+        :return: Number of misclassified documents after the switch
+        """
+        matrix = self.matrix
+        delta = -1 if self.switches[i] else 1
+        self.switches[i] = not self.switches[i]
+        if matrix.top_level_operation == 'and':
+            self.counts += delta * matrix.columns[i]
+            self.n_active += delta
+            new_predictions = matrix._per_document_any(self.counts == self.n_active)
+            changed = np.flatnonzero(new_predictions != self.predictions)
+        else:
+            # Only documents where condition i is true can change their result
+            documents = np.flatnonzero(matrix.any_active[:, i])
+            self.counts[documents] += delta
+            new_predictions = self.predictions.copy()
+            new_predictions[documents] = self.counts[documents] > 0
+            changed = documents[new_predictions[documents] != self.predictions[documents]]
+        became_true = changed[new_predictions[changed]]
+        became_false = changed[~new_predictions[changed]]
+        self.value += int(matrix.weight_false[became_true].sum() - matrix.weight_true[became_true].sum()
+                          + matrix.weight_true[became_false].sum() - matrix.weight_false[became_false].sum())
+        self.predictions = new_predictions
+        return self.value
@@ -0,0 +1,282 @@
+'''
+Benchmarks of cbtbc
+Times preprocessing stages, model runs and training methods on synthetic corpora and writes results as JSON.
+Each result records the best of several repeats, its throughput and the speedup over the reference variant
+of the same algorithm: the original word by word check() scan of each condition for runs, and the same search
+method scoring each switch vector by check() scans of all documents for training.
+
+Usage: python benchmarks/run_benchmarks.py [--quick] [--suites stages,run,train] [--output results.json]
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_corpus  # noqa: E402
+
+
+def measure(function: Callable, repeat: int = 3) -> Dict[str, float]:
+    """
+    Run the function repeat times.
+
+    :return: Dictionary with best and mean time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'seconds': min(times), 'mean_seconds': sum(times) / len(times)}
+
+
+def result(benchmark: str, variant: str, timing: Dict[str, float], n_items: int, reference: bool = False, algorithm: Optional[str] = None, **params) -> Dict:
+    """
+    Create result record, speedups are computed between variants of the same benchmark, algorithm and parameters.
+    """
+    record = {'benchmark': benchmark, 'algorithm': algorithm or benchmark, 'variant': variant, 'reference': reference, 'n_items': n_items}
+    record.update(params)
+    record.update(timing)
+    record['items_per_second'] = n_items / timing['seconds'] if timing['seconds'] > 0 else None
+    return record
+
+
+def add_speedups(results: List[Dict]):
+    """
+    Add speedup over the reference variant of the same benchmark, algorithm and parameters
+    (None if there is no reference, e.g. it was skipped as too slow).
+    """
+    measured = ('variant', 'reference', 'seconds', 'mean_seconds', 'items_per_second', 'speedup', 'errors', 'mismatches')
+
+    def key(record):
+        return tuple(sorted((k, v) for k, v in record.items() if k not in measured))
+    references = {key(record): record['seconds'] for record in results if record['reference']}
+    for record in results:
+        reference = references.get(key(record))
+        record['speedup'] = reference / record['seconds'] if reference and record['seconds'] > 0 else None
+
+
+def reference_run_words(model, words: Sequence[str], conditions_switches: Optional[Sequence[bool]] = None) -> bool:
+    """
+    Original evaluation of the model: each word is passed through check() of each switched on condition.
+    """
+    list_of_conditions = [cond for i, cond in enumerate(model.conditions) if conditions_switches is None or conditions_switches[i]]
+    for cond in list_of_conditions:
+        cond.clean()
+    for word in words:
+        conds_results = [cond.check(word) for cond in list_of_conditions]
+        if model.top_level_operation == 'and':
+            if all(conds_results):
+                return True
+        elif model.top_level_operation == 'or':
+            if any(conds_results):
+                return True
+    return False
+
+
+class reference_objective():
+    def __init__(self, model, list_of_words: Sequence[Sequence[str]], list_of_labels: Sequence[bool]):
+        """
+        Training objective of the original implementation, each switch vector is scored by reference_run_words
+        on each document. Provides the interface of activation.activation_matrix used by cbtbc_model.search_conditions_switches.
+        """
+        self.model = model
+        self.list_of_words = list_of_words
+        self.list_of_labels = list_of_labels
+        self.n_conditions = len(model.conditions)
+
+    def predict(self, conditions_switches: Sequence[bool]) -> List[bool]:
+        return [reference_run_words(self.model, words, conditions_switches) for words in self.list_of_words]
+
+    def errors(self, conditions_switches: Sequence[bool]) -> int:
+        return sum(result != label for result, label in zip(self.predict(conditions_switches), self.list_of_labels))
+
+    def lower_bound(self, prefix: Sequence[bool]) -> int:
+        # Bound by the results of the smallest and the largest completion of the prefix
+        smallest = list(prefix) + [False] * (self.n_conditions - len(prefix))
+        largest = list(prefix) + [True] * (self.n_conditions - len(prefix))
+        a, b = self.predict(smallest), self.predict(largest)
+        least_accepted, most_accepted = (b, a) if self.model.top_level_operation == 'and' else (a, b)
+        return sum((least and not label) or (not most and label) for least, most, label in zip(least_accepted, most_accepted, self.list_of_labels))
+
+    def incremental(self, conditions_switches: Optional[Sequence[bool]] = None):
+        import cbtbc_opt
+        return cbtbc_opt.objective_state(self.errors, conditions_switches or [False] * self.n_conditions)
+
+
+def bench_stages(args) -> List[Dict]:
+    """
+    Time htmltransform stages separately on the same HTML corpus.
+    """
+    import corpus
+    import htmltransform
+    results = []
+    for n_words in args.words_per_document:
+        documents, _ = synthetic_corpus.generate_corpus(args.documents[0], words_per_document=n_words, seed=args.seed)
+        params = {'n_documents': len(documents), 'words_per_document': n_words}
+        htmltransform.warmup()
+        for backend in ('bs4', 'htmlparser', 'lxml'):
+            try:
+                htmltransform.resolve_html_backend(backend)
+            except Exception:
+                continue
+            timing = measure(lambda: [htmltransform.extract_text_from_html(html, '#', backend) for html in documents], args.repeat)
+            results.append(result('extract_text_from_html', backend, timing, len(documents), reference=(backend == 'bs4'), **params))
+        texts = [htmltransform.extract_text_from_html(html) for html in documents]
+        timing = measure(lambda: [htmltransform.word_tokenization_ext(text) for text in texts], args.repeat)
+        results.append(result('word_tokenization_ext', 'nltk', timing, len(texts), reference=True, **params))
+        tokens = [htmltransform.word_tokenization_ext(text) for text in texts]
+        timing = measure(lambda: [htmltransform.words_rule_based_replacement(list(words)) for words in tokens], args.repeat)
+        results.append(result('words_rule_based_replacement', 'list', timing, len(tokens), reference=True, **params))
+        timing = measure(lambda: [htmltransform.words_rule_based_replacement(htmltransform.word_tokenization_ext(text)) for text in texts], args.repeat)
+        results.append(result('tokenize_and_normalize', 'nltk', timing, len(texts), reference=True, **params))
+        timing = measure(lambda: [list(htmltransform.iter_regex_words(text)) for text in texts], args.repeat)
+        results.append(result('tokenize_and_normalize', 'regex', timing, len(texts), **params))
+        timing = measure(lambda: [corpus.preprocess_text(html) for html in documents], args.repeat)
+        results.append(result('preprocess_html', 'bs4_nltk', timing, len(documents), reference=True, **params))
+        timing = measure(lambda: [list(htmltransform.iter_words_from_html(html)) for html in documents], args.repeat)
+        results.append(result('preprocess_html', 'streaming', timing, len(documents), **params))
+    return results
+
+
+def bench_run(args) -> List[Dict]:
+    """
+    Time cbtbc_model.run with different evaluation paths against the original check() scan (reference_run_words)
+    after the same preprocessing. mismatches is the number of documents where the result differs from the reference.
+    """
+    import corpus
+    from cbtbc_model import cbtbc_model
+    results = []
+    variants = [('shared_automaton', {}), ('vectorized', {'vectorized': True}), ('htmlparser', {'html_backend': 'htmlparser'}),
+                ('fast_regex', {'html_backend': 'fast', 'tokenizer': 'regex'})]
+    for n_documents in args.documents:
+        documents, _ = synthetic_corpus.generate_corpus(n_documents, words_per_document=args.words_per_document[0], seed=args.seed)
+        for n_conditions in args.conditions:
+            model = cbtbc_model(synthetic_corpus.generate_conditions(n_conditions, seed=args.seed))
+            model.warmup()
+            params = {'n_documents': n_documents, 'n_conditions': n_conditions}
+            outputs = []
+
+            def run_reference():
+                outputs[:] = [reference_run_words(model, corpus.preprocess_text(html)) for html in documents]
+            timing = measure(run_reference, args.repeat)
+            expected = list(outputs)
+            results.append(dict(result('run', 'reference', timing, n_documents, reference=True, **params), mismatches=0))
+
+            def add(variant, function):
+                timing = measure(lambda: outputs.__setitem__(slice(None), function()), args.repeat)
+                mismatches = sum(a != b for a, b in zip(outputs, expected))
+                results.append(dict(result('run', variant, timing, n_documents, **params), mismatches=mismatches))
+            for variant, kwargs in variants:
+                add(variant, lambda: [model.run(html, **kwargs) for html in documents])
+            cache = corpus.preprocessed_corpus(maxsize=None)
+            cache.get_many(documents)
+            add('corpus_cache', lambda: [model.run(html, corpus_cache=cache) for html in documents])
+            add(f'run_many_{args.jobs}_jobs', lambda: model.run_many(documents, n_jobs=args.jobs))
+    return results
+
+
+def bench_train(args) -> List[Dict]:
+    """
+    Time training methods as the number of conditions and documents grows. Each method is timed on the activation matrix
+    and, as its reference, with the same search scoring switch vectors by reference_objective (skipped if 2**n_conditions
+    * n_documents exceeds --max-reference-evaluations). Random methods are seeded identically, so errors of both are equal.
+    Documents are preprocessed once per corpus, so training time excludes parsing.
+    """
+    import corpus
+    import cbtbc_model as cbtbc_model_module
+    from cbtbc_model import cbtbc_model
+    results = []
+    for n_documents in args.documents:
+        documents, labels = synthetic_corpus.generate_corpus(n_documents, words_per_document=args.words_per_document[0], seed=args.seed)
+        cache = corpus.preprocessed_corpus(maxsize=None)
+        list_of_words = cache.get_many(documents)
+        for n_conditions in args.conditions:
+            params = {'n_documents': n_documents, 'n_conditions': n_conditions}
+            for method in args.methods:
+                if method.startswith('bruteforce') and n_conditions > args.max_bruteforce_conditions:
+                    continue
+                model = cbtbc_model(synthetic_corpus.generate_conditions(n_conditions, seed=args.seed))
+                errors = []
+
+                def train_reference():
+                    random.seed(args.seed)
+                    objective = reference_objective(model, list_of_words, labels)
+                    errors.append(cbtbc_model_module.search_conditions_switches(objective, method, n_iter=args.n_iter)[0])
+
+                def train():
+                    random.seed(args.seed)
+                    errors.append(model.train_minimize_number_of_conditions(documents, labels, method=method, n_iter=args.n_iter, corpus_cache=cache)[0])
+                variants = [('activation_matrix', train, False)]
+                if 2 ** n_conditions * n_documents <= args.max_reference_evaluations:
+                    variants.insert(0, ('reference', train_reference, True))
+                for variant, function, reference in variants:
+                    errors.clear()
+                    timing = measure(function, args.repeat)
+                    results.append(dict(result('train', variant, timing, n_documents, reference=reference, algorithm=method, **params), errors=min(errors)))
+    return results
+
+
+SUITES = {'stages': bench_stages, 'run': bench_run, 'train': bench_train}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of cbtbc on synthetic corpora')
+    parser.add_argument('--suites', default='stages,run,train', help='Comma separated list of suites: ' + ', '.join(SUITES))
+    parser.add_argument('--documents', default='200,1000', help='Comma separated numbers of documents')
+    parser.add_argument('--conditions', default='4,8,12', help='Comma separated numbers of conditions')
+    parser.add_argument('--words-per-document', default='200,2000', help='Comma separated average document lengths')
+    parser.add_argument('--methods', default='bruteforce,bruteforce_gray,bnb,random_bnb,random,anneal', help='Comma separated training methods')
+    parser.add_argument('--max-bruteforce-conditions', type=int, default=16)
+    parser.add_argument('--max-reference-evaluations', type=int, default=200000,
+                        help='Reference training is timed only if 2**conditions * documents does not exceed it')
+    parser.add_argument('--n-iter', type=int, default=100, help='n_iter of random training methods')
+    parser.add_argument('--jobs', type=int, default=2, help='Number of processes of run_many')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quick', action='store_true', help='Small corpora and one repeat (smoke run)')
+    parser.add_argument('--output', default='-', help='Output JSON file, - for stdout')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.documents, args.conditions, args.words_per_document, args.repeat = '20', '4', '100', 1
+        args.n_iter = min(args.n_iter, 10)
+    args.suites = [suite for suite in args.suites.split(',') if suite]
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error(f'Unknown suite {suite}')
+    args.documents = [int(value) for value in str(args.documents).split(',')]
+    args.conditions = [int(value) for value in str(args.conditions).split(',')]
+    args.words_per_document = [int(value) for value in str(args.words_per_document).split(',')]
+    args.methods = [method for method in args.methods.split(',') if method]
+    return args
+
+
+def run_benchmarks(args) -> Dict:
+    import numpy as np
+    results = []
+    for suite in args.suites:
+        results.extend(SUITES[suite](args))
+    add_speedups(results)
+    return {'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': {k: v for k, v in vars(args).items() if k != 'output'}},
+            'results': results}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = json.dumps(run_benchmarks(args), indent=2)
+    if args.output == '-':
+        print(report)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
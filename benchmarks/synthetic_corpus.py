@@ -0,0 +1,153 @@
+'''
+Synthetic corpus generator for benchmarks
+Documents are random sentences over a fixed vocabulary with controllable length, density of numbers,
+frequency of keywords and balance of labels. Positive documents contain a keyword followed by a percent
+within a few words, negative documents never do. The same seed always produces the same corpus.
+'''
+
+import random
+from typing import List, Optional, Sequence, Tuple
+
+VOCABULARY = ['the', 'of', 'and', 'to', 'in', 'is', 'was', 'for', 'on', 'that', 'with', 'as', 'by', 'at', 'from',
+              'market', 'report', 'company', 'year', 'quarter', 'growth', 'sales', 'customers', 'service', 'product',
+              'city', 'river', 'forest', 'election', 'vote', 'policy', 'team', 'season', 'game', 'weather', 'night']
+KEYWORDS = ['rates', 'interest', 'inflation', 'discount', 'tax', 'yield', 'margin', 'share']
+SIGNAL_DISTANCE = 3
+
+
+def random_number(rnd: random.Random, percent_fraction: float) -> str:
+    number = f'{rnd.uniform(0, 100):.{rnd.choice([0, 1, 2])}f}'
+    if rnd.random() < percent_fraction:
+        return number + rnd.choice(['%', ' %'])
+    return number
+
+
+def generate_words(rnd: random.Random, n_words: int, number_density: float, keyword_frequency: float,
+                   percent_fraction: float, keywords: Sequence[str], positive: bool) -> List[str]:
+    """
+    Generate words of one document.
+
+    :param rnd: Random generator
+    :param n_words: Number of words
+    :param number_density: Probability of a word to be a number
+    :param keyword_frequency: Probability of a word to be a keyword
+    :param percent_fraction: Probability of a number to be a percent
+    :param keywords: Keywords
+    :param positive: If True, the document contains a keyword followed by a percent,
+                     otherwise percents are never within SIGNAL_DISTANCE words from keywords
+    :return: List of words (percents may be written as two words)
+    """
+    words = []
+    last_keyword = last_percent = -2 * SIGNAL_DISTANCE
+    for position in range(n_words):
+        value = rnd.random()
+        if value < keyword_frequency and (positive or position - last_percent > SIGNAL_DISTANCE + 1):
+            words.append(rnd.choice(keywords))
+            last_keyword = position
+        elif value < keyword_frequency + number_density:
+            number = random_number(rnd, percent_fraction)
+            if number.endswith('%'):
+                if not positive and position - last_keyword <= SIGNAL_DISTANCE + 1:
+                    number = number.rstrip(' %')
+                else:
+                    last_percent = position
+            words.append(number)
+        else:
+            words.append(rnd.choice(VOCABULARY))
+    if positive:
+        position = rnd.randrange(len(words) + 1)
+        words[position:position] = [rnd.choice(keywords), random_number(rnd, 1.0)]
+    return words
+
+
+def to_html(rnd: random.Random, words: List[str]) -> str:
+    """
+    Wrap words into HTML: paragraphs, inline tags, entities, comments and script/style noise.
+    """
+    parts = ['<html><head><title>Report</title><style>p { margin: 0 }</style></head><body>']
+    position = 0
+    while position < len(words):
+        length = rnd.randint(5, 25)
+        sentence = []
+        for word in words[position:position + length]:
+            value = rnd.random()
+            if value < 0.05:
+                word = f'<b>{word}</b>'
+            elif value < 0.07:
+                word = f'<a href="#x">{word}</a>'
+            elif value < 0.08:
+                word = word + ' &amp;'
+            sentence.append(word)
+        parts.append('<p>' + ' '.join(sentence).capitalize() + '</p>')
+        if rnd.random() < 0.1:
+            parts.append('<!-- comment --><script>var x = "1.5 %";</script>')
+        position += length
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def to_text(words: List[str]) -> str:
+    """
+    Join words into plain text sentences.
+    """
+    sentences = []
+    for start in range(0, len(words), 15):
+        sentences.append(' '.join(words[start:start + 15]).capitalize() + '.')
+    return ' '.join(sentences)
+
+
+def generate_corpus(n_documents: int, words_per_document: int = 200, number_density: float = 0.05, keyword_frequency: float = 0.01,
+                    percent_fraction: float = 0.3, positive_fraction: float = 0.5, ishtml: bool = True,
+                    keywords: Optional[Sequence[str]] = None, seed: int = 0) -> Tuple[List[str], List[bool]]:
+    """
+    Generate labeled synthetic corpus.
+
+    :param n_documents: Number of documents
+    :param words_per_document: Average number of words of a document (actual length is within +-50%)
+    :param number_density: Probability of a word to be a number
+    :param keyword_frequency: Probability of a word to be a keyword
+    :param percent_fraction: Probability of a number to be a percent
+    :param positive_fraction: Fraction of documents labeled True
+    :param ishtml: If True, documents are HTML, otherwise plain text
+    :param keywords: Keywords (KEYWORDS by default)
+    :param seed: Random seed
+    :return: Tuple of list of documents and list of labels
+    """
+    rnd = random.Random(seed)
+    keywords = list(keywords or KEYWORDS)
+    documents = []
+    labels = []
+    for _ in range(n_documents):
+        positive = rnd.random() < positive_fraction
+        n_words = max(1, int(words_per_document * rnd.uniform(0.5, 1.5)))
+        words = generate_words(rnd, n_words, number_density, keyword_frequency, percent_fraction, keywords, positive)
+        documents.append(to_html(rnd, words) if ishtml else to_text(words))
+        labels.append(positive)
+    return documents, labels
+
+
+def generate_conditions(n_conditions: int, keywords: Optional[Sequence[str]] = None, seed: int = 0) -> List[object]:
+    """
+    Generate a pool of candidate conditions over the corpus keywords.
+
+    :param n_conditions: Number of conditions
+    :param keywords: Keywords (KEYWORDS by default)
+    :param seed: Random seed
+    :return: List of condition objects
+    """
+    import conditions
+    rnd = random.Random(seed)
+    keywords = list(keywords or KEYWORDS)
+    result = []
+    for i in range(n_conditions):
+        n_words = rnd.randint(1, 2 * SIGNAL_DISTANCE)
+        kind = i % 4
+        if kind == 0:
+            result.append(conditions.condition_floatpercent_in_last_n_words({'n_words': n_words}))
+        elif kind == 1:
+            result.append(conditions.condition_keywords_in_last_n_words({'n_words': n_words, 'keywords': rnd.sample(keywords, rnd.randint(1, len(keywords)))}))
+        elif kind == 2:
+            result.append(conditions.condition_float_in_last_n_words({'n_words': n_words}))
+        else:
+            result.append(conditions.condition_floatorpercent_in_last_n_words({'n_words': n_words}))
+    return result
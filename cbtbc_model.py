@@ -3,12 +3,78 @@ Conditions based text binnary classification model
 '''
 
 import conditions
+import corpus
 import htmltransform
-from nltk.tokenize import word_tokenize
-import cbtbc_opt
+import activation
+import model_format
+import instrumentation
+import prediction_cache
+import token_corpus
+import worker_pool
+import time
+import numpy as np
 import pickle
-from typing import List, Dict, Union, Optional  # Importing specific types from typing module for type hinting
-from tqdm import tqdm  # Importing tqdm module for progress bar
+import functools
+import multiprocessing
+from typing import Iterable, List, Dict, Union, Optional  # Importing specific types from typing module for type hinting
+
+
+def _run_many_worker(intext, conditions_switches, ishtml):
+    return worker_pool.worker_object('cbtbc_model.run_many').run(intext, conditions_switches, ishtml)
+
+
+def search_conditions_switches(matrix: activation.activation_matrix, method: str = 'bruteforce', n_iter=100, trueprob=0.5, verbose: int = 0, n_jobs: Optional[int] = 1,
+                               max_nodes: Optional[int] = None, max_time: Optional[float] = None, count_evaluations: bool = False):
+    """
+    Find switches of the conditions minimizing the number of errors on the activation matrix,
+    see cbtbc_model.train_minimize_number_of_conditions for the description of the methods and parameters.
+
+    :param matrix: activation.activation_matrix with labels
+    :param count_evaluations: If True, count evaluations of the objective function of 'bnb', 'random_bnb' and 'random' methods
+    :return: Tuple of minimum number of differences, best condition switchers, number of evaluations
+             and statistics of the search method
+    """
+    import cbtbc_opt  # Optimization methods are needed only for training
+    objective_function = matrix.errors
+    evaluations = [2 ** matrix.n_conditions]  # Bruteforce methods evaluate each switch vector once
+    search_stats = {}
+    if count_evaluations and method in ('random_bnb', 'bnb', 'random'):
+        evaluations = [0]
+
+        def objective_function(conditions_switches):
+            evaluations[0] += 1
+            return matrix.errors(conditions_switches)
+
+    if method == 'bruteforce':
+        # Bruteforce method
+        # All possible combinations of conditions, sharded between n_jobs processes
+        best_conditions_switchers, min_number_of_differences = cbtbc_opt.binary_vector_bruteforce_search(matrix.n_conditions, objective_function, n_jobs=n_jobs, verbose=verbose)
+    elif method == 'bruteforce_gray':
+        # Bruteforce method with switch vectors enumerated in Gray code order,
+        # each step switches one condition and the number of errors is updated incrementally
+        best_conditions_switchers, min_number_of_differences = cbtbc_opt.binary_vector_gray_code_search(matrix.n_conditions, matrix.incremental, n_jobs=n_jobs, verbose=verbose)
+    elif method == 'random_bnb':
+        opt_res = cbtbc_opt.binary_vector_bnb_random_search(matrix.n_conditions, objective_function, n_iter=n_iter, bnb_method=True, random_search_method=True, trueprob=trueprob, verbose=verbose,
+                                                            bound_function=matrix.lower_bound, max_nodes=max_nodes, max_time=max_time, stats=search_stats)
+        best_conditions_switchers = opt_res[0]
+        min_number_of_differences = opt_res[1]
+    elif method == 'bnb':
+        opt_res = cbtbc_opt.binary_vector_bnb_random_search(matrix.n_conditions, objective_function, n_iter=1, bnb_method=True, random_search_method=False, verbose=verbose,
+                                                            bound_function=matrix.lower_bound, max_nodes=max_nodes, max_time=max_time, stats=search_stats)
+        best_conditions_switchers = opt_res[0]
+        min_number_of_differences = opt_res[1]
+    elif method == 'anneal':
+        # Simulated annealing by single condition flips, errors are updated incrementally
+        best_conditions_switchers, min_number_of_differences = cbtbc_opt.binary_vector_anneal_search(matrix.n_conditions, state_factory=matrix.incremental, n_iter=n_iter, max_time=max_time, trueprob=trueprob, verbose=verbose, stats=search_stats)
+        evaluations = [search_stats['evaluations']]
+    elif method == 'random':
+        opt_res = cbtbc_opt.binary_vector_bnb_random_search(matrix.n_conditions, objective_function, n_iter=n_iter, bnb_method=False, random_search_method=True, verbose=verbose, stats=search_stats)
+        best_conditions_switchers = opt_res[0]
+        min_number_of_differences = opt_res[1]
+    else:
+        raise Exception(f'Unknown method {method} for training')
+    return min_number_of_differences, best_conditions_switchers, evaluations[0], search_stats
+
 
 class cbtbc_model():
     def __init__(self, conditions_list: Optional[List[Union[str, object]]] = None, condition_params: Optional[List[Dict]] = None):
@@ -19,6 +85,15 @@ class cbtbc_model():
         :param condition_params: List of dictionaries containing parameters for each condition
         """
         self.top_level_operation = 'and'  # Setting default top-level operation to 'and'
+        self._compiled_keywords = None  # Shared automaton of keyword conditions, see compile_keywords
+        self._compiled_keywords_conditions = None
+        self.html_backend = 'bs4'  # HTML parsing backend, see htmltransform.HTML_BACKENDS
+        self.tokenizer = 'nltk'  # Tokenizer, see htmltransform.TOKENIZERS
+        self.conditions_switches = None  # Switches used when run is called without conditions_switches
+        self.instrumentation = None  # instrumentation.model_stats if instrumentation is enabled
+        self.prediction_cache = None  # prediction_cache.prediction_cache if caching of predictions is enabled
+        self._fingerprint = None  # Fingerprint of conditions, see fingerprint
+        self._fingerprint_conditions = None
         if conditions_list is None:
             self.conditions = conditions_list  # Assigning conditions list if provided
         else:
@@ -38,31 +113,114 @@ class cbtbc_model():
                 else:
                     raise TypeError(f'conditions must be list of strings or list of conditions.condition_base, got {type(cond)}')
 
-    def run(self, intext, conditions_switches: Optional[List[bool]] = None,ishtml:bool = True):
+    def run(self, intext, conditions_switches: Optional[List[bool]] = None,ishtml:bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None, vectorized: bool = False, html_backend: Optional[str] = None, tokenizer: Optional[str] = None):
         """
         Run the model on the provided HTML and return True if the conditions are met.
 
-        :param intext: plain text\HTML string to be processed
+        :param intext: plain text/HTML string to be processed
         :param conditions_switches: Optional list of booleans to enable/disable specific conditions
+                                    (conditions_switches of the model by default)
+        :param ishtml: If True, intext is HTML
+        :param corpus_cache: Optional preprocessed corpus, words of intext are taken from it instead of re-parsing
+        :param vectorized: If True, evaluate conditions on the whole list of words with numpy kernels
+        :param html_backend: HTML parsing backend (see htmltransform.HTML_BACKENDS), html_backend of the model by default
+        :param tokenizer: Tokenizer (see htmltransform.TOKENIZERS), tokenizer of the model by default
         :return: Boolean indicating if the conditions are met
         """
         if self.conditions is None:
             return False
-        for cond in self.conditions:
-            cond.clean()
-        if ishtml:
-            text = htmltransform.extract_text_from_html(intext, tag_text_sep="#")
-            words = htmltransform.word_tokenization_ext(text)
-            words = htmltransform.words_rule_based_replacement(words)
+        if html_backend is None:
+            html_backend = self.html_backend
+        if tokenizer is None:
+            tokenizer = self.tokenizer
+        cache = self.prediction_cache
+        if cache is not None:
+            key = prediction_cache.prediction_key(intext, ishtml, self.conditions_switches if conditions_switches is None else conditions_switches,
+                                                  len(self.conditions), self.fingerprint(), html_backend, tokenizer)
+            result = cache.get(key)
+            if result is not None:
+                return result
+        stats = self.instrumentation
+        if stats is not None:
+            stats.start_run()
+        if corpus_cache is not None:
+            words = corpus_cache.get_words(intext, ishtml, html_backend, tokenizer, stats)
         else:
-            words = word_tokenize(intext)
+            words = corpus.preprocess_text(intext, ishtml, html_backend, tokenizer, stats)
+        result = self.run_words(words, conditions_switches, vectorized)
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    def run_stream(self, source, conditions_switches: Optional[List[bool]] = None, ishtml: bool = True, block_size: int = 1 << 14):
+        """
+        Run the model on a stream of text and stop reading as soon as the conditions are met.
+        For HTML, memory usage is bounded by block_size and the largest text node, not by the size of the document:
+        sentences longer than block_size (e.g. text of tables without punctuation) are cut between tags.
+        For plain text, it is bounded by block_size and the longest sentence.
+
+        :param source: plain text/HTML string, file object or iterable of str/bytes chunks
+        :param conditions_switches: Optional list of booleans to enable/disable specific conditions
+        :param ishtml: If True, source is HTML
+        :param block_size: Minimal size of the text buffer split into sentences at once
+        :return: Boolean indicating if the conditions are met
+        """
+        if self.conditions is None:
+            return False
+        words = corpus.iter_preprocess_text(source, ishtml, block_size)
+        try:
+            return self.run_words(words, conditions_switches)
+        finally:
+            words.close()
+
+    def run_words(self, words, conditions_switches: Optional[List[bool]] = None, vectorized: bool = False):
+        """
+        Run the model on already preprocessed list of words and return True if the conditions are met.
 
+        :param words: Iterable of words (as produced by corpus.preprocess_text)
+        :param conditions_switches: Optional list of booleans to enable/disable specific conditions
+                                    (conditions_switches of the model by default)
+        :param vectorized: If True, evaluate conditions on the whole list of words with numpy kernels
+                           (no early exit, but each distinct word is classified only once),
+                           ignored if instrumentation is enabled
+        :return: Boolean indicating if the conditions are met
+        """
+        if self.conditions is None:
+            return False
+        if conditions_switches is None:
+            conditions_switches = self.conditions_switches
+        # Scan state of the conditions lives in per call scan states, so the model may be shared by threads
+        if self.instrumentation is not None:
+            return self._run_words_instrumented(words, conditions_switches)
         if conditions_switches is not None:
             list_of_conditions = [cond for cond, switch in zip(self.conditions, conditions_switches) if switch]
         else:
             list_of_conditions = self.conditions
+        automaton = self.compile_keywords()
+        if vectorized:
+            words = list(words)
+            if not words:
+                return False
+            return self._run_classes(conditions.token_classes(words), conditions_switches, automaton)
+        if automaton is None:
+            scans = [cond.scan() for cond in list_of_conditions]
+            for word in words:
+                conds_results = [scan.check(word) for scan in scans]
+                if self.top_level_operation == 'and':
+                    if all(conds_results):
+                        return True
+                elif self.top_level_operation == 'or':
+                    if any(conds_results):
+                        return True
+            return False
+        # Each word is looked up once in the shared automaton, keyword conditions are updated with its result
+        keyword_ids = set(automaton.ids)
+        plan = [(i, cond.scan(), i in keyword_ids) for i, cond in enumerate(self.conditions)
+                if conditions_switches is None or (i < len(conditions_switches) and conditions_switches[i])]
+        state = 0
         for word in words:
-            conds_results = [cond.check(word) for cond in list_of_conditions]
+            state, triggered = automaton.step(state, word)
+            conds_results = [scan.update(i in triggered) if is_keyword else scan.check(word) for i, scan, is_keyword in plan]
             if self.top_level_operation == 'and':
                 if all(conds_results):
                     return True
@@ -71,68 +229,259 @@ class cbtbc_model():
                     return True
         return False
 
-    def train_minimize_number_of_conditions(self, list_of_htmls: List[str], list_of_labels: List[bool], method: str = 'bruteforce', verbose: int = 0, n_iter=100, trueprob=0.5):
+    def run_tokens(self, tokens: token_corpus.token_corpus, index: int, conditions_switches: Optional[List[bool]] = None):
+        """
+        Run the model on a document of the interned token corpus, conditions are evaluated on token ids.
+
+        :param tokens: token_corpus.token_corpus
+        :param index: Index of the document
+        :param conditions_switches: Optional list of booleans to enable/disable specific conditions
+                                    (conditions_switches of the model by default)
+        :return: Boolean indicating if the conditions are met
+        """
+        if self.conditions is None:
+            return False
+        if conditions_switches is None:
+            conditions_switches = self.conditions_switches
+        classes = tokens.token_classes(index)
+        if not len(classes.ids):
+            return False
+        return self._run_classes(classes, conditions_switches, self.compile_keywords())
+
+    def _run_classes(self, classes, conditions_switches, automaton):
+        if conditions_switches is not None:
+            selected = [i for i, switch in zip(range(len(self.conditions)), conditions_switches) if switch]
+        else:
+            selected = range(len(self.conditions))
+        results = conditions.check_words_all(self.conditions, None, automaton, selected, classes)
+        if self.top_level_operation == 'and':
+            return bool(np.logical_and.reduce(results, axis=0).any()) if results else True
+        elif self.top_level_operation == 'or':
+            return bool(np.logical_or.reduce(results, axis=0).any()) if results else False
+        return False
+
+    def _run_words_instrumented(self, words, conditions_switches: Optional[List[bool]] = None):
+        """
+        Word by word evaluation of run_words which counts hits and triggers of each condition.
+        """
+        stats = self.instrumentation
+        start = time.perf_counter()
+        automaton = self.compile_keywords()
+        keyword_ids = set(automaton.ids) if automaton is not None else set()
+        plan = [(i, cond.scan(), i in keyword_ids) for i, cond in enumerate(self.conditions)
+                if conditions_switches is None or (i < len(conditions_switches) and conditions_switches[i])]
+        hits = [0] * len(self.conditions)
+        triggers = [0] * len(self.conditions)
+        state = 0
+        triggered = ()
+        words_scanned = 0
+        early_exit_position = None
+        for position, word in enumerate(words):
+            words_scanned += 1
+            if automaton is not None:
+                state, triggered = automaton.step(state, word)
+            conds_results = []
+            for i, scan, is_keyword in plan:
+                result = scan.update(i in triggered) if is_keyword else scan.check(word)
+                conds_results.append(result)
+                hits[i] += result
+                triggers[i] += instrumentation.condition_triggered(scan)
+            if (self.top_level_operation == 'and' and all(conds_results)) or (self.top_level_operation == 'or' and any(conds_results)):
+                early_exit_position = position
+                break
+        stats.add_stage('condition_scan', time.perf_counter() - start)
+        stats.add_scan(hits, triggers, words_scanned, early_exit_position)
+        return early_exit_position is not None
+
+    def enable_instrumentation(self, callback=None):
+        """
+        Start collecting statistics of runs and trainings: time and number of calls of pipeline stages,
+        per condition hits and triggers, early exit positions, objective evaluations per second
+        and branch-and-bound pruning ratio. Runs of run_many in worker processes are not collected.
+
+        :param callback: Optional function called with the record of each run and training
+        :return: instrumentation.model_stats
+        """
+        self.instrumentation = instrumentation.model_stats(callback)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        """
+        Stop collecting statistics.
+        """
+        self.instrumentation = None
+
+    def get_stats(self):
+        """
+        Return statistics collected since instrumentation was enabled.
+
+        :return: Dictionary (see instrumentation.model_stats.as_dict) or None if instrumentation is disabled
+        """
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.as_dict()
+
+    def __getstate__(self):
+        # Statistics and their callback stay in the current process
+        state = dict(self.__dict__)
+        state['instrumentation'] = None
+        return state
+
+    def enable_prediction_cache(self, maxsize: Optional[int] = 10000, path: Optional[str] = None):
+        """
+        Start caching results of run. Predictions are keyed by the document, ishtml, the conditions switches
+        and the fingerprint of the model, so changing conditions or top level operation invalidates them.
+        Worker processes of run_many get their own copy of the in-memory cache and share the sqlite file.
+
+        :param maxsize: Maximal number of predictions kept in memory, None for unbounded cache
+        :param path: Optional sqlite file where predictions are persisted
+        :return: prediction_cache.prediction_cache
+        """
+        self.prediction_cache = prediction_cache.prediction_cache(maxsize, path)
+        return self.prediction_cache
+
+    def disable_prediction_cache(self):
+        """
+        Stop caching results of run.
+        """
+        if self.prediction_cache is not None:
+            self.prediction_cache.close()
+        self.prediction_cache = None
+
+    def fingerprint(self) -> bytes:
+        """
+        Return the fingerprint of the model (see prediction_cache.model_fingerprint), it is cached until conditions change.
+
+        :return: Digest of conditions and top level operation
+        """
+        compiled = self._fingerprint_conditions
+        current = (self.top_level_operation,) + tuple(self.conditions or ())
+        if compiled is None or len(compiled) != len(current) or compiled[0] != current[0] or any(a is not b for a, b in zip(compiled[1:], current[1:])):
+            self._fingerprint = prediction_cache.model_fingerprint(self.conditions, self.top_level_operation)
+            self._fingerprint_conditions = current
+        return self._fingerprint
+
+    def compile_keywords(self):
+        """
+        Compile keywords of all keyword conditions into one shared automaton, it is cached until conditions change.
+
+        :return: keywords.keyword_automaton or None if the model has no keyword conditions
+        """
+        if self.conditions is None:
+            return None
+        compiled = self._compiled_keywords_conditions
+        if compiled is None or len(compiled) != len(self.conditions) or any(a is not b for a, b in zip(compiled, self.conditions)):
+            self._compiled_keywords = conditions.compile_keyword_conditions(self.conditions)
+            self._compiled_keywords_conditions = tuple(self.conditions)
+        return self._compiled_keywords
+
+    def warmup(self, ishtml: bool = True):
+        """
+        Load everything the model needs to process documents: parsing libraries, tokenizer resources
+        and compiled keywords. Calling it before forking worker processes lets them share the loaded data.
+
+        :param ishtml: If True, prepare processing of HTML documents
+        """
+        if ishtml:
+            htmltransform.warmup(self.html_backend, self.tokenizer)
+        elif self.tokenizer == 'nltk':
+            htmltransform.word_tokenize('Warm up.')
+        self.compile_keywords()
+
+    def run_many(self, list_of_texts: Iterable[str], conditions_switches: Optional[List[bool]] = None, ishtml: bool = True, n_jobs: Optional[int] = None, chunksize: int = 64, verbose: int = 0) -> List[bool]:
+        """
+        Run the model on many documents using a pool of processes.
+
+        :param list_of_texts: Iterable of plain text/HTML strings, consumed lazily
+        :param conditions_switches: Optional list of booleans to enable/disable specific conditions
+        :param ishtml: If True, documents are HTML
+        :param n_jobs: Number of worker processes (None - number of CPUs, 1 - run in the current process)
+        :param chunksize: Number of documents sent to a worker at once
+        :param verbose: Verbosity level (1: progress bar)
+        :return: List of results in the order of documents
+        """
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        if n_jobs < 1:
+            raise Exception(f'n_jobs must be positive, got {n_jobs}')
+        from tqdm import tqdm  # Importing tqdm module for progress bar
+        total = len(list_of_texts) if hasattr(list_of_texts, '__len__') else None
+        progress = functools.partial(tqdm, total=total, disable=(verbose != 1), desc='cbtbc model. Run')
+        if n_jobs == 1:
+            return [self.run(intext, conditions_switches, ishtml) for intext in progress(list_of_texts)]
+        # Forked workers inherit loaded parsers and tokenizer data
+        self.warmup(ishtml)
+        worker = functools.partial(_run_many_worker, conditions_switches=conditions_switches, ishtml=ishtml)
+        with worker_pool.pool(n_jobs, 'cbtbc_model.run_many', self) as pool:
+            return list(progress(pool.imap(worker, list_of_texts, chunksize=chunksize)))
+
+    def train_minimize_number_of_conditions(self, list_of_htmls: List[str], list_of_labels: List[bool], method: str = 'bruteforce', verbose: int = 0, n_iter=100, trueprob=0.5, ishtml: bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None, n_jobs: Optional[int] = 1, deduplicate: bool = True, max_nodes: Optional[int] = None, max_time: Optional[float] = None):
         """
         Train the model to minimize the number of conditions using the specified method.
 
-        :param list_of_htmls: List of HTML strings for training
+        :param list_of_htmls: List of HTML strings for training or token_corpus.token_corpus of preprocessed documents
         :param list_of_labels: Corresponding list of labels (True/False) for each HTML string
-        :param method: Training method to use ('bruteforce', 'random_bnb', 'bnb', 'random')
+        :param method: Training method to use ('bruteforce', 'bruteforce_gray', 'random_bnb', 'bnb', 'random', 'anneal')
         :param verbose: Verbosity level for training output
-        :param n_iter: Number of iterations for random search methods
+        :param n_iter: Number of iterations for random search methods (number of proposed flips for 'anneal')
         :param trueprob: Probability for random search methods
+        :param ishtml: If True, list_of_htmls contains HTML strings, otherwise plain texts
+        :param corpus_cache: Optional preprocessed corpus used to take words of the documents from,
+                             by default each document is preprocessed once for the whole training
+        :param n_jobs: Number of processes used by the 'bruteforce' and 'bruteforce_gray' methods (None - number of CPUs)
+        :param deduplicate: If True, documents with identical words are scored once and counted with their number of copies
+        :param max_nodes: Optional maximal number of expanded nodes of each branch-and-bound run ('bnb', 'random_bnb')
+        :param max_time: Optional maximal time in seconds of each branch-and-bound run ('bnb', 'random_bnb') or of 'anneal' search
         :return: Tuple of minimum number of differences and best condition switchers
         """
         if len(list_of_htmls) != len(list_of_labels):
             raise Exception('Length of list_of_htmls and list_of_labels must be equal')
-
-        minimum_number_of_conditions = len(self.conditions)
-        best_conditions_switchers = [True for cond in self.conditions]
-        if method == 'bruteforce':
-            # Bruteforce method
-            # Create all possible combinations of conditions
-            bruteforce_results = []
-            for i in tqdm(range(0, 2**len(self.conditions)), disable=(verbose != 1), desc=f'cbtbc model. Training. Method:{method}'):
-                # Create bool list with length len(self.conditions_list) with 2-base representation of i
-                cond_switchers = [bool(int(digit)) for digit in bin(i)[2:].zfill(len(self.conditions))]
-                current_conditions_results = [self.run(html, cond_switchers) for html in list_of_htmls]
-                bruteforce_results.append(sum([int(current_conditions_results[j] != list_of_labels[j]) for j in range(len(list_of_labels))]))
-
-            min_number_of_differences = min(bruteforce_results)
-            # List of indexes of conditions with minimum number of differences
-            min_number_of_differences_indexes = [i for i in range(len(bruteforce_results)) if bruteforce_results[i] == min_number_of_differences]
-            for i in min_number_of_differences_indexes:
-                # Compute sum of 1 in binary representation of i
-                number_of_conditions = sum([int(digit) for digit in bin(i)[2:].zfill(len(self.conditions))])
-
-                if number_of_conditions < minimum_number_of_conditions:
-                    minimum_number_of_conditions = number_of_conditions
-                    best_conditions_switchers = [bool(int(digit)) for digit in bin(i)[2:].zfill(len(self.conditions))]
-        elif method == 'random_bnb':
-            def bnb_random_objective_function(x):
-                current_conditions_results = [self.run(html, x) for html in list_of_htmls]
-                return sum([int(current_conditions_results[j] != list_of_labels[j]) for j in range(len(list_of_labels))])
-            opt_res = cbtbc_opt.binary_vector_bnb_random_search(len(self.conditions), bnb_random_objective_function, n_iter=n_iter, bnb_method=True, random_search_method=True, trueprob=trueprob, verbose=verbose)
-            best_conditions_switchers = opt_res[0]
-            min_number_of_differences = opt_res[1]
-        elif method == 'bnb':
-            def bnb_random_objective_function(x):
-                current_conditions_results = [self.run(html, x) for html in list_of_htmls]
-                return sum([int(current_conditions_results[j] != list_of_labels[j]) for j in range(len(list_of_labels))])
-            opt_res = cbtbc_opt.binary_vector_bnb_random_search(len(self.conditions), bnb_random_objective_function, n_iter=1, bnb_method=True, random_search_method=False, verbose=verbose)
-            best_conditions_switchers = opt_res[0]
-            min_number_of_differences = opt_res[1]
-        elif method == 'random':
-            def bnb_random_objective_function(x):
-                current_conditions_results = [self.run(html, x) for html in list_of_htmls]
-                return sum([int(current_conditions_results[j] != list_of_labels[j]) for j in range(len(list_of_labels))])
-            opt_res = cbtbc_opt.binary_vector_bnb_random_search(len(self.conditions), bnb_random_objective_function, n_iter=n_iter, bnb_method=False, random_search_method=True, verbose=verbose)
-            best_conditions_switchers = opt_res[0]
-            min_number_of_differences = opt_res[1]
+        stats = self.instrumentation
+        stage_start = time.perf_counter()
+        if isinstance(list_of_htmls, token_corpus.token_corpus):
+            list_of_words = list_of_htmls  # Already preprocessed, conditions are evaluated on token ids
         else:
-            raise Exception(f'Unknown method {method} for training')
+            if corpus_cache is None:
+                corpus_cache = corpus.preprocessed_corpus(maxsize=max(len(list_of_htmls), 1))
+            list_of_words = corpus_cache.get_many(list_of_htmls, ishtml, self.html_backend, self.tokenizer)
+        if stats is not None:
+            stats.add_stage('training_preprocessing', time.perf_counter() - stage_start)
+            stage_start = time.perf_counter()
+        # Each condition is passed through each document once, subsets of conditions are scored on the matrix
+        matrix = activation.activation_matrix.from_model(self, list_of_words, list_of_labels, deduplicate)
+        if stats is not None:
+            stats.add_stage('activation_matrix', time.perf_counter() - stage_start)
+            stage_start = time.perf_counter()
+        min_number_of_differences, best_conditions_switchers, evaluations, search_stats = search_conditions_switches(
+            matrix, method, n_iter, trueprob, verbose, n_jobs, max_nodes, max_time, count_evaluations=(stats is not None))
+        if stats is not None:
+            search_seconds = time.perf_counter() - stage_start
+            stats.add_stage('search', search_seconds)
+            record = {key: value for key, value in search_stats.items() if key != 'time'}
+            if method == 'random':
+                record = {}  # Branch-and-bound statistics are not collected without branch-and-bound
+            record.update({'method': method, 'n_conditions': len(self.conditions), 'n_documents': len(list_of_htmls),
+                           'n_unique_documents': matrix.n_unique, 'evaluations': evaluations, 'search_seconds': search_seconds,
+                           'errors': min_number_of_differences})
+            stats.add_training(record)
         return min_number_of_differences, best_conditions_switchers
 
+    def train_sharded(self, shards, summary_dir: Optional[str] = None, method: str = 'bruteforce', verbose: int = 0, n_iter=100, trueprob=0.5, ishtml: bool = True,
+                      n_jobs: Optional[int] = 1, deduplicate: bool = True, max_nodes: Optional[int] = None, max_time: Optional[float] = None, reuse_summaries: bool = False):
+        """
+        Train the model out of core on a sharded corpus, the result is the same as of train_minimize_number_of_conditions
+        on all documents of the shards (see sharded_training.train_sharded).
+
+        :param shards: Directory of *.jsonl shards or iterable of shards (JSON lines file names or iterables of (text, label))
+        :param summary_dir: Directory of on-disk shard summaries (temporary directory by default)
+        :param reuse_summaries: If True, summaries of the same model and preprocessing settings in summary_dir are used
+                                without preprocessing of shards
+        :return: Tuple of minimum number of differences and best condition switchers
+        """
+        import sharded_training
+        return sharded_training.train_sharded(self, shards, summary_dir, method, verbose, n_iter, trueprob, ishtml, n_jobs, deduplicate,
+                                              max_nodes, max_time, reuse_summaries)
+
     def save_conditions(self, filename):
         """
         Save the current set of conditions to a file.
@@ -151,6 +500,32 @@ class cbtbc_model():
         with open(filename, 'rb') as f:
             self.conditions = pickle.load(f)
 
+    def save_model(self, filename):
+        """
+        Save the model (top level operation, conditions, conditions_switches, settings and compiled keywords)
+        to a versioned model file, see model_format.
+
+        :param filename: Name of the file to save the model
+        """
+        model_format.write_model_file(filename, self.conditions, self.top_level_operation, self.conditions_switches,
+                                      self.compile_keywords(), {'html_backend': self.html_backend, 'tokenizer': self.tokenizer})
+
+    def load_model(self, filename):
+        """
+        Load the model from a file written by save_model.
+
+        :param filename: Name of the file to load the model from
+        """
+        loaded = model_format.read_model_file(filename)
+        self.conditions = loaded['conditions']
+        self.top_level_operation = loaded['top_level_operation']
+        self.conditions_switches = loaded['conditions_switches']
+        self.html_backend = loaded['settings'].get('html_backend', 'bs4')
+        self.tokenizer = loaded['settings'].get('tokenizer', 'nltk')
+        # Automaton stored in the file was compiled from the same conditions
+        self._compiled_keywords = loaded['automaton']
+        self._compiled_keywords_conditions = tuple(self.conditions) if self.conditions is not None else None
+
     def filter_conditions(self, condition_switchers):
         """
         Filter the current set of conditions based on the provided condition switchers.
@@ -158,12 +533,18 @@ class cbtbc_model():
         :param condition_switchers: List of booleans indicating which conditions to keep
         """
         new_set_of_conditions = []
+        new_switches = []
         i = 0
         for cs in condition_switchers:
             if cs:
                 new_set_of_conditions.append(self.conditions[i])
+                if self.conditions_switches is not None:
+                    new_switches.append(i < len(self.conditions_switches) and self.conditions_switches[i])
             i += 1
         self.conditions = new_set_of_conditions
+        # conditions_switches are positional, they follow the kept conditions
+        if self.conditions_switches is not None:
+            self.conditions_switches = new_switches
 
     def __str__(self):
         """
@@ -1,43 +1,227 @@
 import tqdm
+import math
 import random
+import time
+import multiprocessing
+import worker_pool
 
-def branch_and_bound(binary_vector, index, best_solution, best_value, objective_function):
+
+def index_to_binary_vector(i, n):
+    """
+    Convert index of the binary vector into the vector, the first element is the most significant bit.
+
+    :param i: Index of the vector (0 <= i < 2**n)
+    :param n: The size of the binary vector
+    :return: List of booleans
+    """
+    if n == 0:
+        return []
+    return [digit == '1' for digit in bin(i)[2:].zfill(n)]
+
+
+def bruteforce_shard(n, start, stop, objective_function=None):
+    """
+    Evaluate binary vectors with indexes in [start, stop) and keep only the best one.
+
+    :param n: The size of the binary vector
+    :param start: First index of the shard
+    :param stop: Index after the last one of the shard
+    :param objective_function: Function to evaluate the value of a binary vector (worker's one if None)
+    :return: Tuple (value, number of True elements, index) of the best vector of the shard or None for empty shard
+    """
+    if objective_function is None:
+        objective_function = worker_pool.worker_object('cbtbc_opt.search')
+    best = None
+    for i in range(start, stop):
+        key = (objective_function(index_to_binary_vector(i, n)), bin(i).count('1'), i)
+        if best is None or key < best:
+            best = key
+    return best
+
+
+def gray_code_shard(n, start, stop, state_factory=None):
+    """
+    Evaluate binary vectors in Gray code order from position start to stop (exclusive) and keep only the best one.
+    Vector at position k has index k ^ (k >> 1), consecutive vectors differ in one element,
+    so the value is updated incrementally instead of being computed from scratch.
+
+    :param n: The size of the binary vector
+    :param start: First position of the shard
+    :param stop: Position after the last one of the shard
+    :param state_factory: Function that takes a binary vector and returns incremental state: an object with
+                          attribute value and method flip(i) which switches element i and returns the new value
+                          (worker's one if None)
+    :return: Tuple (value, number of True elements, index) of the best vector of the shard or None for empty shard
+    """
+    if state_factory is None:
+        state_factory = worker_pool.worker_object('cbtbc_opt.search')
+    if start >= stop:
+        return None
+    index = start ^ (start >> 1)
+    number_of_true = bin(index).count('1')
+    state = state_factory(index_to_binary_vector(index, n))
+    best = (state.value, number_of_true, index)
+    for k in range(start + 1, stop):
+        bit = (k & -k).bit_length() - 1  # Gray code of k differs from the previous one in the lowest set bit of k
+        index ^= 1 << bit
+        number_of_true += 1 if index >> bit & 1 else -1
+        key = (state.flip(n - 1 - bit), number_of_true, index)
+        if key < best:
+            best = key
+    return best
+
+
+def _shard_worker(shard):
+    shard_function, n, start, stop = shard
+    return shard_function(n, start, stop)
+
+
+def _run_shards(shard_function, n, objective_function, n_jobs, n_shards, verbose, desc):
+    """
+    Split the 2**n positions into shards, process them with shard_function and reduce shard results.
+    """
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs < 1:
+        raise Exception(f'n_jobs must be positive, got {n_jobs}')
+    total = 2 ** n
+    if n_shards is None:
+        n_shards = 16 * n_jobs
+    n_shards = max(1, min(n_shards, total))
+    bounds = [total * k // n_shards for k in range(n_shards + 1)]
+    shards = [(shard_function, n, bounds[k], bounds[k + 1]) for k in range(n_shards)]
+    if n_jobs == 1:
+        results = [shard_function(n, start, stop, objective_function)
+                   for _, _, start, stop in tqdm.tqdm(shards, disable=(verbose != 1), desc=desc)]
+    else:
+        with worker_pool.pool(n_jobs, 'cbtbc_opt.search', objective_function) as pool:
+            results = list(tqdm.tqdm(pool.imap_unordered(_shard_worker, shards), total=len(shards), disable=(verbose != 1), desc=desc))
+    best_value, _, best_index = min(result for result in results if result is not None)
+    return index_to_binary_vector(best_index, n), best_value
+
+
+def binary_vector_bruteforce_search(n, objective_function, n_jobs=1, n_shards=None, verbose=0):
+    """
+    Evaluate all binary vectors of size n and find the one with minimal value.
+    Among vectors with equal value the one with fewer True elements wins, then the one with the smaller index
+    (the first element is the most significant bit). Only the best vector of each shard is kept in memory.
+
+    :param n: The size of the binary vector
+    :param objective_function: Function that takes a binary vector as input and returns a numerical value,
+                               it must be picklable if n_jobs > 1
+    :param n_jobs: Number of worker processes (None - number of CPUs, 1 - run in the current process)
+    :param n_shards: Number of shards the index space is split into (by default 16 per worker)
+    :param verbose: Verbosity level (0: silent, 1: progress bar)
+    :return: Tuple containing the optimal binary vector and its corresponding value
+    """
+    return _run_shards(bruteforce_shard, n, objective_function, n_jobs, n_shards, verbose, 'cbtbc model. Training. Method:bruteforce')
+
+
+def binary_vector_gray_code_search(n, state_factory, n_jobs=1, n_shards=None, verbose=0):
+    """
+    Evaluate all binary vectors of size n in Gray code order with incremental updates of the value.
+    The result (including tie-breaking) is the same as of binary_vector_bruteforce_search.
+
+    :param n: The size of the binary vector
+    :param state_factory: Function that takes a binary vector and returns incremental state (see gray_code_shard),
+                          it must be picklable if n_jobs > 1
+    :param n_jobs: Number of worker processes (None - number of CPUs, 1 - run in the current process)
+    :param n_shards: Number of shards the Gray code sequence is split into (by default 16 per worker)
+    :param verbose: Verbosity level (0: silent, 1: progress bar)
+    :return: Tuple containing the optimal binary vector and its corresponding value
+    """
+    return _run_shards(gray_code_shard, n, state_factory, n_jobs, n_shards, verbose, 'cbtbc model. Training. Method:bruteforce_gray')
+
+
+def branch_and_bound_search(n, objective_function, bound_function=None, initial_vector=None, memo=None, max_nodes=None, max_time=None, prefix=None):
+    """
+    Find the binary vector of size n with minimal value by iterative depth-first branch-and-bound.
+    Among vectors with equal value the one with fewer True elements wins.
+
+    :param n: The size of the binary vector
+    :param objective_function: Function that takes a binary vector as input and returns a numerical value
+    :param bound_function: Function that takes a prefix of the binary vector and returns a lower bound of the value
+                           of all vectors starting with it. It must be admissible (never greater than the value of
+                           any completion), otherwise optimal vectors can be pruned. Without it all vectors are evaluated
+    :param initial_vector: Vector which values are explored first on each position (all False by default)
+    :param memo: Dictionary of already evaluated vectors (tuples) to their values, it is updated and can be shared between runs
+    :param max_nodes: Optional maximal number of expanded nodes
+    :param max_time: Optional maximal search time in seconds
+    :param prefix: Optional fixed beginning of the vector, only its completions are explored
+    :return: Tuple containing the best binary vector found, its value and the search statistics
+             (nodes_expanded, nodes_pruned, leaves_evaluated, memo_hits, complete - False if the search stopped on budget, time)
+    """
+    start_time = time.perf_counter()
+    if memo is None:
+        memo = {}
+    if initial_vector is None:
+        initial_vector = [False] * n
+    stats = {'nodes_expanded': 0, 'nodes_pruned': 0, 'leaves_evaluated': 0, 'memo_hits': 0, 'complete': True}
+    best_vector = None
+    best_value = float('inf')
+    best_number_of_true = n + 1
+
+    def evaluate(vector):
+        value = memo.get(vector)
+        if value is None:
+            value = objective_function(list(vector))
+            memo[vector] = value
+            stats['leaves_evaluated'] += 1
+        else:
+            stats['memo_hits'] += 1
+        return value
+
+    prefix = tuple(bool(el) for el in prefix) if prefix is not None else ()
+    stack = [(prefix, sum(prefix))]
+    while stack:
+        if (max_nodes is not None and stats['nodes_expanded'] >= max_nodes) or \
+                (max_time is not None and time.perf_counter() - start_time >= max_time):
+            stats['complete'] = False
+            break
+        node, number_of_true = stack.pop()
+        index = len(node)
+        if index == n:
+            value = evaluate(node)
+            if value < best_value or (value == best_value and number_of_true < best_number_of_true):
+                best_vector, best_value, best_number_of_true = node, value, number_of_true
+            continue
+        if bound_function is not None and best_vector is not None:
+            lower_bound = bound_function(list(node))
+            # Completions have at least number_of_true True elements, so equal value can't be an improvement
+            if lower_bound > best_value or (lower_bound == best_value and number_of_true >= best_number_of_true):
+                stats['nodes_pruned'] += 1
+                continue
+        stats['nodes_expanded'] += 1
+        first = bool(initial_vector[index])
+        stack.append((node + (not first,), number_of_true + (not first)))
+        stack.append((node + (first,), number_of_true + first))
+    if best_vector is None:
+        # Budget exhausted before the first leaf
+        best_vector = prefix + tuple(bool(el) for el in initial_vector[len(prefix):n])
+        best_value = evaluate(best_vector)
+    stats['time'] = time.perf_counter() - start_time
+    return list(best_vector), best_value, stats
+
+
+def branch_and_bound(binary_vector, index, best_solution, best_value, objective_function, bound_function=None):
     """
     Perform the branch-and-bound algorithm to find the optimal binary vector.
 
-    :param binary_vector: Current binary vector being evaluated
+    :param binary_vector: Current binary vector, its first index elements are fixed
     :param index: Current index in the binary vector
     :param best_solution: Best solution found so far (wrapped in a list for mutability)
     :param best_value: Best value found so far (wrapped in a list for mutability)
     :param objective_function: Function to evaluate the value of a binary vector
+    :param bound_function: Optional admissible lower bound of the value of a prefix (see branch_and_bound_search)
     """
-    n = len(binary_vector)
-    # Base case: if we've considered all elements
-    if index == n:
-        current_value = objective_function(binary_vector)
-        if current_value <= best_value[0]:  # Allow equal value to support multiple "True" values
-            if current_value < best_value[0] or sum(binary_vector) < sum(best_solution[0]):
-                best_solution[0] = binary_vector.copy()
-                best_value[0] = current_value
-        return
-
-    # Pruning condition based on a more nuanced strategy
-    # Check if the partial solution could potentially lead to an improvement
-    if index > 0:
-        partial_value = objective_function(binary_vector[:index] + [True] * (n - index))
-        if partial_value > best_value[0]:
-            return  # Prune if the partial solution already exceeds the best value
+    vector, value, _ = branch_and_bound_search(len(binary_vector), objective_function, bound_function,
+                                               initial_vector=binary_vector, prefix=binary_vector[:index])
+    if value < best_value[0] or (value == best_value[0] and (best_solution[0] is None or sum(vector) < sum(best_solution[0]))):
+        best_solution[0] = vector
+        best_value[0] = value
 
-    # Branch with the current element set to False
-    branch_and_bound(binary_vector, index + 1, best_solution, best_value, objective_function)
 
-    # Branch with the current element set to True, without immediate pruning
-    binary_vector[index] = True
-    branch_and_bound(binary_vector, index + 1, best_solution, best_value, objective_function)
-    binary_vector[index] = False  # Reset for the next branch
-
-
-def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_method=True, random_search_method=True, Trueprob=0.5, verbose=0):
+def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_method=True, random_search_method=True, trueprob=0.5, verbose=0, bound_function=None, max_nodes=None, max_time=None, stats=None):
     """
     Find the binary vector of size n that minimizes the given objective function.
 
@@ -47,7 +231,11 @@ def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_metho
     :param bnb_method: If True, use the branch-and-bound method
     :param random_search_method: If True, use the random search method
     :param verbose: Verbosity level (0: silent, 1: progress bar, 2: progress report)
-    :param Trueprob: Probability for choosing True in random search
+    :param trueprob: Probability for choosing True in random search
+    :param bound_function: Optional admissible lower bound of the value of a prefix (see branch_and_bound_search)
+    :param max_nodes: Optional maximal number of expanded nodes of each branch-and-bound run
+    :param max_time: Optional maximal time in seconds of each branch-and-bound run
+    :param stats: Optional dictionary, it is filled with summed branch-and-bound statistics
     :return: Tuple containing the optimal binary vector and its corresponding value
     """
     if not bnb_method and not random_search_method:
@@ -55,10 +243,15 @@ def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_metho
 
     best_solution = [None]  # Using list for mutable reference
     best_value = [float('inf')]
-    binary_vector = [random.choice([True, False]) for _ in range(n)]
+    binary_vector = [random.random() < trueprob for _ in range(n)]
 
-    # Pass the objective function as an argument to branch_and_bound
-    list_of_initial_vectors = []
+    # Evaluated vectors are shared between branch-and-bound runs
+    memo = {}
+    if stats is None:
+        stats = {}
+    for key in ('nodes_expanded', 'nodes_pruned', 'leaves_evaluated', 'memo_hits', 'time'):
+        stats[key] = 0
+    list_of_initial_vectors = set()
     overall_best_value = float('inf')
     overall_best_solution = None
     if bnb_method and not random_search_method and n_iter > 1:
@@ -75,16 +268,23 @@ def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_metho
 
     for i in tqdm.tqdm(range(n_iter), disable=(verbose != 1), desc=f'cbtbc model. Training. Method:{method}'):
         if random_search_method:
-            while binary_vector in list_of_initial_vectors:
-                binary_vector = [random.choice([True, False]) for _ in range(n)]
-            list_of_initial_vectors.append(binary_vector.copy())
+            if len(list_of_initial_vectors) >= 2 ** n:
+                break  # All vectors were already tried
+            while tuple(binary_vector) in list_of_initial_vectors:
+                binary_vector = [random.random() < trueprob for _ in range(n)]
+            list_of_initial_vectors.add(tuple(binary_vector))
         else:
             binary_vector = [False] * n
 
+        complete = False
         if bnb_method:
-            best_solution = [None]
-            best_value = [float('inf')]
-            branch_and_bound(binary_vector, 0, best_solution, best_value, objective_function)
+            vector, value, run_stats = branch_and_bound_search(n, objective_function, bound_function, initial_vector=binary_vector,
+                                                               memo=memo, max_nodes=max_nodes, max_time=max_time)
+            best_solution = [vector]
+            best_value = [value]
+            for key in ('nodes_expanded', 'nodes_pruned', 'leaves_evaluated', 'memo_hits', 'time'):
+                stats[key] += run_stats[key]
+            complete = run_stats['complete']
         else:
             initial_value = objective_function(binary_vector)
             best_solution = [binary_vector]
@@ -93,13 +293,114 @@ def binary_vector_bnb_random_search(n, objective_function, n_iter=100, bnb_metho
         if overall_best_solution is None or best_value[0] < overall_best_value:
             overall_best_solution = best_solution[0]
             overall_best_value = best_value[0]
-            list_of_initial_vectors.append(overall_best_solution)
+            list_of_initial_vectors.add(tuple(overall_best_solution))
             if verbose >= 2:
                 print(f"Iter:{i} new best value: {overall_best_value} ")
+        if complete:
+            # Complete branch-and-bound search is exact, other starting vectors can't improve the result
+            if verbose >= 2:
+                print(f"Iter:{i} branch-and-bound search is complete")
+            break
+    if bnb_method and verbose >= 2:
+        print(f"Branch-and-bound: nodes expanded {stats['nodes_expanded']}, pruned {stats['nodes_pruned']}, "
+              f"leaves evaluated {stats['leaves_evaluated']}, memo hits {stats['memo_hits']}")
 
     return overall_best_solution, overall_best_value
 
 
+class objective_state():
+    def __init__(self, objective_function, binary_vector):
+        """
+        Incremental state for objective functions without incremental evaluation: the value is recomputed on each flip.
+
+        :param objective_function: Function that takes a binary vector as input and returns a numerical value
+        :param binary_vector: Initial binary vector
+        """
+        self.objective_function = objective_function
+        self.binary_vector = list(binary_vector)
+        self.value = objective_function(self.binary_vector)
+
+    def flip(self, i):
+        self.binary_vector[i] = not self.binary_vector[i]
+        self.value = self.objective_function(self.binary_vector)
+        return self.value
+
+
+def binary_vector_anneal_search(n, objective_function=None, state_factory=None, n_iter=1000, max_time=None, initial_temperature=1.0, final_temperature=0.01, trueprob=0.5, initial_vector=None, verbose=0, stats=None):
+    """
+    Find the binary vector of size n that minimizes the given objective function by simulated annealing.
+    Each step proposes to flip one element, the value of the neighbour is computed incrementally by the state
+    (or taken from the visited vectors) and the flip is accepted by Metropolis criterion.
+    Among vectors with equal value the one with fewer True elements wins.
+
+    :param n: The size of the binary vector
+    :param objective_function: Function that takes a binary vector as input and returns a numerical value
+    :param state_factory: Function that takes a binary vector and returns incremental state (see gray_code_shard),
+                          used instead of objective_function if it is provided
+    :param n_iter: Number of proposed flips
+    :param max_time: Optional maximal search time in seconds
+    :param initial_temperature: Temperature at the first step (in units of the objective function)
+    :param final_temperature: Temperature at the last step, it decreases geometrically
+    :param trueprob: Probability for choosing True in the random initial vector
+    :param initial_vector: Optional initial vector (random by default)
+    :param verbose: Verbosity level (0: silent, 1: progress bar, 2: progress report)
+    :param stats: Optional dictionary, it is filled with search statistics (steps, accepted, evaluations, visited, time)
+    :return: Tuple containing the optimal binary vector and its corresponding value
+    """
+    if state_factory is None:
+        if objective_function is None:
+            raise Exception("objective_function or state_factory should be provided")
+        state_factory = lambda binary_vector: objective_state(objective_function, binary_vector)
+    start_time = time.perf_counter()
+    if initial_vector is None:
+        initial_vector = [random.random() < trueprob for _ in range(n)]
+    binary_vector = [bool(el) for el in initial_vector]
+    state = state_factory(binary_vector)
+    mask = sum(1 << i for i in range(n) if binary_vector[i])
+    number_of_true = sum(binary_vector)
+    value = state.value
+    # Values of visited vectors (bit i of the key is element i), revisited neighbours are not evaluated again
+    visited = {mask: value}
+    # Number of True elements is a tie-breaker, it never outweighs a difference of the objective
+    count_weight = 1.0 / (n + 1)
+    best_key = (value, number_of_true)
+    best_vector = list(binary_vector)
+    if stats is None:
+        stats = {}
+    stats.update({'steps': 0, 'accepted': 0, 'evaluations': 1})
+    for step in tqdm.tqdm(range(n_iter if n > 0 else 0), disable=(verbose != 1), desc='cbtbc model. Training. Method:anneal'):
+        if max_time is not None and time.perf_counter() - start_time >= max_time:
+            break
+        temperature = initial_temperature * (final_temperature / initial_temperature) ** (step / max(n_iter - 1, 1))
+        i = random.randrange(n)
+        new_mask = mask ^ (1 << i)
+        new_number_of_true = number_of_true + (-1 if binary_vector[i] else 1)
+        new_value = visited.get(new_mask)
+        flipped = new_value is None
+        if flipped:
+            new_value = state.flip(i)
+            visited[new_mask] = new_value
+            stats['evaluations'] += 1
+        delta = (new_value - value) + count_weight * (new_number_of_true - number_of_true)
+        stats['steps'] += 1
+        if delta <= 0 or random.random() < math.exp(-delta / temperature):
+            if not flipped:
+                state.flip(i)
+            binary_vector[i] = not binary_vector[i]
+            mask, value, number_of_true = new_mask, new_value, new_number_of_true
+            stats['accepted'] += 1
+            if (new_value, number_of_true) < best_key:
+                best_key = (new_value, number_of_true)
+                best_vector = list(binary_vector)
+                if verbose >= 2:
+                    print(f"Step:{step} new best value: {new_value} number of True: {number_of_true}")
+        elif flipped:
+            state.flip(i)  # Return to the current vector
+    stats['visited'] = len(visited)
+    stats['time'] = time.perf_counter() - start_time
+    return best_vector, best_key[0]
+
+
 def objective_function(x):
     """
     Example objective function to demonstrate the usage of the optimization functions.
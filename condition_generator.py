@@ -0,0 +1,260 @@
+'''
+Automatic generation of candidate conditions from two labeled sets of texts
+Documents are passed once: for each token the number of documents of each class containing it is counted,
+and for each token, class of numbers (float, percent, float or percent) and n_words of the sweep the number
+of documents where the token is met within n_words of such number. Counting is vectorized per document,
+candidates are ranked by their discriminative power and the best ones are converted into conditions
+to be selected by cbtbc_model.train_minimize_number_of_conditions.
+'''
+
+import itertools
+import math
+import numpy as np
+import conditions
+import corpus
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# Classes of numbers and conditions triggered by them
+NUMBER_CLASSES = ('float', 'percent', 'floatorpercent')
+NUMBER_CONDITIONS = {'float': 'condition_float_in_last_n_words',
+                     'percent': 'condition_floatpercent_in_last_n_words',
+                     'floatorpercent': 'condition_floatorpercent_in_last_n_words'}
+DEFAULT_N_WORDS = (1, 2, 3, 5, 8)
+
+
+def discriminative_score(positive: np.ndarray, negative: np.ndarray, n_positive: int, n_negative: int, alpha: float = 0.5) -> np.ndarray:
+    """
+    Smoothed log odds ratio of a feature being present in positive documents over negative ones.
+
+    :param positive: Number of positive documents with the feature
+    :param negative: Number of negative documents with the feature
+    :param n_positive: Number of positive documents
+    :param n_negative: Number of negative documents
+    :param alpha: Additive smoothing
+    :return: Score, positive for features indicating the positive class
+    """
+    positive = np.asarray(positive, dtype=np.float64)
+    negative = np.asarray(negative, dtype=np.float64)
+    return (np.log((positive + alpha) / (n_positive - positive + alpha))
+            - np.log((negative + alpha) / (n_negative - negative + alpha)))
+
+
+class candidate_statistics():
+    def __init__(self, n_words_values: Sequence[int] = DEFAULT_N_WORDS):
+        """
+        Initialize empty statistics.
+
+        :param n_words_values: Values of n_words of generated conditions (sweep)
+        """
+        if not n_words_values or min(n_words_values) < 1:
+            raise Exception(f'n_words_values must be a non empty list of positive numbers, got {n_words_values}')
+        self.n_words_values = tuple(sorted(set(n_words_values)))
+        self.vocabulary = {}
+        self.tokens = []
+        self.n_documents = np.zeros(2, dtype=np.int64)  # Negative and positive documents
+        self.number_documents = np.zeros((2, len(NUMBER_CLASSES)), dtype=np.int64)
+        self.document_frequency = np.zeros((2, 0), dtype=np.int64)
+        self._near_number_first = np.zeros((2, len(NUMBER_CLASSES), len(self.n_words_values), 0), dtype=np.int64)
+        self.number_flags = np.zeros((len(NUMBER_CLASSES), 0), dtype=bool)
+        self._resize(1024)
+
+    def _resize(self, capacity):
+        # Per token arrays grow with the vocabulary, the last axis is the token id
+        def grow(array):
+            new = np.zeros(array.shape[:-1] + (capacity,), dtype=array.dtype)
+            new[..., :array.shape[-1]] = array
+            return new
+        self.document_frequency = grow(self.document_frequency)
+        self._near_number_first = grow(self._near_number_first)
+        self.number_flags = grow(self.number_flags)
+
+    def _token_ids(self, words: Sequence[str]) -> np.ndarray:
+        vocabulary = self.vocabulary
+        ids = np.fromiter(map(vocabulary.get, words, itertools.repeat(-1)), dtype=np.intp, count=len(words))
+        for i in np.flatnonzero(ids < 0):
+            word = words[i]
+            token_id = vocabulary.get(word)
+            if token_id is None:
+                token_id = vocabulary[word] = len(self.tokens)
+                self.tokens.append(word)
+                if token_id >= self.number_flags.shape[-1]:
+                    self._resize(2 * self.number_flags.shape[-1])
+                is_float = conditions.isfloat(word)
+                is_percent = conditions.ispercent(word)
+                self.number_flags[:, token_id] = (is_float, is_percent, is_float or is_percent)
+            ids[i] = token_id
+        return ids
+
+    def add_document(self, words: Sequence[str], label: bool):
+        """
+        Count tokens of one preprocessed document.
+
+        :param words: Sequence of words (as produced by corpus.preprocess_text)
+        :param label: Label of the document
+        """
+        label = int(bool(label))
+        self.n_documents[label] += 1
+        if not len(words):
+            return
+        ids = self._token_ids(words)
+        self.document_frequency[label, np.unique(ids)] += 1
+        n_values = np.array(self.n_words_values)
+        reach = n_values[-1] - 1
+        offsets = np.arange(-reach, reach + 1)
+        for c in range(len(NUMBER_CLASSES)):
+            number_positions = np.flatnonzero(self.number_flags[c, ids])
+            if not len(number_positions):
+                continue
+            self.number_documents[label, c] += 1
+            # A token and a number are true at the same word of conditions with n_words = n if they are
+            # less than n words apart, so only words within the largest n_words of numbers are considered
+            positions = (number_positions[:, None] + offsets).ravel()
+            distances = np.tile(np.abs(offsets), len(number_positions))
+            inside = (positions >= 0) & (positions < len(ids))
+            positions, distances = positions[inside], distances[inside]
+            order = np.argsort(distances, kind='stable')
+            near_ids, first = np.unique(ids[positions[order]], return_index=True)
+            # Index of the smallest n_words for which each token is near a number, counts are accumulated
+            # over n_words by near_number_counts
+            smallest = np.searchsorted(n_values, distances[order][first], side='right')
+            self._near_number_first[label, c, smallest, near_ids] += 1
+
+    def near_number_counts(self) -> np.ndarray:
+        """
+        Number of documents where each token is met near a number.
+
+        :return: Array indexed by label, class of numbers (see NUMBER_CLASSES), index of n_words and token id
+        """
+        return np.cumsum(self._near_number_first[..., :len(self.tokens)], axis=2)
+
+    def add_documents(self, list_of_texts: Iterable[str], list_of_labels: Iterable[bool], ishtml: bool = True,
+                      corpus_cache: Optional[corpus.preprocessed_corpus] = None, html_backend: str = 'bs4', tokenizer: str = 'nltk', verbose: int = 0):
+        """
+        Preprocess and count documents, both iterables are consumed lazily.
+
+        :param list_of_texts: Iterable of plain text/HTML strings
+        :param list_of_labels: Iterable of labels (True/False) for each document
+        :param ishtml: If True, texts are HTML
+        :param corpus_cache: Optional preprocessed corpus, words of texts are taken from it
+        :param html_backend: HTML parsing backend (see htmltransform.HTML_BACKENDS)
+        :param tokenizer: Tokenizer (see htmltransform.TOKENIZERS)
+        :param verbose: Verbosity level (1: progress bar)
+        """
+        from tqdm import tqdm  # Importing tqdm module for progress bar
+        total = len(list_of_texts) if hasattr(list_of_texts, '__len__') else None
+        for intext, label in tqdm(zip(list_of_texts, list_of_labels), total=total, disable=(verbose != 1), desc='cbtbc candidate conditions. Counting'):
+            if corpus_cache is not None:
+                words = corpus_cache.get_words(intext, ishtml, html_backend, tokenizer)
+            else:
+                words = corpus.preprocess_text(intext, ishtml, html_backend, tokenizer)
+            self.add_document(words, label)
+
+    def _keyword_mask(self, min_df: int) -> np.ndarray:
+        n_tokens = len(self.tokens)
+        mask = (self.document_frequency[1, :n_tokens] >= min_df) & ~self.number_flags[2, :n_tokens]
+        # Punctuation and tag separators are not keywords
+        mask &= np.fromiter((any(ch.isalnum() for ch in token) for token in self.tokens), dtype=bool, count=n_tokens)
+        return mask
+
+    def rank_candidates(self, min_df: int = 2, alpha: float = 0.5, max_keywords: int = 10, min_score: float = 1.0) -> List[Dict]:
+        """
+        Rank candidate conditions by their discriminative power.
+        Candidates are keywords alone ('keywords') and keywords near a class of numbers within n_words ('near_number'),
+        each of them gets up to max_keywords of the best tokens with score at least min_score.
+
+        :param min_df: Minimal number of positive documents containing a keyword
+        :param alpha: Additive smoothing of the scores
+        :param max_keywords: Maximal number of keywords of one candidate
+        :param min_score: Minimal score of a keyword or a class of numbers (log odds ratio)
+        :return: List of candidates sorted by score, each one is a dictionary with 'kind', 'keywords', 'number_class',
+                 'n_words', 'score' and per keyword 'keyword_scores'
+        """
+        n_negative, n_positive = (int(n) for n in self.n_documents)
+        if not n_positive or not n_negative:
+            raise Exception('Both positive and negative documents are required to rank candidate conditions')
+        n_tokens = len(self.tokens)
+        eligible = self._keyword_mask(min_df)
+        near_number = self.near_number_counts()
+        candidates = []
+
+        def best_keywords(positive, negative):
+            scores = discriminative_score(positive, negative, n_positive, n_negative, alpha)
+            scores = np.where(eligible & (positive >= min_df), scores, -np.inf)
+            top = np.argsort(-scores, kind='stable')[:max_keywords]
+            top = top[scores[top] >= min_score]
+            return [self.tokens[i] for i in top], scores[top]
+
+        keywords, scores = best_keywords(self.document_frequency[1, :n_tokens], self.document_frequency[0, :n_tokens])
+        if keywords:
+            candidates.append({'kind': 'keywords', 'keywords': keywords, 'number_class': None, 'n_words': self.n_words_values[0],
+                               'score': float(scores[0]), 'keyword_scores': [float(score) for score in scores]})
+        for c, number_class in enumerate(NUMBER_CLASSES):
+            for j, n_words in enumerate(self.n_words_values):
+                keywords, scores = best_keywords(near_number[1, c, j], near_number[0, c, j])
+                if keywords:
+                    candidates.append({'kind': 'near_number', 'keywords': keywords, 'number_class': number_class, 'n_words': n_words,
+                                       'score': float(scores[0]), 'keyword_scores': [float(score) for score in scores]})
+        number_scores = discriminative_score(self.number_documents[1], self.number_documents[0], n_positive, n_negative, alpha)
+        for c, number_class in enumerate(NUMBER_CLASSES):
+            if number_scores[c] >= min_score and math.isfinite(number_scores[c]):
+                candidates.append({'kind': 'number', 'keywords': [], 'number_class': number_class, 'n_words': self.n_words_values[0],
+                                   'score': float(number_scores[c]), 'keyword_scores': []})
+        candidates.sort(key=lambda candidate: -candidate['score'])
+        return candidates
+
+    def generate_conditions(self, budget: int = 16, min_df: int = 2, alpha: float = 0.5, max_keywords: int = 10, min_score: float = 1.0) -> List[object]:
+        """
+        Convert the best candidates into conditions.
+        A 'near_number' candidate gives a keyword condition and a number condition with the same n_words,
+        identical conditions are generated once. Generation stops when budget conditions are generated.
+
+        :param budget: Maximal number of conditions
+        :param min_df: Minimal number of positive documents containing a keyword
+        :param alpha: Additive smoothing of the scores
+        :param max_keywords: Maximal number of keywords of one keyword condition
+        :param min_score: Minimal score of a keyword or a class of numbers (log odds ratio)
+        :return: List of condition objects, the most discriminative first
+        """
+        result = []
+        keys = set()
+
+        def add(cond):
+            key = conditions.condition_key(cond)
+            if key not in keys and len(result) < budget:
+                keys.add(key)
+                result.append(cond)
+
+        for candidate in self.rank_candidates(min_df, alpha, max_keywords, min_score):
+            if len(result) >= budget:
+                break
+            n_words = candidate['n_words']
+            if candidate['keywords']:
+                add(conditions.condition_keywords_in_last_n_words({'n_words': n_words, 'keywords': list(candidate['keywords'])}))
+            if candidate['number_class'] is not None:
+                add(conditions.condition_factory(NUMBER_CONDITIONS[candidate['number_class']], {'n_words': n_words}))
+        return result
+
+
+def generate_candidate_conditions(list_of_texts: Iterable[str], list_of_labels: Iterable[bool], budget: int = 16,
+                                  n_words_values: Sequence[int] = DEFAULT_N_WORDS, min_df: int = 2, max_keywords: int = 10,
+                                  ishtml: bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None,
+                                  html_backend: str = 'bs4', tokenizer: str = 'nltk', verbose: int = 0) -> List[object]:
+    """
+    Generate candidate conditions from two labeled sets of texts.
+
+    :param list_of_texts: Iterable of plain text/HTML strings
+    :param list_of_labels: Iterable of labels (True/False) for each document
+    :param budget: Maximal number of generated conditions
+    :param n_words_values: Values of n_words of generated conditions
+    :param min_df: Minimal number of positive documents containing a keyword
+    :param max_keywords: Maximal number of keywords of one keyword condition
+    :param ishtml: If True, texts are HTML
+    :param corpus_cache: Optional preprocessed corpus, words of texts are taken from it
+    :param html_backend: HTML parsing backend (see htmltransform.HTML_BACKENDS)
+    :param tokenizer: Tokenizer (see htmltransform.TOKENIZERS)
+    :param verbose: Verbosity level (1: progress bar)
+    :return: List of condition objects, the most discriminative first
+    """
+    statistics = candidate_statistics(n_words_values)
+    statistics.add_documents(list_of_texts, list_of_labels, ishtml, corpus_cache, html_backend, tokenizer, verbose)
+    return statistics.generate_conditions(budget, min_df, max_keywords=max_keywords)
@@ -4,6 +4,11 @@
     Each condition on each step obtain one word and return boolean value
 '''
 
+import copy
+import json
+import numpy as np
+import keywords as keywords_automaton
+
 #Some utility functions
 def isfloat(value):
     try:
@@ -23,6 +28,78 @@ def ispercent(value):
     except ValueError:
         return False
 
+#Vectorized evaluation
+class token_classes():
+    '''
+        Classification of the list of words, each distinct word is classified only once
+        Masks are boolean numpy arrays with one element per word
+    '''
+    def __init__(self, words):
+        self.words = words
+        index = {}
+        self.inverse = np.fromiter((index.setdefault(word, len(index)) for word in words), dtype=np.intp, count=len(words))
+        self.unique = list(index)
+        self._masks = {}
+    def unique_mask(self, name, predicate):
+        if name not in self._masks:
+            flags = np.fromiter((predicate(word) for word in self.unique), dtype=bool, count=len(self.unique))
+            self._masks[name] = flags[self.inverse]
+        return self._masks[name]
+    def float_mask(self):
+        return self.unique_mask('float', isfloat)
+    def percent_mask(self):
+        return self.unique_mask('percent', ispercent)
+    def keyword_mask(self, keywords):
+        flags = np.fromiter((word in keywords for word in self.unique), dtype=bool, count=len(self.unique))
+        return flags[self.inverse]
+    def trigger_masks(self, automaton):
+        return automaton.trigger_masks(self.words)
+
+def trigger_within_last_n(trigger, n):
+    '''
+        For each position returns True if trigger was met in the last n words (including current one)
+        Equivalent of the distance counter used in condition_in_last_n_words.check
+    '''
+    positions = np.arange(len(trigger))
+    last_trigger = np.maximum.accumulate(np.where(trigger, positions, -1)) if len(trigger) else positions
+    return (last_trigger >= 0) & (positions - last_trigger < n)
+
+#Per call evaluation state
+class scan_state():
+    '''
+        State of one word by word scan of condition_in_last_n_words (or of its negation)
+        The condition is only read, so one condition can be scanned by several threads at once
+    '''
+    __slots__ = ('is_trigger', 'max_distance', 'last_distance', 'negated')
+    def __init__(self, condition):
+        self.is_trigger = condition.is_trigger
+        self.max_distance = condition.max_distance
+        self.last_distance = None
+        self.negated = False
+    def negate(self):
+        self.negated = not self.negated
+        return self
+    def update(self, triggered):
+        if triggered:
+            self.last_distance = 0
+        elif self.last_distance is not None:
+            self.last_distance += 1
+        return (self.last_distance is not None and self.last_distance < self.max_distance) != self.negated
+    def check(self, string):
+        return self.update(self.is_trigger(string))
+
+class automaton_scan_state(scan_state):
+    '''
+        Scan state of keyword condition with keywords of several words, keeps its own state of the keyword automaton
+    '''
+    __slots__ = ('step_trigger', 'automaton_state')
+    def __init__(self, condition):
+        super().__init__(condition)
+        self.step_trigger = condition.step_trigger
+        self.automaton_state = 0
+    def check(self, string):
+        self.automaton_state, triggered = self.step_trigger(self.automaton_state, string)
+        return self.update(triggered)
 
 class condition_base():
     mandatory_params = []
@@ -36,19 +113,45 @@ class condition_base():
         raise Exception(msg)
     def check(self, string):
         return False
+    def scan(self):
+        '''
+            Returns new per call state of word by word evaluation with methods check(word) and update(triggered)
+            Conditions keeping their state on themselves are scanned through a clean shallow copy
+        '''
+        state = copy.copy(self)
+        state.clean()
+        return state
+    def check_words(self, words, classes = None):
+        '''
+            Pass the whole list of words through the condition starting from the clean state
+            Returns boolean numpy array with the result of check() for each word
+            classes is optional token_classes of the words shared between conditions
+        '''
+        state = self.scan()
+        return np.fromiter((state.check(word) for word in words), dtype=bool, count=len(words))
     def clean(self):
         raise NotImplementedError('clean method should be implemented in child class')
     def __str__(self):
         return f'{self.__class__.__name__}({self.params})'
 
-class condition_float_in_last_n_words(condition_base):
+class condition_in_last_n_words(condition_base):
+    '''
+        Base class of conditions which are true if a trigger word was met in the last n words
+        Child classes define the trigger by is_trigger (one word) and trigger_mask (whole list of words)
+    '''
     mandatory_params = ['n_words']
     def __init__(self,params = None):
         super().__init__(params)
         self.max_distance = self.params['n_words']
         self.last_distance = None
-    def check(self, string):
-        if isfloat(string):
+    def is_trigger(self, string):
+        raise NotImplementedError('is_trigger method should be implemented in child class')
+    def scan(self):
+        return scan_state(self)
+    def trigger_mask(self, classes):
+        return np.fromiter((self.is_trigger(word) for word in classes.words), dtype=bool, count=len(classes.words))
+    def update(self, triggered):
+        if triggered:
             self.last_distance = 0
         else:
             if self.last_distance is not None:
@@ -58,53 +161,96 @@ class condition_float_in_last_n_words(condition_base):
             return True
         else:
             return False
-    def __eq__(self, other):
-        return self.params == other.params and self.__class__ == other.__class__
+    def check(self, string):
+        return self.update(self.is_trigger(string))
+    def check_trigger_mask(self, trigger):
+        return trigger_within_last_n(trigger, self.max_distance)
+    def check_words(self, words, classes = None):
+        if classes is None:
+            classes = token_classes(words)
+        return self.check_trigger_mask(self.trigger_mask(classes))
     def clean(self):
         self.last_distance = None
-class condition_keywords_in_last_n_words(condition_base):
+
+class condition_float_in_last_n_words(condition_in_last_n_words):
+    def is_trigger(self, string):
+        return isfloat(string)
+    def trigger_mask(self, classes):
+        return classes.float_mask()
+    def __eq__(self, other):
+        return self.params == other.params and self.__class__ == other.__class__
+class condition_keywords_in_last_n_words(condition_in_last_n_words):
+    '''
+        Keywords consisting of several words separated by spaces are met at the position of their last word
+    '''
     mandatory_params = ['n_words','keywords']
-    def __init__(self,params = None):
+    def __init__(self,params = None, keyword_set = None):
+        '''
+            keyword_set is optional precomputed frozenset of single word keywords (as stored in model files),
+            then only keywords missing from it are split into words
+        '''
         super().__init__(params)
-        self.max_distance = self.params['n_words']
         self.keywords = self.params['keywords']
-        self.last_distance = None
-
-    def check(self, string):
-        if string in self.keywords:
-            self.last_distance = 0
-        else:
-            if self.last_distance is not None:
-                self.last_distance += 1
-
-        if self.last_distance is not None and self.last_distance < self.max_distance:
-            return True
-        else:
-            return False
+        self.compile(keyword_set)
+        self.state = 0
+    def compile(self, keyword_set = None):
+        '''
+            Build keyword_set and automaton from self.keywords
+        '''
+        if keyword_set is None:
+            keyword_set = frozenset(words[0] for words in map(keywords_automaton.split_keyword, self.keywords) if len(words) == 1)
+        self.keyword_set = keyword_set
+        # Automaton of keywords consisting of several words, single word keywords are looked up in keyword_set
+        self.automaton = None
+        if len(self.keyword_set) != len(self.keywords):
+            try:
+                others = set(self.keywords).difference(self.keyword_set)
+            except TypeError:
+                others = [keyword for keyword in self.keywords if isinstance(keyword, str) and keyword not in self.keyword_set]
+            phrases = [keyword for keyword in others if len(keywords_automaton.split_keyword(keyword)) > 1]
+            if phrases:
+                self.automaton = keywords_automaton.keyword_automaton({0: phrases})
+    def __setstate__(self, state):
+        '''
+            Conditions pickled by earlier versions (save_conditions) have only params, keywords and distances
+        '''
+        self.__dict__.update(state)
+        if 'keyword_set' not in state:
+            self.compile()
+            self.state = 0
+    def is_trigger(self, string):
+        if self.automaton is None:
+            return string in self.keyword_set
+        self.state, triggered = self.step_trigger(self.state, string)
+        return triggered
+    def step_trigger(self, automaton_state, string):
+        '''
+            is_trigger with the state of the automaton passed by the caller instead of being kept on the condition
+            Returns tuple of the new automaton state and the trigger flag
+        '''
+        if self.automaton is None:
+            return automaton_state, string in self.keyword_set
+        automaton_state, ids = self.automaton.step(automaton_state, string)
+        return automaton_state, bool(ids) or string in self.keyword_set
+    def scan(self):
+        return scan_state(self) if self.automaton is None else automaton_scan_state(self)
+    def trigger_mask(self, classes):
+        if self.automaton is None:
+            return classes.keyword_mask(self.keyword_set)
+        return classes.keyword_mask(self.keyword_set) | self.automaton.trigger_masks(classes.words)[0]
     def clean(self):
-        self.last_distance = None
+        super().clean()
+        self.state = 0
 class condition_floatpercent_in_last_n_words(condition_float_in_last_n_words):
-    def check(self, string):
-        if ispercent(string):
-            self.last_distance = 0
-        else:
-            if self.last_distance is not None:
-                self.last_distance += 1
-        if self.last_distance is not None and self.last_distance < self.max_distance:
-            return True
-        else:
-            return False
+    def is_trigger(self, string):
+        return ispercent(string)
+    def trigger_mask(self, classes):
+        return classes.percent_mask()
 class condition_floatorpercent_in_last_n_words(condition_float_in_last_n_words):
-    def check(self, string):
-        if ispercent(string) or isfloat(string):
-            self.last_distance = 0
-        else:
-            if self.last_distance is not None:
-                self.last_distance += 1
-        if self.last_distance is not None and self.last_distance < self.max_distance:
-            return True
-        else:
-            return False
+    def is_trigger(self, string):
+        return ispercent(string) or isfloat(string)
+    def trigger_mask(self, classes):
+        return classes.percent_mask() | classes.float_mask()
 
 class negative_condition(condition_base):
     def __init__(self,positive_conditions:condition_base):
@@ -112,8 +258,75 @@ class negative_condition(condition_base):
         self.params = positive_conditions.params
     def check(self, string):
         return not self.positive_conditions.check(string)
+    def update(self, triggered):
+        return not self.positive_conditions.update(triggered)
+    def scan(self):
+        state = self.positive_conditions.scan()
+        if isinstance(state, scan_state):
+            return state.negate()
+        return negative_condition(state)
+    def check_words(self, words, classes = None):
+        return ~self.positive_conditions.check_words(words, classes)
+    def check_trigger_mask(self, trigger):
+        return ~self.positive_conditions.check_trigger_mask(trigger)
     def clean(self):
         self.positive_conditions.clean()
+def keyword_condition(cond):
+    '''
+        Returns condition_keywords_in_last_n_words underlying cond (directly or through negative_condition) or None
+    '''
+    while isinstance(cond, negative_condition):
+        cond = cond.positive_conditions
+    return cond if isinstance(cond, condition_keywords_in_last_n_words) else None
+
+def condition_key(cond):
+    '''
+        Hashable key of the condition, equal for conditions which give equal results on any text
+        (same type and parameters, keyword conditions with the same set of keywords)
+    '''
+    if isinstance(cond, negative_condition):
+        return ('not', condition_key(cond.positive_conditions))
+    if isinstance(cond, condition_keywords_in_last_n_words):
+        return (cond.__class__.__name__, cond.max_distance, frozenset(keyword for keyword in cond.keywords if isinstance(keyword, str)))
+    return (cond.__class__.__name__, json.dumps(cond.params, sort_keys=True, default=repr))
+
+def compile_keyword_conditions(list_of_conditions):
+    '''
+        Compile keywords of all keyword conditions into one shared automaton
+        Ids reported by the automaton are indexes of conditions in list_of_conditions, None if there are no keyword conditions
+    '''
+    keywords_by_id = {}
+    for i, cond in enumerate(list_of_conditions):
+        base = keyword_condition(cond)
+        if base is not None:
+            keywords_by_id[i] = base.keywords
+    if not keywords_by_id:
+        return None
+    return keywords_automaton.keyword_automaton(keywords_by_id)
+
+def check_words_all(list_of_conditions, words, automaton = None, selected = None, classes = None):
+    '''
+        Vectorized evaluation of many conditions over the same list of words
+        Words are classified once, keyword conditions take their triggers from the shared automaton
+        (as returned by compile_keyword_conditions(list_of_conditions))
+        selected is optional list of indexes of conditions to evaluate, all conditions by default
+        classes is optional precomputed token_classes of the words (e.g. of a document of token_corpus),
+        then words may be None
+        Returns list of boolean numpy arrays, one per evaluated condition
+    '''
+    if selected is None:
+        selected = range(len(list_of_conditions))
+    if classes is None:
+        classes = token_classes(words)
+    masks = classes.trigger_masks(automaton) if automaton is not None else {}
+    results = []
+    for i in selected:
+        if i in masks:
+            results.append(list_of_conditions[i].check_trigger_mask(masks[i]))
+        else:
+            results.append(list_of_conditions[i].check_words(classes.words, classes))
+    return results
+
 #Conditions factory
 def condition_factory(condition_name,params = None):
     if condition_name == 'condition_float_in_last_n_words':
@@ -0,0 +1,164 @@
+'''
+Preprocessed corpus for condition based text binary classification
+Each document is tokenized and normalized only once, the list of words is stored under a content hash
+'''
+
+import hashlib
+import threading
+from collections import OrderedDict
+import htmltransform
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+def _call(name, function, *args):
+    return function(*args)
+
+
+def _regex_words(text, tag_text_sep, normalize):
+    return list(htmltransform.iter_regex_words(text, tag_text_sep, normalize))
+
+
+def preprocess_text(intext: str, ishtml: bool = True, html_backend: str = 'bs4', tokenizer: str = 'nltk', stats=None) -> List[str]:
+    """
+    Convert plain text/HTML string into the list of words passed through the conditions.
+
+    :param intext: plain text/HTML string to be processed
+    :param ishtml: If True, extract text from HTML and apply rule based replacements
+    :param html_backend: HTML parsing backend (see htmltransform.HTML_BACKENDS)
+    :param tokenizer: 'nltk' (reference implementation) or 'regex' (fused single pass tokenizer, see htmltransform.iter_regex_words)
+    :param stats: Optional instrumentation.model_stats, time of each stage is added to it
+    :return: List of words
+    """
+    tokenizer = htmltransform.resolve_tokenizer(tokenizer)
+    call = stats.timed if stats is not None else _call
+    if ishtml:
+        text = call('extract_text_from_html', htmltransform.extract_text_from_html, intext, "#", html_backend)
+        if tokenizer == 'regex':
+            return call('regex_tokenizer', _regex_words, text, "#", True)
+        words = call('word_tokenization_ext', htmltransform.word_tokenization_ext, text)
+        words = call('words_rule_based_replacement', htmltransform.words_rule_based_replacement, words)
+    elif tokenizer == 'regex':
+        words = call('regex_tokenizer', _regex_words, intext, None, False)
+    else:
+        words = call('word_tokenize', htmltransform.word_tokenize, intext)
+    return words
+
+
+def iter_preprocess_text(source, ishtml: bool = True, block_size: int = 1 << 14) -> Iterator[str]:
+    """
+    Streaming version of preprocess_text: words are produced incrementally from the text chunks.
+
+    :param source: plain text/HTML string, file object or iterable of str/bytes chunks
+    :param ishtml: If True, extract text from HTML and apply rule based replacements
+    :param block_size: Minimal size of the text buffer split into sentences at once
+    :return: Generator of words
+    """
+    if ishtml:
+        return htmltransform.iter_words_from_html(source, tag_text_sep="#", block_size=block_size)
+    return htmltransform.iter_words_from_text(source, block_size=block_size)
+
+
+def content_hash(intext: str, ishtml: bool = True, html_backend: str = 'bs4', tokenizer: str = 'nltk') -> bytes:
+    """
+    Compute the content hash used as a key of the preprocessed corpus.
+
+    :param intext: plain text/HTML string
+    :param ishtml: Preprocessing mode, documents preprocessed in different modes get different keys
+    :param html_backend: HTML parsing backend, HTML documents parsed by different backends get different keys
+    :param tokenizer: Tokenizer, documents tokenized by different tokenizers get different keys
+    :return: Digest of the document
+    """
+    h = hashlib.blake2b(intext.encode('utf-8', 'surrogatepass'), digest_size=16)
+    h.update(b'h' if ishtml else b't')
+    if ishtml and html_backend != 'bs4':
+        h.update(html_backend.encode('ascii'))
+    if tokenizer != 'nltk':
+        h.update(b':' + tokenizer.encode('ascii'))
+    return h.digest()
+
+
+class preprocessed_corpus():
+    def __init__(self, maxsize: Optional[int] = 10000, html_backend: str = 'bs4', tokenizer: str = 'nltk'):
+        """
+        Initialize the corpus cache.
+
+        :param maxsize: Maximal number of documents kept in the cache (least recently used are dropped first),
+                        None for unbounded cache
+        :param html_backend: Default HTML parsing backend (see htmltransform.HTML_BACKENDS)
+        :param tokenizer: Default tokenizer (see htmltransform.TOKENIZERS)
+        """
+        if maxsize is not None and maxsize < 1:
+            raise Exception(f'maxsize must be positive or None, got {maxsize}')
+        self.maxsize = maxsize
+        self.html_backend = htmltransform.resolve_html_backend(html_backend)
+        self.tokenizer = htmltransform.resolve_tokenizer(tokenizer)
+        self._words = OrderedDict()
+        self._lock = threading.Lock()  # Threads sharing the cache update the LRU order and the counters one at a time
+        self.hits = 0
+        self.misses = 0
+
+    def get_words(self, intext: str, ishtml: bool = True, html_backend: Optional[str] = None, tokenizer: Optional[str] = None, stats=None) -> Tuple[str, ...]:
+        """
+        Return the preprocessed words of the document, preprocessing it only if it is not cached yet.
+
+        :param intext: plain text/HTML string
+        :param ishtml: If True, text is HTML
+        :param html_backend: HTML parsing backend (html_backend of the corpus by default)
+        :param tokenizer: Tokenizer (tokenizer of the corpus by default)
+        :param stats: Optional instrumentation.model_stats, time of preprocessing stages is added to it on a cache miss
+        :return: Tuple of words
+        """
+        html_backend = self.html_backend if html_backend is None else htmltransform.resolve_html_backend(html_backend)
+        tokenizer = self.tokenizer if tokenizer is None else htmltransform.resolve_tokenizer(tokenizer)
+        key = content_hash(intext, ishtml, html_backend, tokenizer)
+        with self._lock:
+            words = self._words.get(key)
+            if words is not None:
+                self._words.move_to_end(key)
+                self.hits += 1
+                return words
+            self.misses += 1
+        # Documents are preprocessed outside of the lock, so threads preprocess different documents in parallel
+        words = tuple(preprocess_text(intext, ishtml, html_backend, tokenizer, stats))
+        with self._lock:
+            self._words[key] = words
+            if self.maxsize is not None and len(self._words) > self.maxsize:
+                self._words.popitem(last=False)
+        return words
+
+    def get_many(self, list_of_texts: Iterable[str], ishtml: bool = True, html_backend: Optional[str] = None, tokenizer: Optional[str] = None) -> List[Tuple[str, ...]]:
+        """
+        Return the preprocessed words for each document of the list.
+
+        :param list_of_texts: Iterable of plain text/HTML strings
+        :param ishtml: If True, texts are HTML
+        :param html_backend: HTML parsing backend (html_backend of the corpus by default)
+        :param tokenizer: Tokenizer (tokenizer of the corpus by default)
+        :return: List of tuples of words
+        """
+        return [self.get_words(intext, ishtml, html_backend, tokenizer) for intext in list_of_texts]
+
+    def clear(self):
+        """
+        Remove all documents from the cache.
+        """
+        with self._lock:
+            self._words.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._words)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __contains__(self, intext):
+        return (content_hash(intext, True, self.html_backend, self.tokenizer) in self._words
+                or content_hash(intext, False, tokenizer=self.tokenizer) in self._words)
@@ -0,0 +1,164 @@
+'''
+K-fold cross-validation of cbtbc_model training
+Documents are preprocessed and passed through the conditions once, activation matrices of the folds
+are sliced from the activation matrix of the whole corpus. The training part of each fold is optimized
+in a separate process and the held-out part is scored on the same sliced data, so run() is never called.
+'''
+
+import multiprocessing
+import random
+import time
+import numpy as np
+import activation
+import corpus
+import token_corpus
+import worker_pool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def kfold_indices(n_documents: int, n_folds: int = 5, shuffle: bool = True, seed: int = 0,
+                  list_of_labels: Optional[Sequence[bool]] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Split documents into folds.
+
+    :param n_documents: Number of documents
+    :param n_folds: Number of folds
+    :param shuffle: If True, documents are shuffled before splitting
+    :param seed: Random seed of shuffling
+    :param list_of_labels: Optional labels, if provided each fold gets the same fraction of documents of each label
+    :return: List of (training indices, held-out indices) for each fold
+    """
+    if n_folds < 2 or n_folds > n_documents:
+        raise Exception(f'n_folds must be between 2 and number of documents ({n_documents}), got {n_folds}')
+    rnd = np.random.default_rng(seed)
+    if list_of_labels is None:
+        groups = [np.arange(n_documents)]
+    else:
+        labels = np.asarray(list_of_labels, dtype=bool)
+        groups = [np.flatnonzero(labels), np.flatnonzero(~labels)]
+    fold_of_document = np.empty(n_documents, dtype=np.int64)
+    start = 0
+    for group in groups:
+        if shuffle:
+            group = rnd.permutation(group)
+        # Folds are filled round robin, continuing from the fold where the previous group stopped
+        fold_of_document[group] = (start + np.arange(len(group))) % n_folds
+        start = (start + len(group)) % n_folds
+    return [(np.flatnonzero(fold_of_document != fold), np.flatnonzero(fold_of_document == fold)) for fold in range(n_folds)]
+
+
+def _run_fold(task) -> Dict:
+    setting_index, fold, train_indices, test_indices, setting, seed = task
+    import cbtbc_model
+    start = time.perf_counter()
+    # Activation matrix of the whole corpus, kept by the worker process
+    matrix = worker_pool.worker_object('cross_validation.matrix')
+    train_matrix = matrix.subset(train_indices)
+    test_matrix = matrix.subset(test_indices)
+    slicing_seconds = time.perf_counter() - start
+    # Random search methods get different but reproducible random sequences in each fold,
+    # the state of the global generator is restored for the caller when folds run in its process
+    random_state = random.getstate()
+    random.seed(seed * 1000003 + setting_index * 1009 + fold)
+    try:
+        start = time.perf_counter()
+        train_errors, switches, evaluations, _ = cbtbc_model.search_conditions_switches(train_matrix, count_evaluations=True, **setting)
+        search_seconds = time.perf_counter() - start
+    finally:
+        random.setstate(random_state)
+    test_errors = test_matrix.errors(switches)
+    return {'fold': fold, 'n_train': len(train_indices), 'n_test': len(test_indices),
+            'train_errors': int(train_errors), 'test_errors': int(test_errors), 'test_error_rate': test_errors / len(test_indices),
+            'conditions_switches': [bool(switch) for switch in switches], 'evaluations': evaluations,
+            'slicing_seconds': slicing_seconds, 'search_seconds': search_seconds}
+
+
+def cross_validate_settings(model, list_of_htmls: List[str], list_of_labels: List[bool], list_of_settings: List[Dict], n_folds: int = 5,
+                            ishtml: bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None, n_jobs: Optional[int] = None,
+                            stratified: bool = True, seed: int = 0, deduplicate: bool = True, verbose: int = 0) -> List[Dict]:
+    """
+    Cross-validate training of the model with several training settings on the same folds.
+
+    :param model: cbtbc_model instance, its conditions are not changed
+    :param list_of_htmls: List of HTML strings (or plain texts) or token_corpus.token_corpus of preprocessed documents
+    :param list_of_labels: Corresponding list of labels (True/False)
+    :param list_of_settings: List of dictionaries with parameters of cbtbc_model.search_conditions_switches
+                             ('method', 'n_iter', 'trueprob', 'max_nodes', 'max_time')
+    :param n_folds: Number of folds
+    :param ishtml: If True, list_of_htmls contains HTML strings, otherwise plain texts
+    :param corpus_cache: Optional preprocessed corpus used to take words of the documents from
+    :param n_jobs: Number of processes optimizing folds (None - number of CPUs, 1 - in the current process)
+    :param stratified: If True, each fold gets the same fraction of documents of each label
+    :param seed: Random seed of folds and of random search methods
+    :param deduplicate: If True, documents with identical words are scored once and counted with their number of copies
+    :param verbose: Verbosity level (1: progress bar)
+    :return: Report for each setting: dictionary with 'setting', per fold results 'folds' (errors on training and held-out
+             documents, chosen switches, timings), 'mean_test_error_rate', 'test_errors' and timings of shared stages
+    """
+    from tqdm import tqdm  # Importing tqdm module for progress bar
+    if len(list_of_htmls) != len(list_of_labels):
+        raise Exception('Length of list_of_htmls and list_of_labels must be equal')
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs < 1:
+        raise Exception(f'n_jobs must be positive, got {n_jobs}')
+    start = time.perf_counter()
+    if isinstance(list_of_htmls, token_corpus.token_corpus):
+        list_of_words = list_of_htmls
+    else:
+        if corpus_cache is None:
+            corpus_cache = corpus.preprocessed_corpus(maxsize=max(len(list_of_htmls), 1))
+        list_of_words = corpus_cache.get_many(list_of_htmls, ishtml, model.html_backend, model.tokenizer)
+    preprocessing_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    matrix = activation.activation_matrix.from_model(model, list_of_words, list_of_labels, deduplicate)
+    activation_seconds = time.perf_counter() - start
+    folds = kfold_indices(len(list_of_htmls), n_folds, seed=seed, list_of_labels=list_of_labels if stratified else None)
+    # Bruteforce searches of folds run in one process each
+    tasks = [(setting_index, fold, train_indices, test_indices, dict({'n_jobs': 1}, **setting), seed)
+             for setting_index, setting in enumerate(list_of_settings) for fold, (train_indices, test_indices) in enumerate(folds)]
+    start = time.perf_counter()
+    progress = tqdm(total=len(tasks), disable=(verbose != 1), desc='cbtbc cross-validation')
+    if n_jobs == 1 or len(tasks) == 1:
+        worker_pool.set_worker_object('cross_validation.matrix', matrix)
+        results = []
+        try:
+            for task in tasks:
+                results.append(_run_fold(task))
+                progress.update()
+        finally:
+            worker_pool.set_worker_object('cross_validation.matrix', None)
+    else:
+        with worker_pool.pool(min(n_jobs, len(tasks)), 'cross_validation.matrix', matrix) as pool:
+            results = []
+            for fold_result in pool.imap(_run_fold, tasks):
+                results.append(fold_result)
+                progress.update()
+    progress.close()
+    folds_seconds = time.perf_counter() - start
+    reports = []
+    for setting_index, setting in enumerate(list_of_settings):
+        # Results are in the order of tasks
+        fold_results = results[setting_index * len(folds):(setting_index + 1) * len(folds)]
+        reports.append({'setting': dict(setting), 'folds': fold_results,
+                        'test_errors': sum(fold_result['test_errors'] for fold_result in fold_results),
+                        'mean_test_error_rate': float(np.mean([fold_result['test_error_rate'] for fold_result in fold_results])),
+                        'mean_train_errors': float(np.mean([fold_result['train_errors'] for fold_result in fold_results])),
+                        'preprocessing_seconds': preprocessing_seconds, 'activation_seconds': activation_seconds,
+                        'folds_seconds': folds_seconds})
+    return reports
+
+
+def cross_validate(model, list_of_htmls: List[str], list_of_labels: List[bool], n_folds: int = 5, method: str = 'bnb', n_iter=100, trueprob=0.5,
+                   max_nodes: Optional[int] = None, max_time: Optional[float] = None, ishtml: bool = True,
+                   corpus_cache: Optional[corpus.preprocessed_corpus] = None, n_jobs: Optional[int] = None, stratified: bool = True,
+                   seed: int = 0, deduplicate: bool = True, verbose: int = 0) -> Dict:
+    """
+    Cross-validate training of the model, see cbtbc_model.train_minimize_number_of_conditions for training parameters
+    and cross_validate_settings for the other ones.
+
+    :return: Dictionary with per fold results 'folds', 'mean_test_error_rate', 'test_errors' and timings of shared stages
+    """
+    setting = {'method': method, 'n_iter': n_iter, 'trueprob': trueprob, 'max_nodes': max_nodes, 'max_time': max_time}
+    return cross_validate_settings(model, list_of_htmls, list_of_labels, [setting], n_folds, ishtml, corpus_cache, n_jobs,
+                                   stratified, seed, deduplicate, verbose)[0]
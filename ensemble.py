@@ -0,0 +1,161 @@
+'''
+Multi-class (one-vs-rest) ensemble of cbtbc models
+Each document is preprocessed once and passed word by word through the conditions of all models at once.
+Identical conditions of different models are evaluated once and keywords of all keyword conditions
+are looked up in one shared automaton. Each model stops as soon as its own result is True,
+the scan stops when all models are done.
+'''
+
+import conditions
+import corpus
+import htmltransform
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+
+class cbtbc_ensemble():
+    def __init__(self, models: Union[Dict[Hashable, object], Iterable[Tuple[Hashable, object]]]):
+        """
+        Initialize the ensemble.
+
+        :param models: Dictionary (or iterable of pairs) of class labels to cbtbc_model instances.
+                       Models are evaluated with their conditions_switches, top_level_operation,
+                       html_backend and tokenizer
+        """
+        self.models = dict(models)
+        self.labels = list(self.models)
+        self.compile()
+
+    def compile(self):
+        """
+        Build the shared evaluation plan, it must be called again if conditions of the models are changed.
+        """
+        unique_index = {}
+        self.unique_conditions = []
+        self.model_plans = []
+        for label in self.labels:
+            model = self.models[label]
+            if model.conditions is None:
+                self.model_plans.append(None)
+                continue
+            switches = model.conditions_switches
+            units = []
+            for i, cond in enumerate(model.conditions):
+                if switches is not None and not (i < len(switches) and switches[i]):
+                    continue
+                key = conditions.condition_key(cond)
+                unit = unique_index.get(key)
+                if unit is None:
+                    unit = unique_index[key] = len(self.unique_conditions)
+                    self.unique_conditions.append(cond)
+                units.append(unit)
+            self.model_plans.append((model.top_level_operation, tuple(units)))
+        self.automaton = conditions.compile_keyword_conditions(self.unique_conditions)
+        self.keyword_units = frozenset(self.automaton.ids) if self.automaton is not None else frozenset()
+
+    @property
+    def n_unique_conditions(self) -> int:
+        return len(self.unique_conditions)
+
+    def preprocessing_settings(self) -> List[Tuple[str, str]]:
+        """
+        Distinct (html_backend, tokenizer) pairs of the models, a document is preprocessed once for each of them.
+        """
+        settings = []
+        for label in self.labels:
+            model = self.models[label]
+            setting = (htmltransform.resolve_html_backend(model.html_backend), model.tokenizer)
+            if setting not in settings:
+                settings.append(setting)
+        return settings
+
+    def run(self, intext: str, ishtml: bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None) -> Dict[Hashable, bool]:
+        """
+        Run all models on the document.
+
+        :param intext: plain text/HTML string to be processed
+        :param ishtml: If True, intext is HTML
+        :param corpus_cache: Optional preprocessed corpus, words of intext are taken from it instead of re-parsing
+        :return: Dictionary of class labels to results of their models
+        """
+        settings = self.preprocessing_settings()
+        if len(settings) == 1:
+            return self.run_words(self._words(intext, ishtml, settings[0], corpus_cache))
+        # Models with different preprocessing: groups of models sharing it are scanned separately
+        results = {}
+        for setting in settings:
+            selected = [label for label in self.labels
+                        if (htmltransform.resolve_html_backend(self.models[label].html_backend), self.models[label].tokenizer) == setting]
+            results.update(self.run_words(self._words(intext, ishtml, setting, corpus_cache), selected))
+        return {label: results[label] for label in self.labels}
+
+    def _words(self, intext, ishtml, setting, corpus_cache):
+        html_backend, tokenizer = setting
+        if corpus_cache is not None:
+            return corpus_cache.get_words(intext, ishtml, html_backend, tokenizer)
+        return corpus.preprocess_text(intext, ishtml, html_backend, tokenizer)
+
+    def predict_labels(self, intext: str, ishtml: bool = True, corpus_cache: Optional[corpus.preprocessed_corpus] = None) -> Set[Hashable]:
+        """
+        Run all models on the document and return the labels of classes whose models accept it (multi-label result).
+
+        :param intext: plain text/HTML string to be processed
+        :param ishtml: If True, intext is HTML
+        :param corpus_cache: Optional preprocessed corpus
+        :return: Set of class labels
+        """
+        return {label for label, result in self.run(intext, ishtml, corpus_cache).items() if result}
+
+    def run_words(self, words: Iterable[str], labels: Optional[List[Hashable]] = None) -> Dict[Hashable, bool]:
+        """
+        Run models on already preprocessed words in a single scan.
+
+        :param words: Iterable of words (as produced by corpus.preprocess_text)
+        :param labels: Optional list of class labels whose models are run (all by default)
+        :return: Dictionary of class labels to results of their models
+        """
+        selected = set(self.labels if labels is None else labels)
+        results = {}
+        pending = []  # (label, top level operation, units) of models which are not done yet
+        for label, plan in zip(self.labels, self.model_plans):
+            if label not in selected:
+                continue
+            results[label] = False
+            if plan is not None:
+                pending.append((label,) + plan)
+        # Per call scan states, conditions of the ensemble are not changed
+        scans = [cond.scan() for cond in self.unique_conditions]
+        automaton = self.automaton
+        keyword_units = self.keyword_units
+        active = sorted(set(unit for _, _, units in pending for unit in units))
+        values = [False] * len(self.unique_conditions)
+        state = 0
+        triggered = ()
+        for word in words:
+            if not pending:
+                break
+            if automaton is not None:
+                state, triggered = automaton.step(state, word)
+            for unit in active:
+                scan = scans[unit]
+                values[unit] = scan.update(unit in triggered) if unit in keyword_units else scan.check(word)
+            still_pending = []
+            for item in pending:
+                label, operation, units = item
+                if operation == 'and':
+                    done = all(values[unit] for unit in units)
+                elif operation == 'or':
+                    done = any(values[unit] for unit in units)
+                else:
+                    done = False
+                if done:
+                    results[label] = True
+                else:
+                    still_pending.append(item)
+            if len(still_pending) != len(pending):
+                # Conditions used only by finished models are not evaluated any more
+                pending = still_pending
+                active = sorted(set(unit for _, _, units in pending for unit in units))
+        return results
+
+    def __str__(self):
+        return f'{self.__class__.__name__}({self.labels})'
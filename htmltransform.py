@@ -1,15 +1,99 @@
-from nltk.tokenize import sent_tokenize, word_tokenize  # Importing tokenization functions from nltk
-from bs4 import BeautifulSoup  # Importing BeautifulSoup for HTML parsing
+# nltk, bs4 and lxml are imported on first use, so importing the module stays cheap (see warmup)
+from html.parser import HTMLParser  # Importing event driven HTML parser for streaming text extraction
+import codecs
+import functools
+import re
+import html.entities as html_entities
 from conditions import isfloat, ispercent  # Importing specific conditions
 
-def extract_text_from_html(html, tag_text_sep="#"):
+HTML_BACKENDS = ('bs4', 'htmlparser', 'lxml', 'fast')
+
+
+def word_tokenize(text, language='english', preserve_line=False):
+    """
+    nltk word_tokenize, nltk is imported on the first call.
+    """
+    from nltk.tokenize import word_tokenize as nltk_word_tokenize
+    return nltk_word_tokenize(text, language, preserve_line)
+
+
+@functools.lru_cache(maxsize=None)
+def _lxml_etree():
+    try:
+        from lxml import etree  # Optional fast HTML parser
+    except ImportError:
+        return None
+    return etree
+
+
+def resolve_html_backend(backend):
+    """
+    Check the name of HTML parsing backend and resolve 'fast' into the fast backend which gives the same text as bs4.
+
+    :param backend: Name of the backend (one of HTML_BACKENDS)
+    :return: Name of the backend which will be used
+    """
+    if backend not in HTML_BACKENDS:
+        raise Exception(f'Unknown HTML backend {backend}, expected one of {HTML_BACKENDS}')
+    if backend == 'fast':
+        # lxml repairs malformed and misnested markup differently from bs4, htmlparser gives the same text
+        backend = 'htmlparser'
+    if backend == 'lxml' and _lxml_etree() is None:
+        raise Exception('HTML backend lxml requires lxml package')
+    return backend
+
+
+def _lxml_text_pieces(html):
+    """
+    Text nodes of HTML outside of skipped elements (html_text_extractor.skip_tags) parsed by lxml, stripped and without empty ones.
+    """
+    if not html.strip():
+        return []
+    etree = _lxml_etree()
+    parser = etree.HTMLParser(remove_comments=False, remove_pis=False)
+    root = etree.fromstring(html, parser)
+    if root is None:
+        return []
+    pieces = []
+    stack = [(root, False)]  # (element, its children are already visited)
+    while stack:
+        element, visited = stack.pop()
+        if visited:
+            if element.tail and element is not root:
+                pieces.append(element.tail)
+            continue
+        if not isinstance(element.tag, str):
+            # Comments and processing instructions: only their tail is text
+            if element.tail:
+                pieces.append(element.tail)
+            continue
+        stack.append((element, True))
+        if element.tag in html_text_extractor.skip_tags:
+            continue
+        if element.text:
+            pieces.append(element.text)
+        stack.extend((child, False) for child in reversed(element))
+    return [piece for piece in (' '.join(piece.split()) for piece in pieces) if piece]
+
+
+def extract_text_from_html(html, tag_text_sep="#", backend='bs4'):
     """
     Extract text from HTML content, removing script and style elements and joining text with a separator.
 
     :param html: HTML string to be processed
     :param tag_text_sep: Separator to use between different HTML tags' text content
+    :param backend: HTML parsing backend (see HTML_BACKENDS): 'bs4' (BeautifulSoup tree, reference implementation),
+                    'htmlparser' (event driven stdlib parser, no tree), 'lxml' (requires lxml, text of malformed or
+                    misnested markup may differ from bs4), 'fast' ('htmlparser')
     :return: Extracted and cleaned text
     """
+    backend = resolve_html_backend(backend)
+    if backend == 'htmlparser':
+        return ''.join(iter_text_from_html([html], tag_text_sep))
+    if backend == 'lxml':
+        text = tag_text_sep.join(_lxml_text_pieces(html))
+        return ' '.join(text.split())  # Normalize whitespace
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'html.parser')
     for script in soup(['script', 'style']):
         script.extract()  # Remove script and style elements
@@ -25,9 +109,7 @@ def word_tokenization_ext(text):
     :return: List of tokenized words
     """
     words = word_tokenize(text)
-    while "#" in words:
-        words.remove("#")  # Remove '#' tokens
-    return words
+    return [word for word in words if word != "#"]  # Remove '#' tokens
 
 def words_rule_based_replacement(words):
     """
@@ -42,7 +124,384 @@ def words_rule_based_replacement(words):
             words[i-1] = words[i-1] + words[i]  # Join float and percent sign
             words[i] = ''
     # Remove empty strings
-    while '' in words:
-        words.remove('')
+    words[:] = [word for word in words if word != '']
+
+    return words
+
+# Fused regex tokenizer
+# One linear pass over the text doing tokenization, separator dropping, lowercasing and float-percent merging.
+# It approximates nltk word_tokenize: floats, percents and words are split in the same way, but sentence
+# boundaries are not detected (a period after a word or a number is always a separate token).
+
+TOKENIZERS = ('nltk', 'regex')
+
+_REGEX_TOKEN = re.compile(r"""
+    (?P<number>[-+]?(?:\d+(?:[.,:/-]\d+)*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w]|[.,:/-]\w)  # 10.5, 1,000.50, -5, .5, 1e5, 5-10
+  | \w+?(?=(?i:n't)\b)                                     # 'do' of "don't"
+  | (?i:n't|'(?:s|m|d|ll|re|ve))\b                          # contractions
+  | \w+(?:(?:[-./=]|'(?!(?i:s|m|d|ll|re|ve)\b))\w+)*        # words: state-of-the-art, u.s, b.com, o'clock
+  | \.\.\.|--                                               # ellipsis and dash
+  | (?P<open_quote>(?<![^\s(\[{<])")                         # quotes are converted as nltk does
+  | (?P<close_quote>")
+  | \S                                                      # any other character
+""", re.VERBOSE)
+
+
+def resolve_tokenizer(tokenizer):
+    """
+    Check the name of the tokenizer.
+
+    :param tokenizer: Name of the tokenizer (one of TOKENIZERS)
+    :return: Name of the tokenizer
+    """
+    if tokenizer not in TOKENIZERS:
+        raise Exception(f'Unknown tokenizer {tokenizer}, expected one of {TOKENIZERS}')
+    return tokenizer
+
+
+def iter_regex_words(text, tag_text_sep="#", normalize=True):
+    """
+    Tokenize the text with the fused regex tokenizer.
+    With normalize=True it is the equivalent of words_rule_based_replacement(word_tokenization_ext(text)),
+    with normalize=False and tag_text_sep=None of word_tokenize(text).
+
+    :param text: Text to be tokenized
+    :param tag_text_sep: Separator token to drop (None - keep all tokens)
+    :param normalize: If True, lowercase words and join floats with following percent signs
+    :return: Generator of words
+    """
+    previous = None
+    for match in _REGEX_TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'open_quote':
+            word = '``'
+        elif kind == 'close_quote':
+            word = "''"
+        else:
+            word = match.group()
+            if word == tag_text_sep:
+                continue
+        if not normalize:
+            yield word
+            continue
+        if word == '%' and previous is not None and isfloat(previous):
+            yield previous + word  # Join float and percent sign
+            previous = None
+            continue
+        if previous is not None:
+            yield previous
+        previous = word.lower()
+    if previous is not None:
+        yield previous
+
+# Streaming pipeline
+# Same processing as extract_text_from_html -> word_tokenization_ext -> words_rule_based_replacement,
+# but text is extracted, tokenized and normalized incrementally with generators
+
+class html_text_extractor(HTMLParser):
+    """
+    Event driven HTML parser collecting text nodes, without building a tree.
+    Text nodes are split by tags, comments and declarations, character references are resolved and text of
+    script, style, template, rt and rp elements is skipped in the same way as BeautifulSoup get_text does.
+    """
+    skip_tags = ('script', 'style', 'template', 'rt', 'rp')
+    void_tags = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+                           'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image',
+                           'isindex', 'nextid', 'spacer'])
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.pieces = []
+        self._data = []
+        self._open_tags = []  # Stack of open elements, end tag closes the nearest open element with the same name
+        self._skip_depth = 0  # Number of open skipped elements
+
+    def _end_data(self):
+        if self._data:
+            if not self._skip_depth:
+                piece = ' '.join(''.join(self._data).split())  # Strip and normalize whitespace
+                if piece:
+                    self.pieces.append(piece)
+            self._data = []
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        if tag in self.void_tags:
+            return
+        self._open_tags.append(tag)
+        if tag in self.skip_tags:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        self._end_data()
+        if tag not in self._open_tags:
+            return
+        while True:
+            open_tag = self._open_tags.pop()
+            if open_tag in self.skip_tags:
+                self._skip_depth -= 1
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_entityref(self, name):
+        character = html_entities.html5.get(name + ';')
+        self._data.append(character if character is not None else '&' + name)
+
+    def handle_charref(self, name):
+        base, pattern = 10, r'^([0-9]+)(.*)'
+        if name[:1] in ('x', 'X'):
+            name, base, pattern = name[1:], 16, r'^([0-9a-f]+)(.*)'
+        extra = ''
+        try:
+            number = int(name, base)
+        except ValueError:
+            # Reference not terminated by a semicolon: its numeric part is the reference, the rest is text
+            match = re.search(pattern, name)
+            if match is None:
+                self._data.append(name)
+                return
+            number, extra = int(match.group(1), base), match.group(2)
+        self._data.append(numeric_character_reference(number) + extra)
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith('CDATA['):
+            # CDATA sections are text nodes
+            self._data.append(data[len('CDATA['):])
+            self._end_data()
+
+    def close(self):
+        super().close()
+        self._end_data()
+
 
-    return words
\ No newline at end of file
+def numeric_character_reference(number):
+    """
+    Character of numeric character reference, invalid references are replaced with U+FFFD
+    and C1 control references with their windows-1252 characters.
+
+    :param number: Code of the reference
+    :return: Character
+    """
+    if number == 0 or number > 0x10ffff or 0xd800 <= number <= 0xdfff:
+        return '\ufffd'
+    if 0x80 <= number <= 0x9f:
+        try:
+            return bytes([number]).decode('windows-1252')
+        except UnicodeDecodeError:
+            pass
+    return chr(number)
+
+
+def iter_text_chunks(source, chunk_size=1 << 16, encoding='utf-8'):
+    """
+    Yield text chunks from a string, a file object or an iterable of chunks.
+
+    :param source: String, file object (text or binary) or iterable of str/bytes chunks
+    :param chunk_size: Number of characters (bytes) read from a file object at once
+    :param encoding: Encoding used to decode bytes chunks
+    :return: Generator of str chunks
+    """
+    if isinstance(source, (str, bytes)):
+        source = [source]
+    elif hasattr(source, 'read'):
+        source = iter(functools.partial(source.read, chunk_size), source.read(0))
+    decoder = None
+    for chunk in source:
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+
+def iter_text_from_html(chunks, tag_text_sep="#"):
+    """
+    Extract text from HTML chunks incrementally, joining text of different tags with a separator.
+    Joined output is equal to extract_text_from_html of the whole HTML.
+
+    :param chunks: Iterable of HTML str chunks
+    :param tag_text_sep: Separator to use between different HTML tags' text content
+    :return: Generator of text increments
+    """
+    # Separator as it looks after whitespace normalization of the whole text
+    sep = ' '.join(tag_text_sep.split())
+    if tag_text_sep and tag_text_sep[0].isspace():
+        sep = ' ' + sep
+    if tag_text_sep and tag_text_sep[-1].isspace() and not sep.endswith(' '):
+        sep = sep + ' '
+    parser = html_text_extractor()
+    first = True
+    chunks = iter(chunks)
+    while parser is not None:
+        chunk = next(chunks, None)
+        if chunk is None:
+            parser.close()
+            pieces, parser = parser.pieces, None
+        else:
+            parser.feed(chunk)
+            pieces, parser.pieces = parser.pieces, []
+        for piece in pieces:
+            yield piece if first else sep + piece
+            first = False
+
+
+@functools.lru_cache(maxsize=None)
+def _punkt_tokenizer(language='english'):
+    from nltk.tokenize import PunktTokenizer
+    return PunktTokenizer(language)
+
+
+def warmup(html_backend='bs4', tokenizer='nltk'):
+    """
+    Import parsing libraries and load tokenizer resources in advance, e.g. before forking worker processes,
+    so they are loaded once and shared by the workers.
+
+    :param html_backend: HTML parsing backend to prepare (see HTML_BACKENDS)
+    :param tokenizer: Tokenizer to prepare (see TOKENIZERS)
+    """
+    text = extract_text_from_html('<p>Warm up.</p><p>10.5 %</p>', backend=html_backend)
+    if resolve_tokenizer(tokenizer) == 'nltk':
+        words_rule_based_replacement(word_tokenization_ext(text))  # Loads punkt data of nltk word_tokenize
+        _punkt_tokenizer()
+
+
+def _separator_cut(buffer, separator, start):
+    """
+    Position right after the last separator in buffer[start:] where the text may be cut without changing its words:
+    separators are tokens of their own and the next part must not start with a quote
+    (word_tokenize turns a leading quote into an opening one). 0 if there is no such position.
+    """
+    position = len(buffer)
+    while True:
+        position = buffer.rfind(separator, start, position)
+        if position < 0:
+            return 0
+        cut = position + len(separator)
+        if cut < len(buffer) and buffer[cut] not in '"\'`':
+            return cut
+
+
+def iter_sentences(chunks, block_size=1 << 14, separator=None):
+    """
+    Split text chunks into sentences in the same way as nltk sent_tokenize does for the whole text.
+    Sentence boundaries depend only on the neighbouring tokens, so the last two sentences of the buffer
+    are kept until more text arrives and all previous ones are final.
+    If separator is given, unfinished sentences longer than block_size (e.g. text of tables without punctuation)
+    are cut after a separator, words of the parts are the same as words of the whole sentence.
+
+    :param chunks: Iterable of text chunks
+    :param block_size: Minimal size of the text buffer split into sentences at once
+    :param separator: Optional separator of text of different HTML tags
+    :return: Generator of sentences
+    """
+    tokenizer = _punkt_tokenizer()
+    parts = []
+    size = 0
+    threshold = block_size
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= threshold:
+            buffer = ''.join(parts)
+            spans = list(tokenizer.span_tokenize(buffer))
+            start = spans[-2][0] if len(spans) > 2 else 0
+            cut = 0
+            if separator and len(buffer) - start >= block_size:
+                cut = _separator_cut(buffer, separator, start)
+            if cut:
+                for span_start, span_end in spans:
+                    if span_start >= cut:
+                        break
+                    yield buffer[span_start:min(span_end, cut)]
+                buffer = buffer[cut:]
+            else:
+                for span_start, span_end in spans[:-2]:
+                    yield buffer[span_start:span_end]
+                buffer = buffer[start:]
+            parts = [buffer]
+            size = len(buffer)
+            threshold = max(block_size, 2 * size)  # Avoid rescanning of long unfinished sentences
+    buffer = ''.join(parts)
+    for start, end in tokenizer.span_tokenize(buffer):
+        yield buffer[start:end]
+
+
+def iter_word_tokenization_ext(sentences):
+    """
+    Tokenize sentences into words, removing '#' tokens (streaming version of word_tokenization_ext).
+
+    :param sentences: Iterable of sentences
+    :return: Generator of words
+    """
+    for sentence in sentences:
+        for word in word_tokenize(sentence, preserve_line=True):
+            if word != "#":
+                yield word
+
+
+def iter_words_rule_based_replacement(words):
+    """
+    Streaming version of words_rule_based_replacement: lowercase words and join floats with following percent signs.
+    Unlike words_rule_based_replacement, a leading '%' is never joined with the last word of the text.
+
+    :param words: Iterable of words
+    :return: Generator of processed words
+    """
+    previous = None
+    for word in words:
+        word = word.lower()
+        if word == '%' and previous is not None and isfloat(previous):
+            previous = previous + word  # Join float and percent sign
+            yield previous
+            previous = ''
+            continue
+        if previous:
+            yield previous
+        previous = word
+    if previous:
+        yield previous
+
+
+def iter_words_from_html(source, tag_text_sep="#", block_size=1 << 14):
+    """
+    Stream normalized words of HTML, the equivalent of
+    words_rule_based_replacement(word_tokenization_ext(extract_text_from_html(html))).
+
+    :param source: HTML string, file object or iterable of chunks
+    :param tag_text_sep: Separator to use between different HTML tags' text content
+    :param block_size: Minimal size of the text buffer split into sentences at once
+    :return: Generator of words
+    """
+    text = iter_text_from_html(iter_text_chunks(source), tag_text_sep)
+    sentences = iter_sentences(text, block_size, ''.join(tag_text_sep.split()) or None)
+    return iter_words_rule_based_replacement(iter_word_tokenization_ext(sentences))
+
+
+def iter_words_from_text(source, block_size=1 << 14):
+    """
+    Stream words of plain text, the equivalent of nltk word_tokenize(text).
+
+    :param source: Text string, file object or iterable of chunks
+    :param block_size: Minimal size of the text buffer split into sentences at once
+    :return: Generator of words
+    """
+    for sentence in iter_sentences(iter_text_chunks(source), block_size):
+        yield from word_tokenize(sentence, preserve_line=True)
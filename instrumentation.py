@@ -0,0 +1,148 @@
+'''
+Opt-in instrumentation of cbtbc_model
+Collects cumulative time and number of calls of pipeline stages, per condition hits and early exit positions
+of runs and statistics of training. Nothing is collected (and nothing is timed) unless the model has
+instrumentation enabled, see cbtbc_model.enable_instrumentation.
+'''
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def condition_triggered(cond) -> bool:
+    """
+    Check whether the trigger of the condition fired on the last checked word.
+
+    :param cond: Condition object or its scan state (see conditions.condition_base.scan), negative conditions are unwrapped
+    :return: True if the last word was a trigger of the condition
+    """
+    while hasattr(cond, 'positive_conditions'):
+        cond = cond.positive_conditions
+    return getattr(cond, 'last_distance', None) == 0
+
+
+class model_stats():
+    def __init__(self, callback: Optional[Callable[[Dict], None]] = None):
+        """
+        Initialize empty statistics.
+
+        :param callback: Optional function called with the record of each run ('event': 'run')
+                         and each training ('event': 'train')
+        """
+        self.callback = callback
+        # Runs of several threads are merged under the lock, each thread builds its own run record
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        Remove all collected statistics.
+        """
+        with self._lock:
+            self.stages = {}
+            self.runs = 0
+            self.early_exits = 0
+            self.early_exit_positions = 0
+            self.words_scanned = 0
+            self.condition_hits = []
+            self.condition_triggers = []
+            self.trainings = []
+        self._local.current = None
+
+    def start_run(self):
+        """
+        Start collecting the record of one run.
+        """
+        self._local.current = {'event': 'run', 'stages': {}}
+
+    def add_stage(self, name: str, seconds: float, calls: int = 1):
+        """
+        Add time of a pipeline stage.
+
+        :param name: Name of the stage
+        :param seconds: Time spent in the stage
+        :param calls: Number of calls of the stage
+        """
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'calls': 0, 'seconds': 0.0}
+            stage['calls'] += calls
+            stage['seconds'] += seconds
+        current = getattr(self._local, 'current', None)
+        if current is not None:
+            current['stages'][name] = current['stages'].get(name, 0.0) + seconds
+
+    def timed(self, name: str, function: Callable, *args):
+        """
+        Call the function and add its time to the stage.
+
+        :return: Result of the function
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        self.add_stage(name, time.perf_counter() - start)
+        return result
+
+    def add_scan(self, hits: List[int], triggers: List[int], words_scanned: int, early_exit_position: Optional[int]):
+        """
+        Add results of the condition scan of one run and finish the run record.
+
+        :param hits: Per condition number of words where the condition was true
+        :param triggers: Per condition number of words where the trigger of the condition fired
+        :param words_scanned: Number of words passed through the conditions
+        :param early_exit_position: Position of the word where the model result became True (None if it did not)
+        """
+        with self._lock:
+            if len(self.condition_hits) < len(hits):
+                self.condition_hits.extend([0] * (len(hits) - len(self.condition_hits)))
+                self.condition_triggers.extend([0] * (len(hits) - len(self.condition_triggers)))
+            for i, (hit, trigger) in enumerate(zip(hits, triggers)):
+                self.condition_hits[i] += hit
+                self.condition_triggers[i] += trigger
+            self.runs += 1
+            self.words_scanned += words_scanned
+            if early_exit_position is not None:
+                self.early_exits += 1
+                self.early_exit_positions += early_exit_position
+        record = getattr(self._local, 'current', None) or {'event': 'run', 'stages': {}}
+        self._local.current = None
+        record.update({'hits': list(hits), 'triggers': list(triggers), 'words_scanned': words_scanned,
+                       'early_exit_position': early_exit_position})
+        if self.callback is not None:
+            self.callback(record)
+
+    def add_training(self, record: Dict):
+        """
+        Add statistics of one training.
+
+        :param record: Dictionary with 'method', 'evaluations', 'search_seconds' and optional search method statistics
+        """
+        record = dict(record, event='train')
+        record['evaluations_per_second'] = record['evaluations'] / record['search_seconds'] if record['search_seconds'] > 0 else None
+        if 'nodes_pruned' in record:
+            considered = record['nodes_expanded'] + record['nodes_pruned']
+            record['prune_ratio'] = record['nodes_pruned'] / considered if considered else 0.0
+        with self._lock:
+            self.trainings.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def as_dict(self) -> Dict:
+        """
+        Return collected statistics.
+
+        :return: Dictionary with 'stages' (name to calls and seconds), 'runs', 'early_exits',
+                 'mean_early_exit_position', 'words_scanned', 'condition_hits', 'condition_triggers' and 'trainings'
+        """
+        with self._lock:
+            return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                    'runs': self.runs,
+                    'early_exits': self.early_exits,
+                    'mean_early_exit_position': self.early_exit_positions / self.early_exits if self.early_exits else None,
+                    'words_scanned': self.words_scanned,
+                    'condition_hits': list(self.condition_hits),
+                    'condition_triggers': list(self.condition_triggers),
+                    'trainings': [dict(record) for record in self.trainings]}
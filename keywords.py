@@ -0,0 +1,214 @@
+'''
+Keyword automaton
+Aho-Corasick automaton over sequences of words. A keyword may consist of several words separated by spaces,
+it is met at the position of its last word. Keywords of many conditions are compiled into one automaton,
+so each word of the text is looked up once for all of them.
+'''
+
+import numpy as np
+from collections import deque
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Sequence, Tuple
+
+NO_IDS = frozenset()
+
+
+def split_keyword(keyword) -> Tuple[str, ...]:
+    """
+    Split keyword into the sequence of words it matches.
+
+    :param keyword: Keyword string, words are separated by whitespaces
+    :return: Tuple of words (empty for keywords which never match a word)
+    """
+    if not isinstance(keyword, str):
+        return ()
+    words = tuple(keyword.split())
+    if len(words) == 1 and words[0] != keyword:
+        return ()  # Words never contain whitespaces, such keyword never matches
+    return words
+
+
+class keyword_automaton():
+    def __init__(self, keywords_by_id: Dict[Hashable, Iterable[str]] = None):
+        """
+        Initialize the automaton.
+
+        :param keywords_by_id: Optional dictionary of ids (usually condition indexes) to their keywords,
+                               if it is provided the automaton is built immediately
+        """
+        self._goto = [{}]
+        self._tables = None  # Transition tables of states whose _goto entry is None, see from_tables
+        self._fail = [0]
+        self._output = [set()]
+        self.max_length = 0
+        self.ids = []
+        self._built = False
+        if keywords_by_id is not None:
+            for keyword_id, keywords in keywords_by_id.items():
+                self.add_keywords(keywords, keyword_id)
+            self.build()
+
+    def add_keywords(self, keywords: Iterable[str], keyword_id: Hashable):
+        """
+        Add keywords to the automaton, all of them are reported with the same id.
+
+        :param keywords: Iterable of keywords
+        :param keyword_id: Id reported when any of the keywords is met
+        """
+        if self._built:
+            raise Exception('keyword_automaton is already built')
+        if keyword_id not in self.ids:
+            self.ids.append(keyword_id)
+        for keyword in keywords:
+            words = split_keyword(keyword)
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                    self._goto[state][word] = next_state
+                state = next_state
+            self._output[state].add(keyword_id)
+            self.max_length = max(self.max_length, len(words))
+
+    def build(self):
+        """
+        Compute failure links, after that the automaton can be used.
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(word, 0)
+                self._fail[next_state] = fail if fail != next_state else 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+        self._output = [frozenset(output) if output else NO_IDS for output in self._output]
+        self._built = True
+
+    def _transitions(self, state: int) -> Dict[str, int]:
+        """
+        Transitions of the state, an automaton restored by from_tables turns them into a dictionary on the first visit.
+        """
+        goto = self._goto[state]
+        if goto is None:
+            labels, offsets, targets = self._tables
+            start, stop = int(offsets[state]), int(offsets[state + 1])
+            goto = self._goto[state] = dict(zip(labels[start:stop], targets[start:stop].tolist()))
+        return goto
+
+    def step(self, state: int, word: str) -> Tuple[int, FrozenSet]:
+        """
+        Pass one word through the automaton.
+
+        :param state: Current state (0 at the beginning of the text)
+        :param word: Next word
+        :return: Tuple of the new state and the set of ids of keywords ending at this word
+        """
+        goto = self._goto
+        while True:
+            try:
+                next_state = goto[state].get(word)
+            except AttributeError:
+                next_state = self._transitions(state).get(word)
+            if next_state is not None:
+                return next_state, self._output[next_state]
+            if state == 0:
+                return 0, NO_IDS
+            state = self._fail[state]
+
+    def scan(self, words: Iterable[str]):
+        """
+        Pass the words through the automaton.
+
+        :param words: Iterable of words
+        :return: Generator of (position, set of ids) for positions where at least one keyword ends
+        """
+        state = 0
+        step = self.step
+        for position, word in enumerate(words):
+            state, ids = step(state, word)
+            if ids:
+                yield position, ids
+
+    def trigger_masks(self, words: Sequence[str]) -> Dict[Hashable, np.ndarray]:
+        """
+        Compute for each id the positions where its keywords end.
+
+        :param words: Sequence of words
+        :return: Dictionary of ids to boolean arrays with one element per word
+        """
+        if self.max_length <= 1:
+            # Single word keywords only: each distinct word is looked up once
+            root = self._transitions(0)
+            index = {}
+            inverse = np.fromiter((index.setdefault(word, len(index)) for word in words), dtype=np.intp, count=len(words))
+            flags = {keyword_id: np.zeros(len(index), dtype=bool) for keyword_id in self.ids}
+            for unique_position, word in enumerate(index):
+                state = root.get(word)
+                if state is not None:
+                    for keyword_id in self._output[state]:
+                        flags[keyword_id][unique_position] = True
+            return {keyword_id: unique_flags[inverse] for keyword_id, unique_flags in flags.items()}
+        masks = {keyword_id: np.zeros(len(words), dtype=bool) for keyword_id in self.ids}
+        for position, ids in self.scan(words):
+            for keyword_id in ids:
+                masks[keyword_id][position] = True
+        return masks
+
+    def to_tables(self) -> Dict[str, object]:
+        """
+        Export the built automaton as flat tables (used by model files).
+
+        :return: Dictionary with 'labels' (list of words of transitions ordered by source state),
+                 'edge_offsets' (transitions of state i are edge_offsets[i]:edge_offsets[i + 1]), 'edge_targets',
+                 'fail', 'output_index' (index of the output set of each state in 'output_sets'),
+                 'output_sets' (list of lists of ids), 'ids' and 'max_length'
+        """
+        if not self._built:
+            raise Exception('keyword_automaton is not built')
+        labels = []
+        targets = []
+        offsets = [0]
+        for state in range(len(self._fail)):
+            goto = self._transitions(state)
+            labels.extend(goto.keys())
+            targets.extend(goto.values())
+            offsets.append(len(labels))
+        output_sets = {NO_IDS: 0}
+        output_index = [output_sets.setdefault(output, len(output_sets)) for output in self._output]
+        return {'labels': labels,
+                'edge_offsets': np.array(offsets, dtype=np.int64),
+                'edge_targets': np.array(targets, dtype=np.int32),
+                'fail': np.array(self._fail, dtype=np.int32),
+                'output_index': np.array(output_index, dtype=np.int32),
+                'output_sets': [sorted(output) for output in output_sets],
+                'ids': list(self.ids),
+                'max_length': self.max_length}
+
+    @classmethod
+    def from_tables(cls, labels: List[str], edge_offsets: np.ndarray, edge_targets: np.ndarray, fail: np.ndarray,
+                    output_index: np.ndarray, output_sets: List[List[Hashable]], ids: List[Hashable], max_length: int):
+        """
+        Restore the built automaton from the tables of to_tables without adding keywords one by one.
+
+        :return: keyword_automaton
+        """
+        automaton = cls()
+        # Transitions are restored when a state is visited first, so loading does not depend on the number of keywords
+        automaton._goto = [None] * len(fail)
+        automaton._tables = (labels, np.asarray(edge_offsets), np.asarray(edge_targets))
+        sets = [frozenset(output) if output else NO_IDS for output in output_sets]
+        automaton._fail = np.asarray(fail).tolist()
+        automaton._output = list(map(sets.__getitem__, np.asarray(output_index).tolist()))
+        automaton.ids = list(ids)
+        automaton.max_length = max_length
+        automaton._built = True
+        return automaton
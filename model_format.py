@@ -0,0 +1,225 @@
+'''
+Versioned model file format
+File layout (little endian): magic (8 bytes), format version (uint32), reserved (uint32), header length (uint64),
+JSON header padded to 8 bytes, blobs aligned to 8 bytes.
+The header describes the top level operation, conditions (type and params), switches and settings of the model,
+keyword lists and tables of the compiled keyword automaton are stored in blobs. The file is memory mapped,
+keyword lists are loaded by a few bulk operations and the automaton tables stay in the mapped file
+until states of the automaton are visited.
+'''
+
+import json
+import mmap
+import struct
+import numpy as np
+import conditions
+import keywords as keywords_automaton
+from typing import Dict, List, Optional
+
+MAGIC = b'CBTBCMF\x00'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sIIQ')
+_ALIGNMENT = 8
+_STRING_SEPARATOR = '\x00'
+
+
+def _padding(length: int) -> int:
+    return -length % _ALIGNMENT
+
+
+class _blob_writer():
+    def __init__(self):
+        self.blobs = []
+        self.descriptions = []
+        self.size = 0
+
+    def add(self, data: bytes, dtype: str) -> int:
+        """
+        Add blob and return its index in the header.
+        """
+        self.descriptions.append({'offset': self.size, 'length': len(data), 'dtype': dtype})
+        self.blobs.append(data)
+        self.blobs.append(b'\x00' * _padding(len(data)))
+        self.size += len(data) + _padding(len(data))
+        return len(self.descriptions) - 1
+
+    def add_strings(self, strings: List[str]) -> int:
+        for string in strings:
+            if not isinstance(string, str) or _STRING_SEPARATOR in string:
+                raise Exception(f'Keywords stored in model file must be strings without NUL characters, got {string!r}')
+        return self.add(_STRING_SEPARATOR.join(strings).encode('utf-8'), 'str')
+
+    def add_array(self, array: np.ndarray, dtype: str) -> int:
+        return self.add(np.ascontiguousarray(array, dtype=dtype).tobytes(), dtype)
+
+
+def _condition_record(cond, writer: _blob_writer) -> Dict:
+    negative = 0
+    while isinstance(cond, conditions.negative_condition):
+        cond = cond.positive_conditions
+        negative += 1
+    params = dict(cond.params) if cond.params is not None else None
+    record = {'type': cond.__class__.__name__, 'negative': negative}
+    if isinstance(cond, conditions.condition_keywords_in_last_n_words):
+        keywords = list(params.pop('keywords'))
+        record['keywords'] = writer.add_strings(keywords)
+        record['n_keywords'] = len(keywords)
+        keyword_set = sorted(cond.keyword_set)
+        record['keyword_set'] = writer.add_strings(keyword_set)
+        record['n_keyword_set'] = len(keyword_set)
+    record['params'] = params
+    return record
+
+
+def write_model_file(filename: str, list_of_conditions: List[object], top_level_operation: str = 'and',
+                     conditions_switches: Optional[List[bool]] = None, automaton=None, settings: Optional[Dict] = None):
+    """
+    Write the model to a file.
+
+    :param filename: Name of the file
+    :param list_of_conditions: List of condition objects (None for a model without conditions)
+    :param top_level_operation: Top level operation of the model ('and' or 'or')
+    :param conditions_switches: Optional list of booleans (trained switches of the conditions)
+    :param automaton: Optional compiled keyword automaton of the conditions (conditions.compile_keyword_conditions)
+    :param settings: Optional dictionary of other JSON serializable settings of the model
+    """
+    writer = _blob_writer()
+    header = {'format_version': FORMAT_VERSION,
+              'top_level_operation': top_level_operation,
+              'conditions': None if list_of_conditions is None else [_condition_record(cond, writer) for cond in list_of_conditions],
+              'conditions_switches': None if conditions_switches is None else [bool(switch) for switch in conditions_switches],
+              'settings': settings or {},
+              'automaton': None}
+    if automaton is not None:
+        tables = automaton.to_tables()
+        header['automaton'] = {'labels': writer.add_strings(tables['labels']),
+                               'n_labels': len(tables['labels']),
+                               'edge_offsets': writer.add_array(tables['edge_offsets'], '<i8'),
+                               'edge_targets': writer.add_array(tables['edge_targets'], '<i4'),
+                               'fail': writer.add_array(tables['fail'], '<i4'),
+                               'output_index': writer.add_array(tables['output_index'], '<i4'),
+                               'output_sets': tables['output_sets'],
+                               'ids': tables['ids'],
+                               'max_length': tables['max_length']}
+    header['blobs'] = writer.descriptions
+    try:
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    except TypeError as e:
+        raise Exception(f'Model can not be saved, parameters of conditions must be JSON serializable: {e}')
+    header_bytes += b' ' * _padding(len(header_bytes))
+    with open(filename, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        for blob in writer.blobs:
+            f.write(blob)
+
+
+class _blob_reader():
+    def __init__(self, data: mmap.mmap, descriptions: List[Dict], base: int):
+        self.data = data
+        self.descriptions = descriptions
+        self.base = base
+
+    def strings(self, index: int, count: int) -> List[str]:
+        if count == 0:
+            return []
+        description = self.descriptions[index]
+        start = self.base + description['offset']
+        return self.data[start:start + description['length']].decode('utf-8').split(_STRING_SEPARATOR)
+
+    def string_table(self, index: int, count: int) -> '_string_table':
+        description = self.descriptions[index]
+        return _string_table(self.data, self.base + description['offset'], description['length'], count)
+
+    def array(self, index: int) -> np.ndarray:
+        description = self.descriptions[index]
+        dtype = np.dtype(description['dtype'])
+        return np.frombuffer(self.data, dtype=dtype, count=description['length'] // dtype.itemsize,
+                             offset=self.base + description['offset'])
+
+
+class _string_table():
+    """
+    Strings of a blob decoded on demand, slices are decoded without splitting the whole blob.
+    """
+    def __init__(self, data: mmap.mmap, start: int, length: int, count: int):
+        self.data = data
+        self.start = start
+        self.length = length
+        self.count = count
+        self.starts = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __reduce__(self):
+        # Mapped files are not pickled, the strings are sent as a list
+        return list, (self[:],)
+
+    def __getitem__(self, index: slice) -> List[str]:
+        start, stop, _ = index.indices(self.count)
+        if start >= stop:
+            return []
+        if self.starts is None:
+            separators = np.flatnonzero(np.frombuffer(self.data, dtype=np.uint8, count=self.length, offset=self.start) == 0)
+            self.starts = np.concatenate(([0], separators + 1, [self.length + 1])).tolist()
+        return self.data[self.start + self.starts[start]:self.start + self.starts[stop] - 1].decode('utf-8').split(_STRING_SEPARATOR)
+
+
+def _condition_from_record(record: Dict, reader: _blob_reader):
+    params = record['params']
+    if 'keywords' in record:
+        if record['type'] != 'condition_keywords_in_last_n_words':
+            raise Exception(f'Unknown keyword condition {record["type"]} in model file')
+        params['keywords'] = reader.strings(record['keywords'], record['n_keywords'])
+        if record['n_keyword_set'] == record['n_keywords']:
+            # All keywords are distinct single words, the set blob holds the same strings
+            keyword_set = frozenset(params['keywords'])
+        else:
+            keyword_set = frozenset(reader.strings(record['keyword_set'], record['n_keyword_set']))
+        cond = conditions.condition_keywords_in_last_n_words(params, keyword_set)
+    else:
+        cond = conditions.condition_factory(record['type'], params)
+    for _ in range(record['negative']):
+        cond = conditions.negative_condition(cond)
+    return cond
+
+
+def read_model_file(filename: str) -> Dict:
+    """
+    Read the model from a file written by write_model_file.
+
+    :param filename: Name of the file
+    :return: Dictionary with 'conditions', 'top_level_operation', 'conditions_switches', 'automaton'
+             (keywords.keyword_automaton or None) and 'settings'
+    """
+    with open(filename, 'rb') as f:
+        if not f.seek(0, 2):
+            raise Exception(f'{filename} is not a cbtbc model file')
+        # Tables of the automaton are views of the mapped file, it stays mapped while they are referenced
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < _PREFIX.size or data[:len(MAGIC)] != MAGIC:
+        raise Exception(f'{filename} is not a cbtbc model file')
+    _, version, _, header_length = _PREFIX.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise Exception(f'Unsupported cbtbc model file format version {version} in {filename}, '
+                        f'this version of cbtbc reads format version {FORMAT_VERSION}')
+    header = json.loads(data[_PREFIX.size:_PREFIX.size + header_length].decode('utf-8'))
+    reader = _blob_reader(data, header['blobs'], _PREFIX.size + header_length)
+    automaton = None
+    if header['automaton'] is not None:
+        tables = header['automaton']
+        automaton = keywords_automaton.keyword_automaton.from_tables(reader.string_table(tables['labels'], tables['n_labels']),
+                                                                     reader.array(tables['edge_offsets']),
+                                                                     reader.array(tables['edge_targets']),
+                                                                     reader.array(tables['fail']),
+                                                                     reader.array(tables['output_index']),
+                                                                     tables['output_sets'], tables['ids'], tables['max_length'])
+    list_of_conditions = None
+    if header['conditions'] is not None:
+        list_of_conditions = [_condition_from_record(record, reader) for record in header['conditions']]
+    return {'conditions': list_of_conditions,
+            'top_level_operation': header['top_level_operation'],
+            'conditions_switches': header['conditions_switches'],
+            'automaton': automaton,
+            'settings': header['settings']}
@@ -0,0 +1,185 @@
+'''
+Content addressed cache of model predictions
+Results of cbtbc_model.run are stored under a hash of the document, its preprocessing settings, the switches
+of the conditions and the fingerprint of the model, so a changed model never gets results of its old version.
+Results are kept in a bounded in-memory LRU and optionally in a sqlite file, which survives restarts
+and is shared by processes on the same host.
+'''
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import conditions
+import corpus
+from typing import Dict, List, Optional
+
+
+def _stable(key):
+    # condition_key contains frozensets, their iteration order differs between processes
+    if isinstance(key, (set, frozenset)):
+        return sorted(repr(_stable(item)) for item in key)
+    if isinstance(key, tuple):
+        return tuple(_stable(item) for item in key)
+    return key
+
+
+def model_fingerprint(list_of_conditions: Optional[List[object]], top_level_operation: str = 'and') -> bytes:
+    """
+    Compute the fingerprint of the model, it is equal for models giving equal results on any document.
+
+    :param list_of_conditions: Conditions of the model
+    :param top_level_operation: Top level operation of the model
+    :return: Digest of the conditions and the top level operation
+    """
+    h = hashlib.blake2b(top_level_operation.encode('ascii'), digest_size=16)
+    for cond in list_of_conditions or ():
+        h.update(b'\x00' + repr(_stable(conditions.condition_key(cond))).encode('utf-8', 'surrogatepass'))
+    return h.digest()
+
+
+def prediction_key(intext: str, ishtml: bool, conditions_switches: Optional[List[bool]], n_conditions: int, fingerprint: bytes,
+                   html_backend: str = 'bs4', tokenizer: str = 'nltk') -> bytes:
+    """
+    Compute the key of a prediction.
+
+    :param intext: plain text/HTML string
+    :param ishtml: If True, intext is HTML
+    :param conditions_switches: Switches of the conditions (None - all conditions are enabled)
+    :param n_conditions: Number of conditions of the model
+    :param fingerprint: Fingerprint of the model (see model_fingerprint)
+    :param html_backend: HTML parsing backend
+    :param tokenizer: Tokenizer
+    :return: Digest of the prediction
+    """
+    h = hashlib.blake2b(corpus.content_hash(intext, ishtml, html_backend, tokenizer), digest_size=16)
+    h.update(fingerprint)
+    if conditions_switches is not None:
+        # Switches past the last condition do not change the result
+        h.update(b's' + bytes(i < len(conditions_switches) and bool(conditions_switches[i]) for i in range(n_conditions)))
+    return h.digest()
+
+
+class prediction_cache():
+    def __init__(self, maxsize: Optional[int] = 10000, path: Optional[str] = None):
+        """
+        Initialize the cache.
+
+        :param maxsize: Maximal number of predictions kept in memory (least recently used are dropped first),
+                        None for unbounded cache
+        :param path: Optional sqlite file where predictions are persisted, it may be shared by several processes
+        """
+        if maxsize is not None and maxsize < 1:
+            raise Exception(f'maxsize must be positive or None, got {maxsize}')
+        self.maxsize = maxsize
+        self.path = path
+        self._results = OrderedDict()
+        self._connection = None
+        self._pid = None
+        self._lock = threading.RLock()  # Threads sharing the cache update the LRU order and the connection one at a time
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self):
+        if self.path is None:
+            return None
+        if self._connection is None or self._pid != os.getpid():
+            # A connection must not be used by a forked process, each process opens its own
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS predictions (key BLOB PRIMARY KEY, result INTEGER NOT NULL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key: bytes, result: bool):
+        self._results[key] = result
+        if self.maxsize is not None and len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: bytes) -> Optional[bool]:
+        """
+        Return the cached prediction.
+
+        :param key: Key of the prediction (see prediction_key)
+        :return: Cached result or None if the prediction is not cached
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+            db = self._db()
+            if db is not None:
+                row = db.execute('SELECT result FROM predictions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    result = bool(row[0])
+                    self._remember(key, result)
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, result: bool):
+        """
+        Store the prediction.
+
+        :param key: Key of the prediction (see prediction_key)
+        :param result: Result of the model
+        """
+        result = bool(result)
+        with self._lock:
+            self._remember(key, result)
+            db = self._db()
+            if db is not None:
+                db.execute('INSERT OR REPLACE INTO predictions (key, result) VALUES (?, ?)', (key, int(result)))
+
+    def clear(self, persistent: bool = False):
+        """
+        Remove all predictions from memory and reset the counters.
+
+        :param persistent: If True, remove predictions from the sqlite file too
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+            db = self._db()
+            if persistent and db is not None:
+                db.execute('DELETE FROM predictions')
+
+    def close(self):
+        """
+        Close the sqlite file, it is opened again on the next access.
+        """
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of the cache.
+
+        :return: Dictionary with 'hits' (in memory), 'disk_hits', 'misses', 'evictions' (from memory) and 'size' (in memory)
+        """
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._results)}
+
+    def __len__(self):
+        return len(self._results)
+
+    def __getstate__(self):
+        # Connections are not picklable, worker processes open their own
+        state = dict(self.__dict__)
+        state['_connection'] = None
+        state['_pid'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
@@ -0,0 +1,380 @@
+'''
+Asyncio classification service
+Concurrent classify() calls are collected into micro-batches which are classified by a pool of processes
+holding the preloaded model. The queue of waiting documents is bounded: when it is full, callers wait
+(or get an exception), so load is pushed back to clients instead of piling up in memory.
+The service can be used from asyncio code or served locally over HTTP or stdin/stdout (JSON lines).
+
+Usage: python service.py model.cbtbc [--http 127.0.0.1:8080] [--jobs 4] [--batch-size 64] [--batch-window 0.005]
+       [--max-queue 1024] [--text] [--line-limit 67108864]
+Without --http, JSON lines are served on stdin/stdout.
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import operator
+import sys
+import time
+import worker_pool
+from typing import Dict, List, Optional
+
+# Default maximal length of a request line of serve_stdio, HTML documents are often longer than 64 KiB
+DEFAULT_LINE_LIMIT = 64 * 1024 * 1024
+
+def _classify_batch(list_of_texts: List[str], ishtml: bool) -> List[bool]:
+    model = worker_pool.worker_object('service.model')
+    return [model.run(intext, ishtml=ishtml) for intext in list_of_texts]
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class classification_service():
+    def __init__(self, model, n_jobs: Optional[int] = None, max_batch_size: int = 64, batch_window: float = 0.005,
+                 max_queue_size: int = 1024, max_batches_in_flight: Optional[int] = None, ishtml: bool = True,
+                 reject_when_full: bool = False, latency_window: int = 10000):
+        """
+        Initialize the service, it starts processing with start() (or async with).
+
+        :param model: cbtbc_model instance
+        :param n_jobs: Number of worker processes (None - number of CPUs,
+                       0 - classify in max_batches_in_flight threads of the current process sharing the model)
+        :param max_batch_size: Maximal number of documents in a batch
+        :param batch_window: Maximal time in seconds a batch waits for more documents after its first one
+        :param max_queue_size: Maximal number of documents waiting for a batch
+        :param max_batches_in_flight: Maximal number of batches being classified at once (2 * number of workers by default)
+        :param ishtml: If True, documents are HTML
+        :param reject_when_full: If True, classify raises an exception when the queue is full instead of waiting
+        :param latency_window: Number of last requests used for latency percentiles
+        """
+        if max_batch_size < 1 or max_queue_size < 1:
+            raise Exception('max_batch_size and max_queue_size must be positive')
+        self.model = model
+        self.n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue_size = max_queue_size
+        self.max_batches_in_flight = max_batches_in_flight or 2 * max(self.n_jobs, 1)
+        self.ishtml = ishtml
+        self.reject_when_full = reject_when_full
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._counters = {'requests': 0, 'completed': 0, 'errors': 0, 'rejected': 0, 'batches': 0, 'batched_documents': 0}
+        self._queue = None
+        self._executor = None
+        self._batcher = None
+        self._in_flight = None
+        self._batch_tasks = set()
+
+    async def start(self):
+        """
+        Start the worker pool and the batching task.
+        """
+        if self._batcher is not None:
+            return
+        self.model.warmup(self.ishtml)
+        if self.n_jobs == 0:
+            # run() keeps its state in per call scan states, so batches in flight share the model
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_batches_in_flight)
+        else:
+            self._executor = worker_pool.process_pool_executor(self.n_jobs, 'service.model', self.model, operator.methodcaller('warmup', self.ishtml))
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._in_flight = asyncio.Semaphore(self.max_batches_in_flight)
+        self._batcher = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self):
+        """
+        Finish classification of queued documents and stop the workers.
+        """
+        if self._batcher is None:
+            return
+        await self._queue.join()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._batcher = None
+        self._executor = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def classify(self, document: str) -> bool:
+        """
+        Classify the document.
+
+        :param document: plain text/HTML string
+        :return: Result of the model
+        """
+        if self._batcher is None:
+            raise Exception('classification_service is not started')
+        self._counters['requests'] += 1
+        future = asyncio.get_running_loop().create_future()
+        item = (document, future, time.perf_counter())
+        if self.reject_when_full:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._counters['rejected'] += 1
+                raise Exception(f'classification_service queue is full ({self.max_queue_size} documents)')
+        else:
+            await self._queue.put(item)  # Waits while the queue is full
+        return await future
+
+    async def classify_many(self, documents: List[str]) -> List[bool]:
+        """
+        Classify documents concurrently.
+
+        :param documents: List of plain text/HTML strings
+        :return: List of results in the order of documents
+        """
+        return list(await asyncio.gather(*(self.classify(document) for document in documents)))
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._in_flight.acquire()
+            task = loop.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            self._counters['batches'] += 1
+            self._counters['batched_documents'] += len(batch)
+            documents = [document for document, _, _ in batch]
+            try:
+                if self.n_jobs == 0:
+                    results = await loop.run_in_executor(self._executor, _classify_batch_in_process, self.model, documents, self.ishtml)
+                else:
+                    results = await loop.run_in_executor(self._executor, _classify_batch, documents, self.ishtml)
+            except Exception as e:
+                self._counters['errors'] += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            now = time.perf_counter()
+            for (_, future, start), result in zip(batch, results):
+                self._latencies.append(now - start)
+                if not future.done():
+                    future.set_result(result)
+            self._counters['completed'] += len(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+            self._in_flight.release()
+
+    def metrics(self) -> Dict:
+        """
+        Return metrics of the service.
+
+        :return: Dictionary with counters of requests, queue depth, batches in flight, mean batch size
+                 and latency percentiles (seconds) over the last requests
+        """
+        latencies = sorted(self._latencies)
+        counters = dict(self._counters)
+        counters.update({'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                         'max_queue_size': self.max_queue_size,
+                         'batches_in_flight': len(self._batch_tasks),
+                         'mean_batch_size': counters['batched_documents'] / counters['batches'] if counters['batches'] else None,
+                         'latency_p50': _percentile(latencies, 0.5),
+                         'latency_p95': _percentile(latencies, 0.95),
+                         'latency_p99': _percentile(latencies, 0.99),
+                         'latency_max': latencies[-1] if latencies else None})
+        return counters
+
+
+def _classify_batch_in_process(model, list_of_texts: List[str], ishtml: bool) -> List[bool]:
+    return [model.run(intext, ishtml=ishtml) for intext in list_of_texts]
+
+
+async def _read_request_line(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Read one line, a line longer than the limit of the reader is skipped.
+
+    :return: Line (empty at the end of the stream) or None if the line was too long
+    """
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial  # Last line without line break
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+    # Unlike readline, readuntil keeps the data on overrun, the rest of the line is dropped chunk by chunk
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b'\n')
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+
+async def serve_stdio(service: classification_service, reader: Optional[asyncio.StreamReader] = None, writer=None, limit: int = DEFAULT_LINE_LIMIT):
+    """
+    Serve JSON lines: each input line is {"id": ..., "text": ...} (or a JSON string), each output line is
+    {"id": ..., "result": true/false} or {"id": ..., "error": "..."}. Responses are written as they are ready.
+    A line "metrics" writes metrics of the service. Invalid and too long lines are answered with an error.
+
+    :param service: Started classification_service
+    :param reader: Stream of requests (stdin by default)
+    :param writer: Function writing one response line (stdout by default)
+    :param limit: Maximal length of a request line in bytes when reading stdin
+    """
+    loop = asyncio.get_running_loop()
+    if reader is None:
+        reader = asyncio.StreamReader(limit=limit)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    if writer is None:
+        def writer(line):
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+    async def answer(request_id, text):
+        try:
+            writer(json.dumps({'id': request_id, 'result': await service.classify(text)}))
+        except Exception as e:
+            writer(json.dumps({'id': request_id, 'error': str(e)}))
+
+    tasks = set()
+    while True:
+        line = await _read_request_line(reader)
+        if line is None:
+            writer(json.dumps({'id': None, 'error': 'Request line is longer than the limit of the reader'}))
+            continue
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        if line == b'metrics':
+            writer(json.dumps({'metrics': service.metrics()}))
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            writer(json.dumps({'id': None, 'error': f'Invalid JSON: {e}'}))
+            continue
+        if isinstance(request, dict):
+            request_id, text = request.get('id'), request.get('text', '')
+        else:
+            request_id, text = None, request
+        task = loop.create_task(answer(request_id, text))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def _handle_http(service: classification_service, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if method == 'POST' and path == '/classify':
+                try:
+                    document = body.decode('utf-8')
+                except UnicodeDecodeError as e:
+                    document, status, response = None, 400, {'error': f'Body is not valid UTF-8: {e}'}
+                if document is not None:
+                    try:
+                        status, response = 200, {'result': await service.classify(document)}
+                    except Exception as e:
+                        status, response = 503, {'error': str(e)}
+            elif method == 'GET' and path == '/metrics':
+                status, response = 200, service.metrics()
+            else:
+                status, response = 404, {'error': f'Unknown endpoint {method} {path}'}
+            payload = json.dumps(response).encode('utf-8')
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}[status]
+            writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode('latin-1') + payload)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(service: classification_service, host: str = '127.0.0.1', port: int = 8080):
+    """
+    Start a minimal HTTP/1.1 server: POST /classify with the document as the body returns {"result": true/false},
+    GET /metrics returns metrics of the service.
+
+    :param service: Started classification_service
+    :param host: Host to listen on
+    :param port: Port to listen on (0 - any free port)
+    :return: asyncio.Server
+    """
+    return await asyncio.start_server(lambda reader, writer: _handle_http(service, reader, writer), host, port)
+
+
+def main(argv=None):
+    import argparse
+    from cbtbc_model import cbtbc_model
+    parser = argparse.ArgumentParser(description='Local cbtbc classification service')
+    parser.add_argument('model', help='Model file written by cbtbc_model.save_model')
+    parser.add_argument('--http', default=None, help='host:port of HTTP server, stdin/stdout JSON lines are served by default')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--batch-window', type=float, default=0.005)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    parser.add_argument('--text', action='store_true', help='Documents are plain texts')
+    parser.add_argument('--line-limit', type=int, default=DEFAULT_LINE_LIMIT, help='Maximal length of a request line in bytes (stdin/stdout JSON lines)')
+    args = parser.parse_args(argv)
+    model = cbtbc_model()
+    model.load_model(args.model)
+
+    async def run():
+        async with classification_service(model, args.jobs, args.batch_size, args.batch_window, args.max_queue, ishtml=not args.text) as service:
+            if args.http:
+                host, _, port = args.http.rpartition(':')
+                server = await serve_http(service, host or '127.0.0.1', int(port))
+                async with server:
+                    await server.serve_forever()
+            else:
+                await serve_stdio(service, limit=args.line_limit)
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+'''
+Out-of-core training over sharded corpora
+Shards of labeled documents are preprocessed one by one into on-disk summaries: the activation matrix of each
+shard (see activation.activation_matrix.save). Optimizers score switch vectors by summing errors and lower bounds
+of memory mapped shard summaries, exhaustive methods pass each shard once and accumulate errors of all switch vectors.
+Memory used does not depend on the number of shards, results are equal to those of training in memory.
+'''
+
+import glob
+import json
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import activation
+import corpus
+import htmltransform
+import prediction_cache
+import worker_pool
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+SUMMARY_FILE = 'summary.json'
+
+
+def preprocessing_settings(model, ishtml: bool, deduplicate: bool) -> Dict:
+    """
+    Settings the shard summaries depend on besides the conditions of the model.
+    """
+    return {'ishtml': bool(ishtml),
+            'html_backend': htmltransform.resolve_html_backend(model.html_backend) if ishtml else None,
+            'tokenizer': htmltransform.resolve_tokenizer(model.tokenizer),
+            'deduplicate': bool(deduplicate)}
+
+
+def iter_shard_documents(shard) -> Iterable[Tuple[str, bool]]:
+    """
+    Iterate documents of a shard.
+
+    :param shard: Name of JSON lines file (one {"text": ..., "label": ...} object per line) or iterable of (text, label) pairs
+    :return: Generator of (text, label)
+    """
+    if isinstance(shard, str):
+        with open(shard, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['text'], bool(record['label'])
+    else:
+        for text, label in shard:
+            yield text, bool(label)
+
+
+def list_shards(shards: Union[str, Iterable]) -> Iterable:
+    """
+    Resolve shards: a directory gives its *.jsonl files in sorted order, other iterables are returned as they are.
+    """
+    if isinstance(shards, str):
+        if not os.path.isdir(shards):
+            raise Exception(f'{shards} is not a directory of shards')
+        return sorted(glob.glob(os.path.join(shards, '*.jsonl')))
+    return shards
+
+
+def _summarize_shard(model, shard, dirname: str, ishtml: bool, deduplicate: bool) -> Dict:
+    list_of_words = []
+    list_of_labels = []
+    for text, label in iter_shard_documents(shard):
+        list_of_words.append(corpus.preprocess_text(text, ishtml, model.html_backend, model.tokenizer))
+        list_of_labels.append(label)
+    matrix = activation.activation_matrix.from_model(model, list_of_words, list_of_labels, deduplicate)
+    matrix.save(dirname)
+    return {'dirname': os.path.basename(dirname), 'n_documents': matrix.n_documents, 'n_unique': matrix.n_unique}
+
+
+def _summary_worker(task):
+    shard, dirname, ishtml, deduplicate = task
+    return _summarize_shard(worker_pool.worker_object('sharded_training.model'), shard, dirname, ishtml, deduplicate)
+
+
+def build_shard_summaries(model, shards: Union[str, Iterable], summary_dir: str, ishtml: bool = True, deduplicate: bool = True,
+                          n_jobs: int = 1, verbose: int = 0) -> 'sharded_matrix':
+    """
+    Preprocess shards into on-disk summaries, only one shard (per process) is kept in memory at a time.
+
+    :param model: cbtbc_model instance
+    :param shards: Directory of *.jsonl shards or iterable of shards (see iter_shard_documents), consumed lazily
+    :param summary_dir: Directory where summaries are written
+    :param ishtml: If True, documents are HTML
+    :param deduplicate: If True, documents with identical words of a shard are scored once
+    :param n_jobs: Number of processes summarizing shards given as file names (None - number of CPUs)
+    :param verbose: Verbosity level (1: progress bar)
+    :return: sharded_matrix over the summaries
+    """
+    from tqdm import tqdm  # Importing tqdm module for progress bar
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs < 1:
+        raise Exception(f'n_jobs must be positive, got {n_jobs}')
+    os.makedirs(summary_dir, exist_ok=True)
+    shards = list_shards(shards)
+    tasks = ((shard, os.path.join(summary_dir, f'shard_{i:06d}'), ishtml, deduplicate) for i, shard in enumerate(shards))
+    progress = dict(disable=(verbose != 1), desc='cbtbc sharded training. Summaries')
+    if n_jobs == 1:
+        records = [_summarize_shard(model, *task) for task in tqdm(tasks, **progress)]
+    else:
+        # Shards given as iterables of documents can not be sent to workers
+        tasks = list(tasks)
+        if not all(isinstance(task[0], str) for task in tasks):
+            raise Exception('Shards must be file names to be summarized by several processes')
+        model.warmup(ishtml)
+        with worker_pool.pool(n_jobs, 'sharded_training.model', model) as pool:
+            records = list(tqdm(pool.imap(_summary_worker, tasks), total=len(tasks), **progress))
+    summary = {'fingerprint': prediction_cache.model_fingerprint(model.conditions, model.top_level_operation).hex(),
+               'settings': preprocessing_settings(model, ishtml, deduplicate),
+               'n_conditions': len(model.conditions), 'top_level_operation': model.top_level_operation, 'shards': records}
+    with open(os.path.join(summary_dir, SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f)
+    return sharded_matrix(summary_dir)
+
+
+class sharded_matrix():
+    def __init__(self, summary_dir: str, max_open_shards: int = 64):
+        """
+        Open shard summaries written by build_shard_summaries.
+        Provides the interface of activation.activation_matrix used by the optimizers (errors, lower_bound, incremental).
+
+        :param summary_dir: Directory of the summaries
+        :param max_open_shards: Maximal number of memory mapped shard summaries kept open
+        """
+        with open(os.path.join(summary_dir, SUMMARY_FILE)) as f:
+            summary = json.load(f)
+        self.summary_dir = summary_dir
+        self.max_open_shards = max_open_shards
+        self.fingerprint = bytes.fromhex(summary['fingerprint'])
+        self.settings = summary.get('settings')  # None for summaries written before settings were recorded
+        self.n_conditions = summary['n_conditions']
+        self.top_level_operation = summary['top_level_operation']
+        self.shard_dirs = [os.path.join(summary_dir, record['dirname']) for record in summary['shards']]
+        self.n_documents = sum(record['n_documents'] for record in summary['shards'])
+        self.n_unique = sum(record['n_unique'] for record in summary['shards'])
+        self._open = OrderedDict()
+
+    def check_model(self, model, ishtml: Optional[bool] = None, deduplicate: Optional[bool] = None):
+        """
+        Raise an exception if the summaries were built for other conditions or top level operation,
+        or, if ishtml is given, with other preprocessing settings (ishtml, HTML backend, tokenizer, deduplicate).
+
+        :param model: cbtbc_model instance
+        :param ishtml: Optional ishtml setting of training
+        :param deduplicate: Deduplicate setting of training, compared if ishtml is given (True by default)
+        """
+        if prediction_cache.model_fingerprint(model.conditions, model.top_level_operation) != self.fingerprint:
+            raise Exception(f'Shard summaries in {self.summary_dir} were built for another model')
+        if ishtml is None:
+            return
+        expected = preprocessing_settings(model, ishtml, True if deduplicate is None else deduplicate)
+        if self.settings != expected:
+            raise Exception(f'Shard summaries in {self.summary_dir} were built with preprocessing settings {self.settings}, '
+                            f'training uses {expected}')
+
+    def shard(self, i: int) -> activation.activation_matrix:
+        """
+        Memory mapped activation matrix of shard i.
+        """
+        matrix = self._open.get(i)
+        if matrix is None:
+            matrix = self._open[i] = activation.activation_matrix.load(self.shard_dirs[i], mmap=True)
+            if len(self._open) > self.max_open_shards:
+                self._open.popitem(last=False)
+        else:
+            self._open.move_to_end(i)
+        return matrix
+
+    def __len__(self):
+        return len(self.shard_dirs)
+
+    def errors(self, conditions_switches: Sequence[bool]) -> int:
+        """
+        Number of misclassified documents of all shards.
+        """
+        return sum(self.shard(i).errors(conditions_switches) for i in range(len(self)))
+
+    def lower_bound(self, prefix: Sequence[bool]) -> int:
+        """
+        Admissible lower bound of errors of all switch vectors starting with prefix, sum of the bounds of shards.
+        """
+        return sum(self.shard(i).lower_bound(prefix) for i in range(len(self)))
+
+    def incremental(self, conditions_switches: Optional[Sequence[bool]] = None):
+        """
+        State of the number of errors updated on each flip, errors are recomputed shard by shard
+        (per word counts of incremental states of shards would take memory proportional to the corpus).
+        """
+        import cbtbc_opt
+        if conditions_switches is None:
+            conditions_switches = [False] * self.n_conditions
+        return cbtbc_opt.objective_state(self.errors, conditions_switches)
+
+    def exhaustive_errors(self, n_jobs: int = 1, verbose: int = 0) -> np.ndarray:
+        """
+        Errors of all 2**n_conditions switch vectors, each shard is passed once and its errors are accumulated.
+
+        :param n_jobs: Number of processes scanning shards (None - number of CPUs)
+        :param verbose: Verbosity level (1: progress bar)
+        :return: Array of errors indexed by the index of the switch vector (the first condition is the most significant bit)
+        """
+        from tqdm import tqdm  # Importing tqdm module for progress bar
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        total = np.zeros(2 ** self.n_conditions, dtype=np.int64)
+        progress = dict(total=len(self), disable=(verbose != 1), desc='cbtbc sharded training. Shards')
+        if n_jobs == 1:
+            for dirname in tqdm(self.shard_dirs, **progress):
+                total += _shard_exhaustive_errors(dirname)
+        else:
+            with multiprocessing.Pool(processes=n_jobs) as pool:
+                for errors in tqdm(pool.imap_unordered(_shard_exhaustive_errors, self.shard_dirs), **progress):
+                    total += errors
+        return total
+
+    def __getstate__(self):
+        # Memory maps are opened again by each process
+        state = dict(self.__dict__)
+        state['_open'] = OrderedDict()
+        return state
+
+
+def _shard_exhaustive_errors(dirname: str) -> np.ndarray:
+    """
+    Errors of all switch vectors on one shard, vectors are enumerated in Gray code order with incremental updates.
+    """
+    matrix = activation.activation_matrix.load(dirname, mmap=False)
+    n = matrix.n_conditions
+    errors = np.empty(2 ** n, dtype=np.int64)
+    index = 0
+    state = matrix.incremental()
+    errors[0] = state.value
+    for k in range(1, 2 ** n):
+        bit = (k & -k).bit_length() - 1
+        index ^= 1 << bit
+        errors[index] = state.flip(n - 1 - bit)
+    return errors
+
+
+def best_exhaustive_vector(errors: np.ndarray, n: int) -> Tuple[List[bool], int]:
+    """
+    Choose the best switch vector as binary_vector_bruteforce_search does: minimal errors,
+    then fewer switched on conditions, then the smaller index.
+
+    :param errors: Errors of all switch vectors (see sharded_matrix.exhaustive_errors)
+    :param n: Number of conditions
+    :return: Tuple of the best switch vector and its errors
+    """
+    import cbtbc_opt
+    indexes = np.arange(len(errors), dtype=np.int64)
+    popcount = np.zeros(len(errors), dtype=np.int64)
+    for bit in range(n):
+        popcount += (indexes >> bit) & 1
+    best = np.lexsort((indexes, popcount, errors))[0]
+    return cbtbc_opt.index_to_binary_vector(int(best), n), int(errors[best])
+
+
+def train_sharded(model, shards: Union[str, Iterable], summary_dir: Optional[str] = None, method: str = 'bruteforce', verbose: int = 0,
+                  n_iter=100, trueprob=0.5, ishtml: bool = True, n_jobs: Optional[int] = 1, deduplicate: bool = True,
+                  max_nodes: Optional[int] = None, max_time: Optional[float] = None, reuse_summaries: bool = False):
+    """
+    Train the model on sharded corpus, see cbtbc_model.train_minimize_number_of_conditions for the methods and parameters.
+
+    :param model: cbtbc_model instance
+    :param shards: Directory of *.jsonl shards or iterable of shards (see iter_shard_documents)
+    :param summary_dir: Directory of shard summaries (temporary directory removed after training by default)
+    :param n_jobs: Number of processes summarizing shards and scanning them for exhaustive methods
+    :param reuse_summaries: If True and summary_dir contains summaries of the same model and preprocessing settings,
+                            shards are not preprocessed again
+    :return: Tuple of minimum number of differences and best condition switchers
+    """
+    if summary_dir is None:
+        with tempfile.TemporaryDirectory(prefix='cbtbc_shards_') as temporary_dir:
+            return train_sharded(model, shards, temporary_dir, method, verbose, n_iter, trueprob, ishtml, n_jobs, deduplicate, max_nodes, max_time)
+    import cbtbc_model
+    if reuse_summaries and os.path.exists(os.path.join(summary_dir, SUMMARY_FILE)):
+        matrix = sharded_matrix(summary_dir)
+        matrix.check_model(model, ishtml, deduplicate)
+    else:
+        matrix = build_shard_summaries(model, shards, summary_dir, ishtml, deduplicate, n_jobs, verbose)
+    if method in ('bruteforce', 'bruteforce_gray'):
+        # Shard by shard accumulation of errors of all switch vectors, same choice as bruteforce search in memory
+        best_vector, errors = best_exhaustive_vector(matrix.exhaustive_errors(n_jobs, verbose), matrix.n_conditions)
+        return errors, best_vector
+    errors, best_vector, _, _ = cbtbc_model.search_conditions_switches(matrix, method, n_iter, trueprob, verbose, n_jobs, max_nodes, max_time)
+    return errors, best_vector
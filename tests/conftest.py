@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules of the repository and benchmark scripts (synthetic_corpus, run_benchmarks) are imported by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
@@ -0,0 +1,162 @@
+import itertools
+import random
+import pytest
+from activation import activation_matrix, condition_activations
+from cbtbc_model import cbtbc_model
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
+
+# Documents (lists of words) and labels: 'rates' close to a number
+DOCUMENTS = [['special', 'rates', 'is', '10.5', '%'],
+             ['rates', 'is', 'good', 'for', '50%', 'of', 'customers'],
+             ['price', 'is', '3', 'price'],
+             ['rates', 'price', '10.5'],
+             ['good', 'rates', 'nan', 'is', 'good'],
+             [],
+             ['50%', 'of', 'customers', 'price'],
+             ['3', 'rates'],
+             ['is', 'good'],
+             ['rates', '50%', 'price'],
+             ['10.5', 'price', 'rates', 'of', '3'],
+             ['nan', '%', 'rates'],
+             ['rates', 'at', '50%'],
+             ['price', '50%']]
+LABELS = [True, False, False, True, False, False, False, True, False, True, True, False, True, False]
+
+@pytest.fixture
+def conditions():
+    return [condition_float_in_last_n_words({'n_words': 2}),
+            condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}),
+            condition_floatpercent_in_last_n_words({'n_words': 4}),
+            negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']}))]
+
+def test_condition_activations():
+    cond = condition_float_in_last_n_words({'n_words': 2})
+    assert condition_activations(cond, ['a', '1.0', 'b', 'c']).tolist() == [False, True, True, False]
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_matrix_matches_run(top_level_operation, conditions):
+    model = cbtbc_model(conditions)
+    model.top_level_operation = top_level_operation
+    matrix = activation_matrix.from_model(model, DOCUMENTS, LABELS)
+    for switches in itertools.product([False, True], repeat=len(model.conditions)):
+        expected = [model.run_words(words, list(switches)) for words in DOCUMENTS]
+        assert matrix.predict(switches).tolist() == expected
+        assert matrix.errors(switches) == sum(e != l for e, l in zip(expected, LABELS))
+
+def test_matrix_predict(conditions):
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS)
+    # A number in the last 2 words and 'rates' in the last 3 words
+    assert matrix.predict([True, True, False, False]).tolist() == [True, False, False, True, True, False, False,
+                                                                   True, False, False, True, False, False, False]
+    assert matrix.errors([True, True, False, False]) == 3
+    assert matrix.errors([False, False, True, True]) == 7
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS, 'or')
+    assert matrix.predict([False] * 4).tolist() == [False] * len(DOCUMENTS)
+    assert matrix.errors([False, True, False, False]) == 3
+
+def test_matrix_errors_requires_labels(conditions):
+    matrix = activation_matrix(conditions, DOCUMENTS[:3])
+    with pytest.raises(Exception):
+        matrix.errors([True] * 4)
+    with pytest.raises(Exception):
+        activation_matrix(conditions, DOCUMENTS[:3], top_level_operation='xor')
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_incremental_state_matches_predict(top_level_operation, conditions):
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS, top_level_operation)
+    state = matrix.incremental([True, False, False, True])
+    assert state.value == matrix.errors([True, False, False, True])
+    for i in [1, 0, 2, 3, 1, 2, 0, 3, 3, 2, 1, 1, 0]:
+        value = state.flip(i)
+        assert value == matrix.errors(state.switches)
+        assert state.predictions.tolist() == matrix.predict_unique(state.switches).tolist()
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_gray_code_search_matches_bruteforce(top_level_operation, conditions):
+    import cbtbc_opt
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS, top_level_operation)
+    expected = cbtbc_opt.binary_vector_bruteforce_search(matrix.n_conditions, matrix.errors)
+    assert cbtbc_opt.binary_vector_gray_code_search(matrix.n_conditions, matrix.incremental) == expected
+    assert cbtbc_opt.binary_vector_gray_code_search(matrix.n_conditions, matrix.incremental, n_shards=5) == expected
+    assert cbtbc_opt.binary_vector_gray_code_search(matrix.n_conditions, matrix.incremental, n_jobs=2) == expected
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_deduplicated_matrix_matches_full(top_level_operation, conditions):
+    # Copies of documents as lists and tuples, some of them with the opposite label
+    documents = DOCUMENTS + [list(words) for words in DOCUMENTS[:6]] + [tuple(DOCUMENTS[0])] * 3
+    labels = LABELS + [not label for label in LABELS[:3]] + LABELS[3:6] + [True, False, True]
+    deduplicated = activation_matrix(conditions, documents, labels, top_level_operation)
+    full = activation_matrix(conditions, documents, labels, top_level_operation, deduplicate=False)
+    assert (deduplicated.n_unique, full.n_unique) == (14, 23)
+    assert deduplicated.weight_true.sum() + deduplicated.weight_false.sum() == len(documents)
+    for switches in itertools.product([False, True], repeat=deduplicated.n_conditions):
+        assert deduplicated.predict(switches).tolist() == full.predict(switches).tolist()
+        assert deduplicated.errors(switches) == full.errors(switches)
+    state = deduplicated.incremental()
+    for i in [0, 2, 1, 0, 3, 2]:
+        assert state.flip(i) == full.errors(state.switches)
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_lower_bound_is_admissible(top_level_operation, conditions):
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS, top_level_operation)
+    vectors = list(itertools.product([False, True], repeat=matrix.n_conditions))
+    for length in range(matrix.n_conditions + 1):
+        for prefix in set(vector[:length] for vector in vectors):
+            completions = [matrix.errors(vector) for vector in vectors if vector[:length] == prefix]
+            assert matrix.lower_bound(list(prefix)) <= min(completions)
+            if length == matrix.n_conditions:
+                assert matrix.lower_bound(list(prefix)) == completions[0]
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_subset_matches_rebuilt_matrix(top_level_operation, conditions):
+    documents = DOCUMENTS + DOCUMENTS[:4] + [[]]
+    labels = LABELS + [False, True, False, True, True]
+    matrix = activation_matrix(conditions, documents, labels, top_level_operation)
+    # Indices of repeated documents and of copies of the same document
+    indices = [0, 5, 15, 1, 18, 12, 14, 5]
+    subset = matrix.subset(indices)
+    rebuilt = activation_matrix(conditions, [documents[i] for i in indices], [labels[i] for i in indices], top_level_operation)
+    assert subset.n_documents == 8 and subset.n_unique == rebuilt.n_unique == 4
+    for switches in itertools.product([False, True], repeat=matrix.n_conditions):
+        assert subset.predict(switches).tolist() == rebuilt.predict(switches).tolist()
+        assert subset.errors(switches) == rebuilt.errors(switches)
+        assert subset.lower_bound(list(switches[:2])) == rebuilt.lower_bound(list(switches[:2]))
+    state = subset.incremental()
+    for i in [1, 0, 3, 1, 2]:
+        assert state.flip(i) == rebuilt.errors(state.switches)
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load_roundtrip(tmp_path, mmap, conditions):
+    matrix = activation_matrix(conditions, DOCUMENTS, LABELS, 'or')
+    matrix.save(str(tmp_path / 'matrix'))
+    loaded = activation_matrix.load(str(tmp_path / 'matrix'), mmap=mmap)
+    assert (loaded.n_documents, loaded.n_unique, loaded.top_level_operation) == (14, 14, 'or')
+    for switches in itertools.product([False, True], repeat=matrix.n_conditions):
+        assert loaded.predict(switches).tolist() == matrix.predict(switches).tolist()
+        assert loaded.errors(switches) == matrix.errors(switches)
+    assert loaded.incremental().flip(2) == matrix.incremental().flip(2)
+    empty = activation_matrix(conditions, [], None)
+    empty.save(str(tmp_path / 'empty'))
+    assert activation_matrix.load(str(tmp_path / 'empty')).labels is None
+
+def test_lower_bound_is_cheaper_than_errors():
+    import time
+    rnd = random.Random(3)
+    # Long unique documents: a leading number makes the copies of each document different
+    documents = [[str(i)] + list(words) * 10 for i, words in enumerate(DOCUMENTS * 72)]
+    labels = [i % 3 == 0 for i in range(len(documents))]
+    conditions = [condition_float_in_last_n_words({'n_words': n}) for n in range(1, 13)] + \
+                 [condition_keywords_in_last_n_words({'n_words': n, 'keywords': ['rates', 'price']}) for n in range(1, 13)]
+    matrix = activation_matrix(conditions, documents, labels, 'and')
+    vectors = [[rnd.random() < 0.5 for _ in range(len(conditions))] for _ in range(100)]
+    prefixes = [vector[:rnd.randint(1, len(conditions) - 1)] for vector in vectors]
+
+    def best_time(function, arguments):
+        times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            for argument in arguments:
+                function(argument)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    assert best_time(matrix.lower_bound, prefixes) < best_time(matrix.errors, vectors)
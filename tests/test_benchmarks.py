@@ -0,0 +1,32 @@
+import synthetic_corpus
+import run_benchmarks
+
+def test_generate_corpus_is_reproducible():
+    documents, labels = synthetic_corpus.generate_corpus(30, words_per_document=50, positive_fraction=0.3, seed=1)
+    assert (documents, labels) == synthetic_corpus.generate_corpus(30, words_per_document=50, positive_fraction=0.3, seed=1)
+    assert len(documents) == 30 and 0 < sum(labels) < 30
+    texts, _ = synthetic_corpus.generate_corpus(5, ishtml=False, seed=1)
+    assert all('<' not in text for text in texts)
+
+def test_signal_is_learnable():
+    from cbtbc_model import cbtbc_model
+    from conditions import condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words
+    documents, labels = synthetic_corpus.generate_corpus(40, words_per_document=60, seed=2)
+    model = cbtbc_model([condition_keywords_in_last_n_words({'n_words': synthetic_corpus.SIGNAL_DISTANCE, 'keywords': synthetic_corpus.KEYWORDS}),
+                         condition_floatpercent_in_last_n_words({'n_words': synthetic_corpus.SIGNAL_DISTANCE})])
+    assert [model.run(html) for html in documents] == labels
+
+def test_run_benchmarks_quick():
+    report = run_benchmarks.run_benchmarks(run_benchmarks.parse_args(['--quick', '--suites', 'train', '--methods', 'bruteforce,bnb']))
+    results = report['results']
+    assert [(record['algorithm'], record['variant']) for record in results] == \
+           [('bruteforce', 'reference'), ('bruteforce', 'activation_matrix'), ('bnb', 'reference'), ('bnb', 'activation_matrix')]
+    # Speedups compare variants of the same search method, which find the same optimum
+    assert results[1]['speedup'] is not None and results[0]['speedup'] == 1.0
+    assert results[0]['errors'] == results[1]['errors'] == results[2]['errors'] == results[3]['errors']
+
+def test_run_benchmarks_reference_run():
+    report = run_benchmarks.run_benchmarks(run_benchmarks.parse_args(['--quick', '--suites', 'run']))
+    results = report['results']
+    assert results[0]['variant'] == 'reference' and results[0]['reference']
+    assert all(record['mismatches'] == 0 and record['speedup'] is not None for record in results)
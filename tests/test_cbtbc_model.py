@@ -1,6 +1,6 @@
 import pytest
 from cbtbc_model import cbtbc_model
-from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
 # Fixture for creating a model instance
 @pytest.fixture
 def model_instance():
@@ -33,6 +33,24 @@ def test_save_and_load_conditions(tmp_path, model_instance):
     # You might need to compare the effects of the conditions instead
     assert new_instance == model_instance, "Loaded conditions should match saved conditions"
 
+# Conditions [float(2), keywords(3, ['rates', 'price']) after check('rates'), not keywords(1, ['good'])]
+# as pickled by save_conditions before keyword conditions had keyword_set and automaton
+OLD_CONDITIONS_PICKLE = (b'\x80\x04\x95\xa1\x01\x00\x00\x00\x00\x00\x00]\x94(\x8c\nconditions\x94\x8c\x1fcondition_float_in_last_n_words\x94\x93\x94)\x81\x94}\x94(\x8c\x06params\x94}\x94\x8c\x07n_words\x94K\x02s\x8c\rerror'
+                         b'_handler\x94\x8c\x08builtins\x94\x8c\x07getattr\x94\x93\x94h\x04\x8c\x15default_error_handler\x94\x86\x94R\x94\x8c\x0cmax_distance\x94K\x02\x8c\rlast_distance\x94Nubh\x01'
+                         b'\x8c"condition_keywords_in_last_n_words\x94\x93\x94)\x81\x94}\x94(h\x06}\x94(h\x08K\x03\x8c\x08keywords\x94]\x94(\x8c\x05rates\x94\x8c\x05price\x94euh\th\x0ch\x14h\r\x86\x94R\x94h\x10'
+                         b'K\x03h\x17h\x18h\x11K\x00ubh\x01\x8c\x12negative_condition\x94\x93\x94)\x81\x94}\x94(\x8c\x13positive_conditions\x94h\x13)\x81\x94}\x94(h\x06}\x94(h\x08K\x01h\x17]\x94\x8c\x04good\x94auh\th\x0ch'
+                         b'"h\r\x86\x94R\x94h\x10K\x01h\x17h%h\x11Nubh\x06h$ube.')
+
+def test_load_conditions_pickled_by_earlier_versions(tmp_path):
+    file_path = tmp_path / "conditions.dat"
+    file_path.write_bytes(OLD_CONDITIONS_PICKLE)
+    model = cbtbc_model()
+    model.load_conditions(str(file_path))
+    assert model.conditions[1].keyword_set == frozenset(['rates', 'price']) and model.conditions[1].automaton is None
+    assert model.run_words(['10.5', 'rates', 'x'])
+    assert not model.run_words(['10.5', 'good', 'rates']) and not model.run_words(['price', 'x', 'y', '1.0'])
+    assert model.run_words(['10.5', 'rates', 'x'], vectorized=True)
+
 def test_train_bruteforce(model_instance):
     # This test might need adjustments based on the actual logic within `train_minimize_number_of_conditions`
     min_number_of_differences, best_conditions_switchers = model_instance.train_minimize_number_of_conditions(
@@ -92,3 +110,187 @@ def test_cbtcb_model_train_bruteforce():
         results_after_training.append(testmodel.run(string, conditions_switches=best_conditions_switchers))
     assert results_before_training != test_label
     assert results_after_training == test_label
+
+def test_run_vectorized(model_instance):
+    for text in ["1.2 sample test", "1.2 sample sample", "sample test 5 words after", ""]:
+        assert model_instance.run(text, ishtml=False, vectorized=True) == model_instance.run(text, ishtml=False)
+    model_instance.top_level_operation = 'or'
+    for text in ["1.2 sample test", "none here", ""]:
+        assert model_instance.run(text, vectorized=True) == model_instance.run(text)
+    assert model_instance.run("text", conditions_switches=[False, False], vectorized=True) == model_instance.run("text", conditions_switches=[False, False])
+
+def test_run_many(model_instance):
+    texts = ["1.2 sample test", "1.2 sample sample", "<b>10.0</b> keyword", "nothing"] * 5
+    expected = [model_instance.run(text) for text in texts]
+    assert model_instance.run_many(texts, n_jobs=1) == expected
+    assert model_instance.run_many(iter(texts), n_jobs=2, chunksize=3) == expected
+    assert model_instance.run_many(texts, conditions_switches=[True, False], n_jobs=2) == [model_instance.run(text, [True, False]) for text in texts]
+
+def test_run_stream_early_exit(model_instance):
+    html = "<p>10.0 test. Second sentence. Third sentence.</p>"
+    def chunks():
+        yield html
+        raise AssertionError("stream was read after the decision")
+    assert model_instance.run_stream(chunks(), block_size=1)
+    for text in ["<b>1.2 sample test</b>", "<b>1.2 sample sample</b>"]:
+        assert model_instance.run_stream([text[:4], text[4:]]) == model_instance.run(text)
+    assert model_instance.run_stream("1.2 sample test", ishtml=False) == model_instance.run("1.2 sample test", ishtml=False)
+
+def test_run_stream_early_exit_without_punctuation(model_instance):
+    read = []
+    def chunks():
+        yield "<table>"
+        for i in range(100000):
+            read.append(i)
+            yield f"<tr><td>row {i}</td><td>{'1.2 sample test' if i == 100 else 'value'}</td></tr>"
+    assert model_instance.run_stream(chunks(), block_size=1024)
+    assert len(read) < 200
+
+def test_run_with_shared_keyword_automaton():
+    from conditions import negative_condition
+    model = cbtbc_model(conditions_list=[condition_keywords_in_last_n_words({'n_words': 2, 'keywords': ['rates', 'interest rate']}),
+                                         negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']})),
+                                         condition_float_in_last_n_words({'n_words': 4})])
+    assert model.compile_keywords().ids == [0, 1]
+    assert model.compile_keywords() is model.compile_keywords()
+    texts = ["interest rate is 5", "the price of interest rate 5", "rates 5 price", "rates price 5", "5 interest rate"]
+    for text in texts:
+        words = text.split()
+        for cond in model.conditions:
+            cond.clean()
+        reference = False
+        for word in words:
+            if all([cond.check(word) for cond in model.conditions]):
+                reference = True
+                break
+        assert model.run_words(words) == reference
+        assert model.run_words(words, vectorized=True) == reference
+    model.filter_conditions([False, True, True])
+    assert model.compile_keywords().ids == [0]
+
+# Plain texts labeled True when 'rates' is close to a number, for comparing training methods
+TRAINING_TEXTS = ['special rates are 10.5 % for new customers', 'rates are good for 50% of customers', 'the price is 3 and the price is good',
+                  'rates and price 10.5', 'good rates , nan is good', '', '50% of customers like the price', '3 rates',
+                  'it is good', 'rates of 50% for price', '10.5 is the price of rates of 3', 'nan % rates', 'rates at 50%',
+                  'price 50%', 'rates', 'price of 2.5 is 10 %']
+TRAINING_LABELS = [True, False, False, True, False, False, False, True, False, True, True, False, True, False, False, False]
+
+@pytest.fixture
+def rates_model():
+    return cbtbc_model(conditions_list=[condition_float_in_last_n_words({'n_words': 2}),
+                                        condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}),
+                                        condition_floatpercent_in_last_n_words({'n_words': 4}),
+                                        negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']}))])
+
+def test_train_bruteforce_parallel(rates_model):
+    serial = rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bruteforce', ishtml=False)
+    assert serial == (2, [True, True, False, False]), "A number and 'rates' nearby should be chosen"
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bruteforce', ishtml=False, n_jobs=3) == serial
+    rates_model.top_level_operation = 'or'
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bruteforce', ishtml=False, n_jobs=3) == (4, [False, True, False, False])
+
+def test_train_bruteforce_gray(rates_model):
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bruteforce_gray', ishtml=False) == (2, [True, True, False, False])
+    rates_model.top_level_operation = 'or'
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bruteforce_gray', ishtml=False) == (4, [False, True, False, False])
+
+def test_train_deduplicate(model_instance):
+    htmls = ["10.0 test string", "test string", "<p>test string</p>", "10.0 test string", "1.0 keyword"]
+    labels = [True, False, True, True, False]
+    for method in ['bruteforce', 'bruteforce_gray']:
+        assert model_instance.train_minimize_number_of_conditions(htmls, labels, method=method) == model_instance.train_minimize_number_of_conditions(htmls, labels, method=method, deduplicate=False)
+
+@pytest.mark.parametrize('top_level_operation, expected', [('and', (2, [True, True, False, False])), ('or', (4, [False, True, False, False]))])
+def test_train_bnb_matches_bruteforce(top_level_operation, expected, rates_model):
+    rates_model.top_level_operation = top_level_operation
+    for method in ['bnb', 'random_bnb']:
+        assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method=method, ishtml=False, n_iter=3) == expected
+    budget_errors, budget_switches = rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='bnb', ishtml=False, max_nodes=1)
+    assert len(budget_switches) == len(rates_model.conditions) and budget_errors >= expected[0]
+
+def test_train_anneal(rates_model):
+    import random
+    random.seed(1)
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='anneal', ishtml=False, n_iter=400) == (2, [True, True, False, False])
+    rates_model.top_level_operation = 'or'
+    assert rates_model.train_minimize_number_of_conditions(TRAINING_TEXTS, TRAINING_LABELS, method='anneal', ishtml=False, n_iter=400) == (4, [False, True, False, False])
+
+def test_import_is_lazy():
+    # Heavy dependencies are imported only by the code paths which need them
+    import os, subprocess, sys, json
+    code = "import sys, json, cbtbc_model; print(json.dumps(sorted(m for m in ('nltk', 'bs4', 'tqdm', 'cbtbc_opt', 'lxml') if m in sys.modules)))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == []
+
+def test_warmup(model_instance):
+    import sys
+    model_instance.warmup()
+    assert 'nltk' in sys.modules and 'bs4' in sys.modules
+    assert model_instance.run("<p>1.2 sample test</p>")
+
+def test_concurrent_runs_match_serial_runs():
+    import itertools
+    import random
+    import sys
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from conditions import condition_floatpercent_in_last_n_words, negative_condition
+    from corpus import preprocessed_corpus
+    from ensemble import cbtbc_ensemble
+    from token_corpus import token_corpus
+    model = cbtbc_model(conditions_list=[condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates', 'of customers']}),
+                                         negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']})),
+                                         condition_float_in_last_n_words({'n_words': 4}), condition_floatpercent_in_last_n_words({'n_words': 6})])
+    model.top_level_operation = 'or'
+    # 302 different texts, more than the caches below keep
+    beginnings = ['special rates are', 'the price is', 'it is good for', 'customers pay', 'nothing here for', 'price']
+    middles = ['10.5 %', '3', 'nan', 'some', 'few']
+    ends = ['now', 'price', 'of customers', 'for rates', 'today', 'or less', 'here', 'again', 'and more', 'at all']
+    texts = [' '.join(parts) for parts in itertools.product(beginnings, middles, ends)] + ['', 'price']
+    switches = [[True, True, True, True], [True, False, True, False], [False, True, False, True]]
+    expected = {(i, j): model.run(text, s, ishtml=False) for i, text in enumerate(texts) for j, s in enumerate(switches)}
+    assert 0 < sum(expected.values()) < len(expected)
+
+    def run_concurrently(call, n_threads=8):
+        barrier = threading.Barrier(n_threads)
+
+        def worker(seed):
+            keys = list(expected)
+            random.Random(seed).shuffle(keys)
+            barrier.wait()
+            return [(key, call(key, seed)) for key in keys]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Threads are switched as often as possible
+        try:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                results = [result for results in pool.map(worker, range(n_threads)) for result in results]
+        finally:
+            sys.setswitchinterval(interval)
+        assert len(results) == n_threads * len(expected) and all(result == expected[key] for key, result in results)
+        return results
+
+    run_concurrently(lambda key, seed: model.run(texts[key[0]], switches[key[1]], ishtml=False, vectorized=bool(seed % 2)))
+    # Shared corpus cache, small enough to evict documents while other threads use them
+    cache = preprocessed_corpus(maxsize=150)
+    results = run_concurrently(lambda key, seed: model.run(texts[key[0]], switches[key[1]], ishtml=False, corpus_cache=cache))
+    assert cache.hits + cache.misses == len(results) and len(cache) == 150
+    # Shared token corpus, its caches of masks are filled concurrently
+    tokens = token_corpus.from_texts(texts, ishtml=False)
+    run_concurrently(lambda key, seed: model.run_tokens(tokens, key[0], switches[key[1]]))
+    # Shared ensemble of models with different switches
+    models = {}
+    for j, s in enumerate(switches):
+        models[j] = cbtbc_model(model.conditions)
+        models[j].top_level_operation = 'or'
+        models[j].conditions_switches = s
+    ensemble = cbtbc_ensemble(models)
+    list_of_words = [tokens[i] for i in range(len(texts))]
+    run_concurrently(lambda key, seed: ensemble.run_words(list_of_words[key[0]])[key[1]])
+    # Shared instrumentation and prediction cache
+    model.enable_instrumentation()
+    model.enable_prediction_cache(maxsize=100)
+    results = run_concurrently(lambda key, seed: model.run(texts[key[0]], switches[key[1]], ishtml=False))
+    stats = model.prediction_cache.stats()
+    assert stats['hits'] + stats['misses'] == len(results) and stats['size'] == 100
+    assert model.get_stats()['runs'] == stats['misses']
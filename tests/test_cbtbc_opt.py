@@ -0,0 +1,81 @@
+import random
+import pytest
+from cbtbc_opt import binary_vector_bruteforce_search, binary_vector_gray_code_search, binary_vector_bnb_random_search, binary_vector_anneal_search, branch_and_bound_search, index_to_binary_vector, bruteforce_shard, gray_code_shard
+
+def count_objective(vector):
+    return abs(sum(vector) - 2)
+
+def test_index_to_binary_vector():
+    assert index_to_binary_vector(5, 4) == [False, True, False, True]
+    assert index_to_binary_vector(0, 0) == []
+
+@pytest.mark.parametrize("n_jobs,n_shards", [(1, None), (1, 5), (2, 7)])
+def test_bruteforce_search(n_jobs, n_shards):
+    vector, value = binary_vector_bruteforce_search(5, count_objective, n_jobs=n_jobs, n_shards=n_shards)
+    assert value == 0
+    assert vector == [False, False, False, True, True]
+
+def test_bruteforce_shard():
+    assert bruteforce_shard(3, 4, 8, objective_function=count_objective) == (0, 2, 5)
+    assert bruteforce_shard(3, 4, 4, objective_function=count_objective) is None
+
+class count_state():
+    def __init__(self, vector):
+        self.vector = list(vector)
+        self.value = count_objective(self.vector)
+    def flip(self, i):
+        self.vector[i] = not self.vector[i]
+        self.value = count_objective(self.vector)
+        return self.value
+
+@pytest.mark.parametrize("n_shards", [None, 3, 32])
+def test_gray_code_search(n_shards):
+    assert binary_vector_gray_code_search(5, count_state, n_shards=n_shards) == binary_vector_bruteforce_search(5, count_objective)
+    assert gray_code_shard(3, 2, 2, count_state) is None
+
+def target_objective(vector):
+    target = [True, False, True, True, False, False]
+    return sum(a != b for a, b in zip(vector, target)) + (2 if vector[0] and vector[1] else 0)
+
+def target_bound(prefix):
+    return sum(a != b for a, b in zip(prefix, [True, False, True, True, False, False]))
+
+def test_branch_and_bound_search():
+    expected = binary_vector_bruteforce_search(6, target_objective)
+    vector, value, stats = branch_and_bound_search(6, target_objective)
+    assert (vector, value) == expected
+    assert stats['complete'] and stats['leaves_evaluated'] == 2 ** 6 and stats['nodes_pruned'] == 0
+    vector, value, stats = branch_and_bound_search(6, target_objective, bound_function=target_bound)
+    assert (vector, value) == expected
+    assert stats['nodes_pruned'] > 0 and stats['leaves_evaluated'] < 2 ** 6
+
+def test_branch_and_bound_search_budget_and_memo():
+    memo = {}
+    vector, value, stats = branch_and_bound_search(6, target_objective, max_nodes=2, memo=memo)
+    assert not stats['complete'] and len(vector) == 6 and value == target_objective(vector)
+    branch_and_bound_search(6, target_objective, memo=memo)
+    _, _, stats = branch_and_bound_search(6, target_objective, memo=memo)
+    assert stats['leaves_evaluated'] == 0 and stats['memo_hits'] == 2 ** 6
+
+def test_bnb_random_search():
+    stats = {}
+    vector, value = binary_vector_bnb_random_search(6, target_objective, n_iter=5, bound_function=target_bound, stats=stats)
+    assert value == 0 and vector == [True, False, True, True, False, False]
+    assert stats['nodes_expanded'] > 0
+    vector, value = binary_vector_bnb_random_search(6, target_objective, n_iter=20, bnb_method=False, trueprob=0.9)
+    assert value == target_objective(vector)
+
+def test_anneal_search():
+    random.seed(0)
+    stats = {}
+    vector, value = binary_vector_anneal_search(6, target_objective, n_iter=500, stats=stats)
+    assert (vector, value) == ([True, False, True, True, False, False], 0)
+    assert stats['steps'] == 500 and stats['evaluations'] == stats['visited'] <= 2 ** 6
+    vector, value = binary_vector_anneal_search(6, state_factory=lambda v: count_state(v), n_iter=300, initial_vector=[True] * 6)
+    assert value == 0 and sum(vector) == 2
+    with pytest.raises(Exception):
+        binary_vector_anneal_search(3)
+
+def test_random_search_exhausts_small_space():
+    vector, value = binary_vector_bnb_random_search(2, count_objective, n_iter=50, bnb_method=False)
+    assert value == 0
@@ -0,0 +1,55 @@
+import pytest
+import numpy as np
+import synthetic_corpus
+from cbtbc_model import cbtbc_model
+from corpus import preprocessed_corpus
+from condition_generator import candidate_statistics, generate_candidate_conditions, NUMBER_CLASSES, NUMBER_CONDITIONS
+from conditions import condition_factory, condition_keywords_in_last_n_words
+
+def test_counts_match_conditions():
+    documents = [['special', 'rates', 'are', '10.5', '%'], ['rates', 'are', 'good', 'for', '50%', 'of', 'customers'],
+                 ['price', 'is', '3', 'price'], [], ['good', 'rates', 'nan'], ['50%', 'of', 'customers', 'price'],
+                 ['3', 'rates'], ['is', 'good'], ['rates', '50%', 'price']]
+    labels = [True, False, False, False, True, False, True, False, True]
+    statistics = candidate_statistics([1, 2, 4])
+    for words, label in zip(documents, labels):
+        statistics.add_document(words, label)
+    assert statistics.n_documents.tolist() == [5, 4]
+    near_number = statistics.near_number_counts()
+    rates = statistics.vocabulary['rates']
+    assert statistics.document_frequency[:, rates].tolist() == [1, 4]
+    # 'rates' and a float in the last 1, 2 and 4 words of positive documents
+    assert near_number[1, NUMBER_CLASSES.index('float'), :, rates].tolist() == [0, 2, 3]
+    for token, token_id in statistics.vocabulary.items():
+        assert statistics.document_frequency[1, token_id] == sum(token in words for words, label in zip(documents, labels) if label)
+        for c, number_class in enumerate(NUMBER_CLASSES):
+            for j, n_words in enumerate(statistics.n_words_values):
+                keyword = condition_keywords_in_last_n_words({'n_words': n_words, 'keywords': [token]})
+                number = condition_factory(NUMBER_CONDITIONS[number_class], {'n_words': n_words})
+                # Documents where both conditions are true at the same word
+                expected = [sum(bool(np.any(keyword.check_words(words) & number.check_words(words))) for words, label in zip(documents, labels) if label == value)
+                            for value in (False, True)]
+                assert near_number[:, c, j, token_id].tolist() == expected
+
+def test_generated_conditions_are_learnable():
+    documents, labels = synthetic_corpus.generate_corpus(200, words_per_document=80, seed=4)
+    cache = preprocessed_corpus(maxsize=None)
+    candidates = generate_candidate_conditions(documents, labels, budget=8, corpus_cache=cache)
+    assert 0 < len(candidates) <= 8
+    assert any(set(synthetic_corpus.KEYWORDS) <= set(getattr(cond, 'keywords', ())) for cond in candidates)
+    model = cbtbc_model(candidates)
+    errors, _ = model.train_minimize_number_of_conditions(documents, labels, method='bnb', corpus_cache=cache)
+    assert errors <= len(documents) // 20
+
+def test_ranking_and_budget():
+    documents, labels = synthetic_corpus.generate_corpus(100, words_per_document=60, ishtml=False, seed=5)
+    statistics = candidate_statistics()
+    statistics.add_documents(documents, labels, ishtml=False)
+    candidates = statistics.rank_candidates(max_keywords=3)
+    scores = [candidate['score'] for candidate in candidates]
+    assert scores == sorted(scores, reverse=True)
+    assert all(len(candidate['keywords']) <= 3 for candidate in candidates)
+    assert candidates[0]['kind'] == 'near_number'
+    assert len(statistics.generate_conditions(budget=3)) == 3
+    with pytest.raises(Exception):
+        generate_candidate_conditions(documents[:5], [True] * 5, ishtml=False)
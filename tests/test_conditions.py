@@ -3,7 +3,8 @@ Pytest test of conditions.py
 '''
 
 import pytest
-from conditions import isfloat,ispercent, condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, condition_floatorpercent_in_last_n_words, negative_condition
+import numpy as np
+from conditions import isfloat,ispercent, condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, condition_floatorpercent_in_last_n_words, negative_condition, token_classes, trigger_within_last_n
 
 # Tests for utility functions
 def test_is_float():
@@ -50,3 +51,60 @@ def test_negative_condition():
     assert negative_condition_obj.check("100.5") is False
     negative_condition_obj.clean()
     assert negative_condition_obj.check("not a float") is True
+
+# Tests for vectorized evaluation
+def scalar_check_words(condition, words):
+    condition.clean()
+    return [condition.check(word) for word in words]
+
+@pytest.mark.parametrize("n_words", [0, 1, 2, 5])
+def test_check_words_matches_check(n_words):
+    words = ["rates", "nan", "1_000", "5%", "%", "x", "inf", "1e5", "50.5%", "test", "abc%", "", "-3", "rates"]
+    words = [word for word in words if word]
+    conditions = [condition_float_in_last_n_words({"n_words": n_words}),
+                  condition_keywords_in_last_n_words({"n_words": n_words, "keywords": ["rates", "test"]}),
+                  condition_floatpercent_in_last_n_words({"n_words": n_words}),
+                  condition_floatorpercent_in_last_n_words({"n_words": n_words})]
+    conditions += [negative_condition(cond) for cond in list(conditions)]
+    classes = token_classes(words)
+    for condition in conditions:
+        expected = scalar_check_words(condition, words)
+        assert condition.check_words(words).tolist() == expected
+        assert condition.check_words(words, classes).tolist() == expected
+        assert condition.check_words([]).tolist() == []
+
+def test_trigger_within_last_n():
+    assert trigger_within_last_n(np.array([False, True, False, False, True, False]), 2).tolist() == [False, True, True, False, True, True]
+    assert trigger_within_last_n(np.array([], dtype=bool), 2).tolist() == []
+
+def test_token_classes():
+    classes = token_classes(["1.5", "a", "1.5", "7%"])
+    assert classes.unique == ["1.5", "a", "7%"]
+    assert classes.float_mask().tolist() == [True, False, True, False]
+    assert classes.percent_mask().tolist() == [False, False, False, True]
+    assert classes.keyword_mask({"a"}).tolist() == [False, True, False, False]
+
+def test_condition_keywords_phrases():
+    condition = condition_keywords_in_last_n_words({"n_words": 2, "keywords": ["interest rate", "fee"]})
+    words = ["the", "interest", "rate", "is", "low", "interest", "fee"]
+    assert scalar_check_words(condition, words) == [False, False, True, True, False, False, True]
+    assert condition.check_words(words).tolist() == scalar_check_words(condition, words)
+    condition.clean()
+    assert condition.check(" interest rate") is False
+
+# Tests for per call scan states
+@pytest.mark.parametrize("condition", [condition_float_in_last_n_words({"n_words": 2}),
+                                       condition_keywords_in_last_n_words({"n_words": 2, "keywords": ["rates", "interest rate"]}),
+                                       negative_condition(condition_keywords_in_last_n_words({"n_words": 3, "keywords": ["price"]}))])
+def test_scan_matches_check_without_changing_condition(condition):
+    words = "interest rate of 5 price interest rates 5 % and price".split()
+    expected = scalar_check_words(condition, words)
+    condition.clean()
+    first, second = condition.scan(), condition.scan()
+    results = []
+    for word in words:
+        results.append(first.check(word))
+        second.check("interest")  # Interleaved scan does not disturb the first one
+    assert results == expected
+    base = condition.positive_conditions if isinstance(condition, negative_condition) else condition
+    assert base.last_distance is None and getattr(base, 'state', 0) == 0
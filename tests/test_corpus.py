@@ -0,0 +1,85 @@
+import pytest
+from corpus import preprocessed_corpus, preprocess_text, content_hash
+from cbtbc_model import cbtbc_model
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words
+
+def test_preprocess_text():
+    html = "<html><body>Special.<b>rates</b> is <i>100.00<b>%</b></i></body></html>"
+    assert "100.00%" in preprocess_text(html)
+    assert "rates" in preprocess_text(html)
+
+def test_content_hash_depends_on_mode():
+    assert content_hash("text", True) != content_hash("text", False)
+    assert content_hash("text", True) == content_hash("text", True)
+
+def test_corpus_parses_each_document_once():
+    corpus = preprocessed_corpus()
+    words = corpus.get_words("<p>10.0 test</p>")
+    assert words == ("10.0", "test")
+    assert corpus.get_words("<p>10.0 test</p>") is words
+    assert corpus.misses == 1 and corpus.hits == 1
+    assert "<p>10.0 test</p>" in corpus
+
+def test_corpus_lru_bound():
+    corpus = preprocessed_corpus(maxsize=2)
+    corpus.get_many(["a", "b"])
+    corpus.get_words("a")
+    corpus.get_words("c")
+    assert len(corpus) == 2
+    assert "a" in corpus and "b" not in corpus
+    with pytest.raises(Exception):
+        preprocessed_corpus(maxsize=0)
+
+def test_run_and_train_with_corpus():
+    model = cbtbc_model(conditions_list=[condition_float_in_last_n_words({'n_words': 3}), condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['test', 'keyword']})])
+    corpus = preprocessed_corpus()
+    htmls = ["10.0 test string", "test string"]
+    assert model.run(htmls[0], corpus_cache=corpus) == model.run(htmls[0])
+    assert model.run_words(["1.2", "sample", "test"])
+    result = model.train_minimize_number_of_conditions(htmls, [True, False], method='bruteforce', corpus_cache=corpus)
+    assert result == (0, [True, False])
+    assert corpus.misses == 2
+
+def test_corpus_html_backend():
+    corpus = preprocessed_corpus(html_backend="htmlparser")
+    html = "<p>10.0 <b>test</b></p><script>1.5</script>"
+    assert corpus.get_words(html) == tuple(preprocess_text(html))
+    assert content_hash(html, True, "htmlparser") != content_hash(html, True)
+    assert html in corpus
+    corpus.get_words(html, html_backend="bs4")
+    assert corpus.misses == 2
+    model = cbtbc_model(conditions_list=[condition_float_in_last_n_words({'n_words': 3})])
+    model.html_backend = "fast"
+    assert model.run(html) and not model.run("<script>1.5</script>text") and model.run(html, html_backend="bs4")
+
+def test_corpus_regex_tokenizer():
+    corpus = preprocessed_corpus(tokenizer="regex")
+    html = "<p>Rate is 10.5 <b>%</b></p>"
+    assert corpus.get_words(html) == tuple(preprocess_text(html)) == ("rate", "is", "10.5%")
+    assert corpus.get_words("Rate is 10.5", ishtml=False) == ("Rate", "is", "10.5")
+    assert content_hash(html, True, tokenizer="regex") != content_hash(html, True)
+    model = cbtbc_model(conditions_list=[condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rate']})])
+    model.tokenizer = "regex"
+    assert model.run(html) and model.run("rate 1", ishtml=False) and not model.run("Rate 1", ishtml=False)
+
+def test_preprocessed_corpus_shared_by_threads():
+    import random
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    texts = [f'rates {i} %' for i in range(4)]
+    cache = preprocessed_corpus(maxsize=2)  # Half of the documents fit, so hits and evictions interleave
+    expected = [cache.get_words(text, ishtml=False) for text in texts]
+    cache.clear()
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        return [(i, cache.get_words(texts[i], ishtml=False)) for i in (rnd.randrange(4) for _ in range(2000))]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # Threads are switched as often as possible
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = [result for results in pool.map(worker, range(8)) for result in results]
+    finally:
+        sys.setswitchinterval(interval)
+    assert all(words == expected[i] for i, words in results)
+    assert cache.hits + cache.misses == len(results) and len(cache) == 2
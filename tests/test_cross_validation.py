@@ -0,0 +1,58 @@
+import pytest
+import numpy as np
+from cbtbc_model import cbtbc_model
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words
+from cross_validation import cross_validate, cross_validate_settings, kfold_indices
+
+TEXTS = [' '.join(words) for words in [['rates', 'are', '10.5', '%'], ['price', 'is', 'good'], ['rates', 'of', 'customers'],
+                                       ['50%', 'of', 'customers'], ['rates', '3'], ['nothing', 'here'], ['price', '10.5'],
+                                       ['rates', 'price', '3', '%'], ['is', 'good', '50%'], ['customers', 'rates', 'nan']]] * 2
+LABELS = [True, False, False, True, True, False, False, True, True, False] * 2
+
+def make_model():
+    return cbtbc_model([condition_float_in_last_n_words({'n_words': 2}),
+                        condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}),
+                        condition_floatpercent_in_last_n_words({'n_words': 4}),
+                        condition_keywords_in_last_n_words({'n_words': 2, 'keywords': ['price', 'customers']})])
+
+def test_kfold_indices():
+    folds = kfold_indices(23, 4, list_of_labels=[i % 3 == 0 for i in range(23)])
+    held_out = np.concatenate([test for _, test in folds])
+    assert sorted(held_out.tolist()) == list(range(23))
+    for train, test in folds:
+        assert not set(train) & set(test) and len(train) + len(test) == 23
+        assert 1 <= sum(i % 3 == 0 for i in test) <= 3
+    with pytest.raises(Exception):
+        kfold_indices(3, 4)
+
+def test_cross_validate_matches_retraining():
+    model = make_model()
+    report = cross_validate(model, TEXTS, LABELS, n_folds=4, method='bruteforce', ishtml=False, n_jobs=1)
+    folds = kfold_indices(len(TEXTS), 4, list_of_labels=LABELS)
+    assert len(report['folds']) == 4
+    for fold_result, (train, test) in zip(report['folds'], folds):
+        fold_model = make_model()
+        errors, switches = fold_model.train_minimize_number_of_conditions([TEXTS[i] for i in train], [LABELS[i] for i in train], ishtml=False)
+        assert (fold_result['train_errors'], fold_result['conditions_switches']) == (errors, switches)
+        assert fold_result['test_errors'] == sum(fold_model.run(TEXTS[i], switches, ishtml=False) != LABELS[i] for i in test)
+    assert report['test_errors'] == sum(fold_result['test_errors'] for fold_result in report['folds']) == 4
+    assert model.conditions_switches is None
+
+def test_cross_validate_settings_in_parallel():
+    model = make_model()
+    settings = [{'method': 'bnb'}, {'method': 'random', 'n_iter': 20}, {'method': 'anneal', 'n_iter': 50}]
+    parallel = cross_validate_settings(model, TEXTS, LABELS, settings, n_folds=3, ishtml=False, n_jobs=2, seed=1)
+    serial = cross_validate_settings(model, TEXTS, LABELS, settings, n_folds=3, ishtml=False, n_jobs=1, seed=1)
+    assert [report['setting'] for report in parallel] == settings
+    for a, b in zip(parallel, serial):
+        assert [(f['train_errors'], f['test_errors'], f['conditions_switches']) for f in a['folds']] == \
+               [(f['train_errors'], f['test_errors'], f['conditions_switches']) for f in b['folds']]
+        assert all(f['evaluations'] > 0 and f['search_seconds'] >= 0 for f in a['folds'])
+
+def test_cross_validate_keeps_global_random_state():
+    import random
+    random.seed(5)
+    expected = random.random()
+    random.seed(5)
+    cross_validate(make_model(), TEXTS, LABELS, n_folds=3, method='random', n_iter=20, ishtml=False, n_jobs=1)
+    assert random.random() == expected
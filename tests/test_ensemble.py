@@ -0,0 +1,51 @@
+from cbtbc_model import cbtbc_model
+from corpus import preprocessed_corpus
+from ensemble import cbtbc_ensemble
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
+
+def make_models():
+    rates = cbtbc_model([condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates', 'price']}), condition_float_in_last_n_words({'n_words': 2})])
+    customers = cbtbc_model([condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['price', 'rates']}), condition_keywords_in_last_n_words({'n_words': 2, 'keywords': ['of customers']})])
+    percents = cbtbc_model(['or', 'condition_floatpercent_in_last_n_words', 'condition_keywords_in_last_n_words'], [{'n_words': 1}, {'n_words': 1, 'keywords': ['good']}])
+    negative = cbtbc_model([negative_condition(condition_keywords_in_last_n_words({'n_words': 4, 'keywords': ['is']})), condition_float_in_last_n_words({'n_words': 2}),
+                            condition_floatpercent_in_last_n_words({'n_words': 5})])
+    negative.conditions_switches = [True, True, False]
+    return {'rates': rates, 'customers': customers, 'percents': percents, 'negative': negative, 'empty': cbtbc_model()}
+
+def test_ensemble_matches_models():
+    models = make_models()
+    ensemble = cbtbc_ensemble(models)
+    # Keyword conditions of 'rates' and 'customers' are identical, floats of 'rates' and 'negative' too
+    assert ensemble.n_unique_conditions == 6
+    # Documents and labels of the models which accept them
+    documents = [(['special', 'rates', 'are', '10.5'], {'rates', 'negative'}),
+                 (['price', 'of', 'customers'], {'customers'}),
+                 ([], set()),
+                 (['it', 'is', 'good'], {'percents'}),
+                 (['50%', 'of', 'customers'], {'percents'}),
+                 (['the', 'price', 'is', '3'], {'rates'}),
+                 (['10.5', 'x', 'y', 'z', 'w'], {'negative'}),
+                 (['good', '3', '%'], {'percents', 'negative'}),
+                 (['rates', 'is', 'nan', 'is'], {'rates'})]
+    for words, labels in documents:
+        expected = {label: label in labels for label in models}
+        assert ensemble.run_words(words) == expected
+        assert expected == {label: model.run_words(words) for label, model in models.items()}
+        assert ensemble.run_words(words, ['percents']) == {'percents': expected['percents']}
+
+def test_ensemble_preprocesses_once():
+    ensemble = cbtbc_ensemble(make_models())
+    cache = preprocessed_corpus()
+    html = "<p>Rates are 10.5 <b>%</b> of customers</p>"
+    result = ensemble.run(html, corpus_cache=cache)
+    assert cache.misses == 1
+    assert result == {label: model.run(html) for label, model in make_models().items()}
+    assert ensemble.predict_labels(html) == {label for label, value in result.items() if value}
+
+def test_ensemble_mixed_preprocessing():
+    models = make_models()
+    models['percents'].tokenizer = 'regex'
+    cache = preprocessed_corpus()
+    html = "<p>Good 10.5 <b>%</b> price</p>"
+    assert cbtbc_ensemble(models).run(html, corpus_cache=cache) == {label: model.run(html) for label, model in models.items()}
+    assert cache.misses == 2
@@ -1,5 +1,8 @@
+import io
 import pytest
-from htmltransform import extract_text_from_html, word_tokenization_ext, words_rule_based_replacement
+from htmltransform import extract_text_from_html, resolve_html_backend, iter_regex_words, resolve_tokenizer, word_tokenization_ext, words_rule_based_replacement, iter_text_chunks, iter_text_from_html, iter_words_from_html, iter_words_from_text, iter_words_rule_based_replacement
+from nltk.tokenize import word_tokenize
+from conditions import isfloat, ispercent
 
 def test_extract_text_from_html():
     html = "<html><head><title>Test</title></head><body><p>Hello World!</p></body></html>"
@@ -21,3 +24,94 @@ def test_words_rule_based_replacement():
 
     words_with_percent = ["100", "%", "complete"]
     assert words_rule_based_replacement(words_with_percent) == ["100%", "complete"]
+
+STREAM_HTMLS = ["<html><body>Special.<b>rates</b> is <i>100.00<b>%</b></i></body></html>",
+                "<html><head><style>p {}</style><title>T</title></head><body><p>Hello World! Next one.</p>a < b &amp; c<!-- x --><script>var s = '<b>';</script>10 %</body></html>",
+                "<p>Mr. Smith paid 10.5 % of it. Then he left.</p><![CDATA[raw]]><br/>end"]
+
+@pytest.mark.parametrize("html", STREAM_HTMLS)
+def test_iter_text_from_html(html):
+    assert "".join(iter_text_from_html([html])) == extract_text_from_html(html)
+    assert "".join(iter_text_from_html([html[i:i + 3] for i in range(0, len(html), 3)], tag_text_sep=" ")) == extract_text_from_html(html, tag_text_sep=" ")
+
+@pytest.mark.parametrize("html", STREAM_HTMLS)
+def test_iter_words_from_html(html):
+    expected = words_rule_based_replacement(word_tokenization_ext(extract_text_from_html(html)))
+    assert list(iter_words_from_html(html)) == expected
+    assert list(iter_words_from_html([html[i:i + 5] for i in range(0, len(html), 5)], block_size=8)) == expected
+    assert list(iter_words_from_html(io.BytesIO(html.encode("utf-8")), block_size=1)) == expected
+
+def test_iter_words_from_html_without_punctuation():
+    # Text of tables has no sentence boundaries, long sentences are cut after tag separators
+    html = "<table>" + "".join(f"<tr><td>row {i}</td><td>C# \"q\" 'x' 10.5 %</td></tr>" for i in range(200)) + "</table>"
+    expected = words_rule_based_replacement(word_tokenization_ext(extract_text_from_html(html)))
+    assert list(iter_words_from_html([html[i:i + 7] for i in range(0, len(html), 7)], block_size=16)) == expected
+
+def test_iter_words_from_text():
+    text = "First sentence. Second one has 10.5 % here! And a third?"
+    assert list(iter_words_from_text(io.StringIO(text), block_size=4)) == word_tokenize(text)
+
+def test_iter_text_chunks():
+    assert list(iter_text_chunks(["ab", b"\xc3", b"\xa9"])) == ["ab", "\u00e9"]
+    assert "".join(iter_text_chunks(io.StringIO("x" * 10), chunk_size=3)) == "x" * 10
+
+def test_iter_words_rule_based_replacement():
+    assert list(iter_words_rule_based_replacement(["This", "100", "%", "%", "Done"])) == ["this", "100%", "%", "done"]
+
+# Well formed HTML: all backends extract the same text
+PARITY_HTMLS = ["<html><head><title>Test</title></head><body><p>Hello World!</p></body></html>",
+                "<html><script>if (a < b) { document.write('<p>x</p>') }</script><body>Text</body></html>",
+                "x &amp; y &lt; z &gt; &quot;q&quot; &#39;s &#x41; &nbsp;nb &#12345;",
+                "<p>one<!-- comment -->two</p><!DOCTYPE html><p>doc</p>",
+                "<style>p {color: red}</style><p>styled</p><SCRIPT>upper</SCRIPT><P>Upper tags</P>",
+                "<br/>self<br>closing<img src=x>img",
+                "<pre>  pre\n  formatted\ttext  </pre><p>  multiple   spaces\n\nand\tlines  </p>",
+                "plain text without tags", "", "<p></p><div>   </div>",
+                "<table><tr><td>1</td><td>2.5</td></tr></table>%",
+                "<p>unicode \u00fc \u00e9 \u4e2d\u6587 \u2014 \u201cquotes\u201d</p>",
+                "<template><p>templ</p></template><ruby>kan<rp>(</rp><rt>k</rt><rp>)</rp></ruby>ji",
+                "<svg><style>x</style><text>svg text</text></svg>"]
+# Malformed HTML and SGML leftovers: the event driven parser still follows BeautifulSoup
+MALFORMED_HTMLS = ["<p>unclosed <b>bold <i>italic</p> tail", "</p>stray end tag", "<script>unclosed script text",
+                   "<rt>a</rt></rt>b<rt>c", "<b><rt>a</b>c", "<br><rt>x</br>y",
+                   "&amp without semicolon &unknown; &copy2023 &#65x &#xZZ; &#0; &#128; &#129; &#x110000;",
+                   "<![CDATA[cdata text]]><p>after</p>", "<?xml version='1.0'?><p>pi</p>", "text<!unknown decl>more",
+                   "<textarea>text <b>area</b></textarea>"]
+
+@pytest.mark.parametrize("html", PARITY_HTMLS + MALFORMED_HTMLS)
+@pytest.mark.parametrize("sep", ["#", " "])
+def test_htmlparser_backend_parity(html, sep):
+    assert extract_text_from_html(html, sep, backend="htmlparser") == extract_text_from_html(html, sep)
+
+@pytest.mark.parametrize("html", PARITY_HTMLS)
+@pytest.mark.parametrize("sep", ["#", " "])
+def test_lxml_backend_parity(html, sep):
+    pytest.importorskip("lxml")
+    assert extract_text_from_html(html, sep, backend="lxml") == extract_text_from_html(html, sep)
+
+def test_resolve_html_backend():
+    assert resolve_html_backend("bs4") == "bs4"
+    assert resolve_html_backend("fast") == "htmlparser"
+    with pytest.raises(Exception):
+        resolve_html_backend("regex")
+
+TOKENIZER_TEXTS = ["Rates rose 10.5% to $1,000.50 (approx.) in the U.S. today.",
+                   "Don't stop -5 and +3, 1e5 or .5 and 5 nan inf CAN'T it's o'clock",
+                   "state-of-the-art \"quoted\" 'single' a/b 10/20 x:y 3:30 50 % of 2b 5.x",
+                   "e-mail: a@b.com #tag ... -- 5-10 10%-20% \u00bd \uff13 a#b C# 10.5#%#x",
+                   "End 10.5. Next? Yes! (12.3%) [7] {8} <9> 10%; 11%, 1.2.3 1.5-2.5 100.00 % PRICE is 3 %"]
+
+def condition_tokens(words):
+    # Tokens the conditions look at: floats, percents and keywords
+    return [word for word in words if isfloat(word) or ispercent(word) or word.isalpha()]
+
+@pytest.mark.parametrize("text", TOKENIZER_TEXTS)
+def test_iter_regex_words_conformance(text):
+    expected = words_rule_based_replacement(word_tokenization_ext(text))
+    assert condition_tokens(iter_regex_words(text)) == condition_tokens(expected)
+    assert condition_tokens(iter_regex_words(text, tag_text_sep=None, normalize=False)) == condition_tokens(word_tokenize(text))
+
+def test_iter_regex_words():
+    assert list(iter_regex_words("Rates: 10.5 % and 3 %% of \"it\"#")) == ["rates", ":", "10.5%", "and", "3%", "%", "of", "``", "it", "''"]
+    with pytest.raises(Exception):
+        resolve_tokenizer("spacy")
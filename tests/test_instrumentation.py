@@ -0,0 +1,50 @@
+import pytest
+from cbtbc_model import cbtbc_model
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, negative_condition
+
+def make_model():
+    return cbtbc_model([condition_float_in_last_n_words({'n_words': 2}),
+                        condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates', 'interest rate']}),
+                        negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']}))])
+
+def test_instrumented_run_matches_run():
+    model = make_model()
+    documents = [['special', 'rates', 'are', '10.5', '%'], ['the', 'price', 'is', '3'], ['interest', 'rate', '1.5'], [],
+                 ['rates', 'price'], ['3', 'rates', 'nan'], ['no', 'numbers', 'here'], ['price', '10.5', 'price']]
+    expected = [True, False, True, False, False, True, False, False]
+    model.enable_instrumentation()
+    assert [model.run_words(words) for words in documents] == expected
+    stats = model.get_stats()
+    assert stats['runs'] == 8 and stats['early_exits'] == 3
+    assert stats['stages']['condition_scan']['calls'] == 8
+    assert len(stats['condition_hits']) == 3 and stats['condition_triggers'][0] > 0
+
+def test_run_records_stages_and_callback():
+    model = make_model()
+    records = []
+    model.enable_instrumentation(callback=records.append)
+    assert model.run("<p>Special rates</p> of 10.5 now")
+    assert not model.run("no numbers here", ishtml=False)
+    assert [record['event'] for record in records] == ['run', 'run']
+    assert set(records[0]['stages']) == {'extract_text_from_html', 'word_tokenization_ext', 'words_rule_based_replacement', 'condition_scan'}
+    assert 'word_tokenize' in records[1]['stages']
+    assert records[0]['early_exit_position'] == 3 and records[0]['triggers'][1] == 1
+    assert records[1]['early_exit_position'] is None and records[1]['words_scanned'] == 3
+    assert model.get_stats()['stages']['extract_text_from_html']['calls'] == 1
+    model.disable_instrumentation()
+    assert model.get_stats() is None
+
+@pytest.mark.parametrize('method', ['bruteforce', 'bruteforce_gray', 'bnb', 'random_bnb', 'random', 'anneal'])
+def test_training_stats(method):
+    model = make_model()
+    documents = ['special rates are 10.5 %', 'the price is 3', 'interest rate 1.5', '', 'rates and price', '3 rates nan',
+                 'no numbers here', 'price 10.5 price', 'rates of 50%', 'price of customers']
+    labels = [True, False, True, False, False, True, False, False, True, False]
+    model.enable_instrumentation()
+    result = model.train_minimize_number_of_conditions(documents, labels, method=method, ishtml=False, n_iter=20)
+    record = model.get_stats()['trainings'][0]
+    assert record['method'] == method and record['errors'] == result[0]
+    assert record['evaluations'] > 0 and record['evaluations_per_second'] > 0
+    if method in ('bnb', 'random_bnb'):
+        assert 0 <= record['prune_ratio'] <= 1
+    assert {'training_preprocessing', 'activation_matrix', 'search'} <= set(model.get_stats()['stages'])
@@ -0,0 +1,49 @@
+import random
+import pytest
+from keywords import keyword_automaton, split_keyword
+
+def reference_triggers(keywords_by_id, words):
+    triggers = {keyword_id: [False] * len(words) for keyword_id in keywords_by_id}
+    for keyword_id, keywords in keywords_by_id.items():
+        for keyword in keywords:
+            phrase = list(split_keyword(keyword))
+            for end in range(len(phrase), len(words) + 1) if phrase else []:
+                if words[end - len(phrase):end] == phrase:
+                    triggers[keyword_id][end - 1] = True
+    return triggers
+
+def test_split_keyword():
+    assert split_keyword("rates") == ("rates",)
+    assert split_keyword("interest  rate") == ("interest", "rate")
+    assert split_keyword(" rates") == ()
+    assert split_keyword(5) == ()
+
+def test_step_and_scan():
+    automaton = keyword_automaton({0: ["a b c"], 1: ["b c d", "b"], 2: ["c"]})
+    words = ["a", "b", "c", "d", "b"]
+    assert list(automaton.scan(words)) == [(1, frozenset({1})), (2, frozenset({0, 2})), (3, frozenset({1})), (4, frozenset({1}))]
+    state, ids = automaton.step(0, "x")
+    assert state == 0 and not ids
+
+@pytest.mark.parametrize("seed", range(20))
+def test_trigger_masks_match_reference(seed):
+    rnd = random.Random(seed)
+    vocabulary = ["a", "b", "c", "d"]
+    max_words = rnd.choice([1, 3])
+    keywords_by_id = {i: [" ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(1, max_words))) for _ in range(rnd.randint(1, 3))] for i in range(4)}
+    words = [rnd.choice(vocabulary) for _ in range(rnd.randint(0, 30))]
+    masks = keyword_automaton(keywords_by_id).trigger_masks(words)
+    assert {keyword_id: mask.tolist() for keyword_id, mask in masks.items()} == reference_triggers(keywords_by_id, words)
+
+def test_add_after_build():
+    automaton = keyword_automaton({0: ["a"]})
+    with pytest.raises(Exception):
+        automaton.add_keywords(["b"], 1)
+
+def test_tables_roundtrip():
+    automaton = keyword_automaton({0: ["a b c"], 1: ["b c d", "b"], 2: ["c"]})
+    restored = keyword_automaton.from_tables(**automaton.to_tables())
+    words = ["a", "b", "c", "d", "b", "x", "c"]
+    assert list(restored.scan(words)) == list(automaton.scan(words))
+    with pytest.raises(Exception):
+        restored.add_keywords(["e"], 3)
@@ -0,0 +1,86 @@
+import pickle
+import struct
+import pytest
+import model_format
+from cbtbc_model import cbtbc_model
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
+
+def make_model():
+    model = cbtbc_model([condition_float_in_last_n_words({'n_words': 2}),
+                         condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates', 'of customers', 'is good', '']}),
+                         negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']})),
+                         condition_floatpercent_in_last_n_words({'n_words': 4})])
+    model.top_level_operation = 'or'
+    model.conditions_switches = [True, True, False, True]
+    model.tokenizer = 'regex'
+    return model
+
+def test_save_and_load_model(tmp_path):
+    model = make_model()
+    filename = str(tmp_path / "model.cbtbc")
+    model.save_model(filename)
+    loaded = cbtbc_model()
+    loaded.load_model(filename)
+    assert loaded.top_level_operation == 'or' and loaded.tokenizer == 'regex'
+    assert loaded.conditions_switches == [True, True, False, True]
+    assert [str(cond) for cond in loaded.conditions] == [str(cond) for cond in model.conditions]
+    assert loaded.conditions[1].keyword_set == model.conditions[1].keyword_set
+    documents = [['rates', 'is', '10.5'], ['price'], ['the', 'price', 'is', 'good'], ['50%', 'of', 'customers'], [],
+                 ['price', 'x'], ['x', 'y', 'price'], ['nan', 'price']]
+    assert [loaded.run_words(words) for words in documents] == [True, False, True, True, False, False, False, True]
+    assert [loaded.run_words(words, [True] * 4) for words in documents] == [True, False, True, True, False, True, True, True]
+    assert [loaded.run_words(words, vectorized=True) for words in documents] == [model.run_words(words) for words in documents]
+    assert loaded.compile_keywords() is not None and loaded.compile_keywords().to_tables()['ids'] == [1, 2]
+
+def test_conditions_switches_default(tmp_path):
+    model = cbtbc_model([condition_float_in_last_n_words({'n_words': 1}), condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['rates']})])
+    assert not model.run_words(['1.5'])
+    model.conditions_switches = [True, False]
+    assert model.run_words(['1.5']) and not model.run_words(['1.5'], [True, True])
+
+def test_filter_conditions_keeps_switches_aligned(tmp_path):
+    filename = str(tmp_path / "model.cbtbc")
+    make_model().save_model(filename)
+    model = cbtbc_model()
+    model.load_model(filename)
+    model.filter_conditions([False, True, True, True])
+    assert model.conditions_switches == [True, False, True]
+    # The negative keyword condition is still switched off, the float condition is gone
+    assert not model.run_words(['1.5', 'x']) and model.run_words(['rates', 'x'])
+    model.conditions_switches = None
+    model.filter_conditions([True, True, False])
+    assert model.conditions_switches is None and len(model.conditions) == 2
+
+def test_load_model_errors(tmp_path):
+    filename = tmp_path / "model.cbtbc"
+    make_model().save_model(str(filename))
+    data = bytearray(filename.read_bytes())
+    struct.pack_into('<I', data, len(model_format.MAGIC), model_format.FORMAT_VERSION + 1)
+    filename.write_bytes(bytes(data))
+    with pytest.raises(Exception, match='format version'):
+        cbtbc_model().load_model(str(filename))
+    filename.write_bytes(b'')
+    with pytest.raises(Exception, match='not a cbtbc model'):
+        cbtbc_model().load_model(str(filename))
+    filename.write_bytes(b'not a model')
+    with pytest.raises(Exception, match='not a cbtbc model'):
+        cbtbc_model().load_model(str(filename))
+    with pytest.raises(Exception):
+        cbtbc_model([condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['a\x00b']})]).save_model(str(filename))
+
+def test_large_keyword_table(tmp_path):
+    keywords = ['kw%d' % i for i in range(20000)] + ['interest rate']
+    model = cbtbc_model([condition_keywords_in_last_n_words({'n_words': 2, 'keywords': keywords})])
+    filename = str(tmp_path / "model.cbtbc")
+    model.save_model(filename)
+    loaded = cbtbc_model()
+    loaded.load_model(filename)
+    assert loaded.conditions[0].keywords == keywords
+    assert loaded.run_words(['x', 'kw19999']) and loaded.run_words(['interest', 'rate', 'x']) and not loaded.run_words(['rate', 'x', 'y'])
+    # Transitions are restored lazily from the mapped tables, only visited states become dictionaries
+    assert loaded.run_words(['interest', 'rate', 'x'], vectorized=True) and not loaded.run_words(['rate', 'x', 'y'], vectorized=True)
+    automaton = loaded.compile_keywords()
+    assert 0 < sum(goto is not None for goto in automaton._goto) <= 3
+    copy = pickle.loads(pickle.dumps(loaded))
+    assert copy.run_words(['x', 'kw19999'], vectorized=True) and copy.run_words(['interest', 'rate', 'x'], vectorized=True)
+    assert automaton.to_tables()['labels'] == model.compile_keywords().to_tables()['labels']
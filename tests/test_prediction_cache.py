@@ -0,0 +1,66 @@
+import os
+from cbtbc_model import cbtbc_model
+from prediction_cache import prediction_cache, prediction_key, model_fingerprint
+from conditions import condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, condition_float_in_last_n_words
+
+HTMLS = ["<p>Rates are 10.5 <b>%</b> now</p>", "<p>Nothing to see</p>", "<p>Rates 3 %</p>"]
+
+def make_model():
+    return cbtbc_model([condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates', 'price', 'tax']}), condition_floatpercent_in_last_n_words({'n_words': 2})])
+
+def test_cache_hits_and_results():
+    model = make_model()
+    expected = [model.run(html) for html in HTMLS]
+    cache = model.enable_prediction_cache()
+    assert [model.run(html) for html in HTMLS] == expected
+    assert [model.run(html) for html in HTMLS] == expected
+    assert cache.stats() == {'hits': 3, 'disk_hits': 0, 'misses': 3, 'evictions': 0, 'size': 3}
+    # Switches and ishtml are part of the key
+    assert model.run(HTMLS[0], [False, True]) == make_model().run(HTMLS[0], [False, True])
+    model.run(HTMLS[0], ishtml=False)
+    assert cache.misses == 5
+
+def test_cache_invalidated_by_model_changes():
+    model = make_model()
+    cache = model.enable_prediction_cache()
+    html = "<p>Rates 3 now</p>"
+    assert model.run(html) is False
+    model.conditions[1] = condition_float_in_last_n_words({'n_words': 2})
+    assert model.run(html) is True
+    model.top_level_operation = 'or'
+    assert model.run("<p>Rates</p>") is True
+    assert cache.hits == 0
+    model.conditions_switches = [False, True]
+    assert model.run("<p>Rates</p>") is False
+
+def test_fingerprint_is_stable():
+    assert model_fingerprint(make_model().conditions) == model_fingerprint(make_model().conditions)
+    reordered = make_model()
+    reordered.conditions[0] = condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['tax', 'rates', 'price']})
+    assert model_fingerprint(reordered.conditions) == model_fingerprint(make_model().conditions)
+    assert model_fingerprint(make_model().conditions, 'or') != model_fingerprint(make_model().conditions)
+    fingerprint = model_fingerprint(make_model().conditions)
+    assert prediction_key('a', True, [True, True], 2, fingerprint) == prediction_key('a', True, [True, True, False], 2, fingerprint)
+    assert prediction_key('a', True, None, 2, fingerprint) != prediction_key('a', True, [True, False], 2, fingerprint)
+
+def test_cache_eviction():
+    cache = prediction_cache(maxsize=2)
+    for i in range(5):
+        cache.put(bytes([i]), i % 2 == 0)
+    assert len(cache) == 2 and cache.evictions == 3
+    assert cache.get(bytes([0])) is None
+    assert cache.get(bytes([4])) is True
+
+def test_cache_persistence(tmp_path):
+    path = os.path.join(tmp_path, 'predictions.sqlite')
+    model = make_model()
+    model.enable_prediction_cache(path=path)
+    expected = [model.run(html) for html in HTMLS]
+    model.disable_prediction_cache()
+    restarted = make_model()
+    cache = restarted.enable_prediction_cache(path=path)
+    assert [restarted.run(html) for html in HTMLS] == expected
+    assert cache.stats()['disk_hits'] == 3 and cache.misses == 0
+    assert restarted.run_many(HTMLS * 4, n_jobs=2) == expected * 4
+    cache.clear(persistent=True)
+    assert cache.get(prediction_key(HTMLS[0], True, None, 2, restarted.fingerprint())) is None
@@ -0,0 +1,160 @@
+import asyncio
+import json
+from cbtbc_model import cbtbc_model
+from service import DEFAULT_LINE_LIMIT, classification_service, serve_http, serve_stdio
+from conditions import condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words
+
+DOCUMENTS = ["<p>Rates are 10.5 <b>%</b> now</p>", "<p>Nothing to see</p>", "<p>Interest rates</p>", "<p>Rates 3 %</p>"]
+
+def make_model():
+    return cbtbc_model([condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}), condition_floatpercent_in_last_n_words({'n_words': 2})])
+
+def expected_results(documents):
+    model = make_model()
+    return [model.run(document) for document in documents]
+
+def test_service_batches_requests():
+    documents = DOCUMENTS * 10
+
+    async def run():
+        async with classification_service(make_model(), n_jobs=0, max_batch_size=16, batch_window=0.05) as service:
+            results = await service.classify_many(documents)
+            return results, service.metrics()
+    results, metrics = asyncio.run(run())
+    assert results == expected_results(documents)
+    assert metrics['completed'] == len(documents)
+    assert metrics['batches'] < len(documents)
+    assert metrics['mean_batch_size'] > 1
+    assert metrics['queue_depth'] == 0
+    assert 0 <= metrics['latency_p50'] <= metrics['latency_p99'] <= metrics['latency_max']
+
+def test_service_thread_pool_runs_batches_concurrently():
+    import threading
+    import time
+    model = make_model()
+    run = model.run
+    lock = threading.Lock()
+    running = [0, 0]  # Current and maximal number of documents classified at once
+
+    def slow_run(intext, **kwargs):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return run(intext, **kwargs)
+    model.run = slow_run
+
+    async def run_service():
+        async with classification_service(model, n_jobs=0, max_batch_size=2, batch_window=0, max_batches_in_flight=4) as service:
+            return await service.classify_many(DOCUMENTS * 10)
+    assert asyncio.run(run_service()) == expected_results(DOCUMENTS * 10)
+    assert running[1] > 1
+
+def test_service_process_pool():
+    async def run():
+        async with classification_service(make_model(), n_jobs=2, max_batch_size=4, batch_window=0.01) as service:
+            return await service.classify_many(DOCUMENTS * 5)
+    assert asyncio.run(run()) == expected_results(DOCUMENTS * 5)
+
+def test_service_worker_warmup_follows_ishtml(monkeypatch):
+    import concurrent.futures
+    import worker_pool
+    model = make_model()
+    warmups = []
+    monkeypatch.setattr(model, 'warmup', lambda ishtml=True: warmups.append(ishtml))
+    pools = []
+
+    def process_pool_executor(max_workers, name, obj, setup):
+        pools.append((obj, setup))
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
+    monkeypatch.setattr(worker_pool, 'process_pool_executor', process_pool_executor)
+
+    async def run():
+        async with classification_service(model, n_jobs=1, ishtml=False):
+            pass
+    asyncio.run(run())
+    obj, setup = pools[0]
+    setup(obj)  # What each worker process runs after receiving the model
+    assert obj is model and warmups == [False, False]
+
+def test_service_backpressure():
+    async def run():
+        async with classification_service(make_model(), n_jobs=0, max_batch_size=1, max_queue_size=2, reject_when_full=True) as service:
+            results = await asyncio.gather(*(service.classify(document) for document in DOCUMENTS * 5), return_exceptions=True)
+            return results, service.metrics()
+    results, metrics = asyncio.run(run())
+    rejected = [result for result in results if isinstance(result, Exception)]
+    assert rejected and metrics['rejected'] == len(rejected)
+    assert metrics['completed'] == len(results) - len(rejected)
+
+    async def run_waiting():
+        async with classification_service(make_model(), n_jobs=0, max_batch_size=1, max_queue_size=2) as service:
+            return await service.classify_many(DOCUMENTS * 5)
+    assert asyncio.run(run_waiting()) == expected_results(DOCUMENTS * 5)
+
+def test_service_stdio():
+    lines = [json.dumps({'id': i, 'text': document}) for i, document in enumerate(DOCUMENTS)] + ['not json']
+    output = []
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(('\n'.join(lines) + '\n').encode('utf-8'))
+        reader.feed_eof()
+        async with classification_service(make_model(), n_jobs=0) as service:
+            await serve_stdio(service, reader, output.append)
+    asyncio.run(run())
+    responses = [json.loads(line) for line in output]
+    assert {response['id']: response['result'] for response in responses if 'result' in response} == dict(enumerate(expected_results(DOCUMENTS)))
+    assert any(response['id'] is None and 'error' in response for response in responses)
+
+def test_service_stdio_long_lines():
+    long_document = '<p>' + 'filler words ' * 12000 + 'rates 3 %</p>'  # About 150 KB
+    documents = [long_document, DOCUMENTS[0], long_document, DOCUMENTS[1]]
+    data = ('\n'.join(json.dumps({'id': i, 'text': document}) for i, document in enumerate(documents)) + '\n').encode('utf-8')
+    assert len(data) > 2 * 64 * 1024
+
+    def serve(limit):
+        output = []
+
+        async def run():
+            reader = asyncio.StreamReader(limit=limit)
+            reader.feed_data(data)
+            reader.feed_eof()
+            async with classification_service(make_model(), n_jobs=0) as service:
+                await serve_stdio(service, reader, output.append)
+        asyncio.run(run())
+        return [json.loads(line) for line in output]
+    responses = serve(DEFAULT_LINE_LIMIT)
+    assert {response['id']: response['result'] for response in responses} == dict(enumerate(expected_results(documents)))
+    # Lines over the limit are answered with errors, the other requests are still served
+    responses = serve(64 * 1024)
+    assert {response['id']: response['result'] for response in responses if 'result' in response} == {1: expected_results(DOCUMENTS[:1])[0], 3: expected_results(DOCUMENTS[1:2])[0]}
+    assert sum('error' in response for response in responses) == 2
+
+def test_service_http():
+    async def request(port, method, path, body=b''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(payload)
+
+    async def run():
+        async with classification_service(make_model(), n_jobs=0) as service:
+            server = await serve_http(service, port=0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                results = [await request(port, 'POST', '/classify', document.encode('utf-8')) for document in DOCUMENTS]
+                metrics = await request(port, 'GET', '/metrics')
+                missing = await request(port, 'GET', '/missing')
+                invalid = await request(port, 'POST', '/classify', b'<p>\xff\xfe rates</p>')
+            return results, metrics, missing, invalid
+    results, metrics, missing, invalid = asyncio.run(run())
+    assert [payload['result'] for _, payload in results] == expected_results(DOCUMENTS)
+    assert metrics[0] == 200 and metrics[1]['completed'] == len(DOCUMENTS)
+    assert missing[0] == 404
+    assert invalid[0] == 400 and 'UTF-8' in invalid[1]['error']
@@ -0,0 +1,76 @@
+import json
+import random
+import pytest
+from cbtbc_model import cbtbc_model
+from cbtbc_opt import index_to_binary_vector
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
+from sharded_training import build_shard_summaries, iter_shard_documents, sharded_matrix
+
+# Plain texts labeled True when 'rates' is close to a number
+TEXTS = ['special rates are 10.5 % for new customers', 'rates are good for 50% of customers', 'the price is 3 and the price is good',
+         'rates and price 10.5', 'good rates , nan is good', '', '50% of customers like the price', '3 rates', 'it is good',
+         'rates of 50% for price', '10.5 is the price of rates of 3', 'nan % rates', 'rates at 50%', 'price 50%', 'rates',
+         'price of 2.5 is 10 %', 'rates 7', 'customers pay 7 %', 'price rates 1.5', 'good price of 3']
+LABELS = [True, False, False, True, False, False, False, True, False, True,
+          True, False, True, False, False, False, True, False, True, False]
+
+def make_model():
+    return cbtbc_model([condition_float_in_last_n_words({'n_words': 2}),
+                        condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}),
+                        condition_floatpercent_in_last_n_words({'n_words': 4}),
+                        negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']}))])
+
+def split_shards(texts, labels, sizes):
+    shards, start = [], 0
+    for size in sizes:
+        shards.append(list(zip(texts[start:start + size], labels[start:start + size])))
+        start += size
+    return shards
+
+def write_shards(dirname, shards):
+    for i, shard in enumerate(shards):
+        with open(dirname / f'part_{i:03d}.jsonl', 'w') as f:
+            for text, label in shard:
+                f.write(json.dumps({'text': text, 'label': label}) + '\n')
+
+@pytest.mark.parametrize('method', ['bruteforce', 'bruteforce_gray', 'bnb', 'random_bnb', 'random', 'anneal'])
+def test_sharded_training_matches_in_memory(tmp_path, method):
+    shards = split_shards(TEXTS, LABELS, [8, 0, 7, 5])
+    random.seed(7)
+    expected = make_model().train_minimize_number_of_conditions(TEXTS, LABELS, method, n_iter=30, ishtml=False)
+    random.seed(7)
+    result = make_model().train_sharded(iter(shards), str(tmp_path), method, n_iter=30, ishtml=False)
+    assert result == expected
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_sharded_matrix_matches_in_memory(tmp_path, top_level_operation):
+    import activation, corpus
+    model = make_model()
+    model.top_level_operation = top_level_operation
+    matrix = build_shard_summaries(model, split_shards(TEXTS, LABELS, [7, 7, 6]), str(tmp_path), ishtml=False)
+    in_memory = activation.activation_matrix.from_model(model, [corpus.preprocess_text(text, False) for text in TEXTS], LABELS)
+    assert (len(matrix), matrix.n_documents) == (3, 20)
+    assert matrix.exhaustive_errors().tolist() == [in_memory.errors(index_to_binary_vector(i, 4)) for i in range(16)]
+    assert matrix.lower_bound([True, False]) <= min(matrix.errors([True, False, a, b]) for a in (False, True) for b in (False, True))
+    state = matrix.incremental()
+    assert state.flip(1) == in_memory.errors([False, True, False, False])
+
+def test_directory_of_shards_in_parallel(tmp_path):
+    write_shards(tmp_path, split_shards(TEXTS, LABELS, [8, 8, 4]))
+    assert list(iter_shard_documents(str(tmp_path / 'part_002.jsonl'))) == list(zip(TEXTS[16:], LABELS[16:]))
+    expected = (2, [True, True, False, False])
+    model = make_model()
+    summary_dir = str(tmp_path / 'summaries')
+    assert model.train_sharded(str(tmp_path), summary_dir, ishtml=False, n_jobs=2) == expected
+    assert model.train_sharded('missing directory', summary_dir, 'bnb', ishtml=False, reuse_summaries=True) == expected
+    other = cbtbc_model(make_model().conditions[:3])
+    with pytest.raises(Exception):
+        sharded_matrix(summary_dir).check_model(other)
+    # Summaries of other preprocessing settings are not reused
+    with pytest.raises(Exception, match='preprocessing settings'):
+        model.train_sharded('missing directory', summary_dir, 'bnb', ishtml=True, reuse_summaries=True)
+    with pytest.raises(Exception, match='preprocessing settings'):
+        model.train_sharded('missing directory', summary_dir, 'bnb', ishtml=False, deduplicate=False, reuse_summaries=True)
+    model.tokenizer = 'regex'
+    with pytest.raises(Exception, match='preprocessing settings'):
+        model.train_sharded('missing directory', summary_dir, 'bnb', ishtml=False, reuse_summaries=True)
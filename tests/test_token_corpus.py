@@ -0,0 +1,87 @@
+import itertools
+import pytest
+import numpy as np
+from activation import activation_matrix
+from cbtbc_model import cbtbc_model
+from token_corpus import token_corpus, FLOAT, PERCENT
+from conditions import condition_float_in_last_n_words, condition_keywords_in_last_n_words, condition_floatpercent_in_last_n_words, negative_condition
+
+# Documents (lists of words) with repeated tokens, numbers, percents and phrases of several words
+DOCUMENTS = [['special', 'rates', 'are', '10.5', '%'], ['rates', 'are', 'good', 'for', '50%', 'of', 'customers'],
+             ['price', 'is', '3', 'price'], [], ['good', 'rates', 'nan'], ['50%', 'of', 'customers', 'price'],
+             ['3', 'rates'], ['is', 'good'], ['rates', '50%', 'price', 'of', 'customers'], ['10.5', 'price', 'rates', 'of', '3'],
+             ['special', 'rates', 'are', '10.5', '%'], ['of', 'good', 'customers']]
+LABELS = [True, False, False, False, False, False, True, False, True, True, True, False]
+
+def make_conditions():
+    return [condition_float_in_last_n_words({'n_words': 2}),
+            condition_keywords_in_last_n_words({'n_words': 3, 'keywords': ['rates']}),
+            condition_floatpercent_in_last_n_words({'n_words': 4}),
+            negative_condition(condition_keywords_in_last_n_words({'n_words': 1, 'keywords': ['price']})),
+            condition_keywords_in_last_n_words({'n_words': 2, 'keywords': ['of customers', 'good']})]
+
+def make_corpus(documents):
+    tokens = token_corpus()
+    for words in documents:
+        tokens.add(words)
+    return tokens
+
+def test_interning():
+    tokens = make_corpus(DOCUMENTS)
+    assert len(tokens) == 12
+    assert list(tokens) == DOCUMENTS and tokens[3] == []
+    assert len(tokens.tokens) == len(set(itertools.chain.from_iterable(DOCUMENTS))) == 14
+    assert tokens.ids.dtype == np.uint32 and len(tokens.ids) == sum(map(len, DOCUMENTS)) == 45
+    flags = {token: int(tokens.flags[i]) for i, token in enumerate(tokens.tokens)}
+    assert flags['10.5'] == FLOAT and flags['50%'] == PERCENT and flags['rates'] == 0
+    assert tokens.document_key(0) == tokens.document_key(10) == make_corpus([DOCUMENTS[0]]).document_key(0)
+    assert tokens.document_key(0) != tokens.document_key(1)
+
+@pytest.mark.parametrize('top_level_operation', ['and', 'or'])
+def test_matrix_on_token_ids(top_level_operation):
+    tokens = make_corpus(DOCUMENTS)
+    for deduplicate in (True, False):
+        expected = activation_matrix(make_conditions(), DOCUMENTS, LABELS, top_level_operation, deduplicate=deduplicate)
+        matrix = activation_matrix(make_conditions(), tokens, LABELS, top_level_operation, deduplicate=deduplicate)
+        assert matrix.n_unique == expected.n_unique == (11 if deduplicate else 12)
+        for switches in itertools.product([False, True], repeat=matrix.n_conditions):
+            assert matrix.predict(switches).tolist() == expected.predict(switches).tolist()
+
+def test_run_tokens_matches_run_words():
+    tokens = make_corpus(DOCUMENTS)
+    model = cbtbc_model(make_conditions())
+    for switches in [None, [True, False, True, False, True], [False, True, False, True, False]]:
+        for i, words in enumerate(DOCUMENTS):
+            assert model.run_tokens(tokens, i, switches) == model.run_words(words, switches)
+
+def test_training_on_token_corpus():
+    texts = [' '.join(words) for words in DOCUMENTS]
+    tokens = token_corpus.from_texts(texts, ishtml=False)
+    model = cbtbc_model(make_conditions())
+    expected = model.train_minimize_number_of_conditions(texts, LABELS, ishtml=False)
+    assert model.train_minimize_number_of_conditions(tokens, LABELS) == expected == (1, [True, True, False, False, False])
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_and_load(tmp_path, mmap):
+    documents = DOCUMENTS + [['naïve', 'x\x00y']]
+    tokens = make_corpus(documents)
+    filename = str(tmp_path / 'corpus.cbtbc')
+    tokens.save(filename)
+    loaded = token_corpus.load(filename, mmap=mmap)
+    assert list(loaded) == documents and loaded.tokens == tokens.tokens
+    assert loaded.flags.tolist() == tokens.flags.tolist()
+    assert isinstance(loaded.ids, np.memmap) == mmap
+    model = cbtbc_model(make_conditions())
+    assert [model.run_tokens(loaded, i) for i in range(len(loaded))] == [model.run_words(words) for words in documents]
+    if mmap:
+        with pytest.raises(Exception):
+            loaded.add(['new'])
+    else:
+        assert loaded.add(['new', '3']) == len(documents) and loaded[-1] == ['new', '3']
+
+def test_load_errors(tmp_path):
+    filename = str(tmp_path / 'wrong.cbtbc')
+    with open(filename, 'wb') as f:
+        f.write(b'not a corpus file at all')
+    with pytest.raises(Exception, match='not a cbtbc token corpus'):
+        token_corpus.load(filename)
@@ -0,0 +1,21 @@
+import operator
+import os
+import pytest
+import worker_pool
+
+def _object_and_pid(_):
+    return worker_pool.worker_object('test.pool'), os.getpid()
+
+def test_pool_sends_object_to_each_worker_once():
+    with worker_pool.pool(2, 'test.pool', {'value': 42}, setup=operator.methodcaller('update', ready=True)) as pool:
+        results = pool.map(_object_and_pid, range(8))
+    assert all(obj == {'value': 42, 'ready': True} for obj, _ in results)
+    with pytest.raises(KeyError):
+        worker_pool.worker_object('test.pool')  # Only the workers keep it
+
+def test_set_worker_object():
+    worker_pool.set_worker_object('test.local', [1])
+    assert worker_pool.worker_object('test.local') == [1]
+    worker_pool.set_worker_object('test.local', None)
+    with pytest.raises(KeyError):
+        worker_pool.worker_object('test.local')
@@ -0,0 +1,318 @@
+'''
+Interned token corpus
+Words of all documents are interned into one vocabulary and stored as token ids in one contiguous uint32 buffer,
+document i is the slice offsets[i]:offsets[i + 1]. Token classes (float, percent) are computed once per vocabulary
+entry, conditions are evaluated on token ids through interned_token_classes.
+File layout (little endian): magic (8 bytes), format version (uint32), reserved (uint32), header length (uint64),
+JSON header padded to 8 bytes, blobs (ids, offsets, flags, vocabulary) aligned to 8 bytes, so the buffers can be memory mapped.
+'''
+
+import json
+import struct
+import threading
+import weakref
+from array import array
+import numpy as np
+import conditions
+import corpus
+from typing import Dict, Iterable, List
+
+MAGIC = b'CBTBCTC\x00'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sIIQ')
+_ALIGNMENT = 8
+# Token class flags
+FLOAT = 1
+PERCENT = 2
+
+
+def _padding(length: int) -> int:
+    return -length % _ALIGNMENT
+
+
+def token_flags(word: str) -> int:
+    """
+    Compute token class flags of the word.
+
+    :param word: Word
+    :return: Combination of FLOAT and PERCENT
+    """
+    return (FLOAT if conditions.isfloat(word) else 0) | (PERCENT if word and conditions.ispercent(word) else 0)
+
+
+class interned_token_classes(conditions.token_classes):
+    '''
+        Token classes of a document of token_corpus, masks are taken from per vocabulary entry flags
+        Words are decoded from ids only if a condition needs them
+    '''
+    def __init__(self, token_corpus, ids):
+        self.corpus = token_corpus
+        self.ids = ids
+        self._words = None
+        self._unique = None
+        self._masks = {}
+    @property
+    def words(self):
+        if self._words is None:
+            tokens = self.corpus.tokens
+            self._words = [tokens[i] for i in self.ids.tolist()]
+        return self._words
+    @property
+    def inverse(self):
+        if self._unique is None:
+            self._unique = np.unique(self.ids, return_inverse=True)
+        return self._unique[1]
+    @property
+    def unique(self):
+        if self._unique is None:
+            self._unique = np.unique(self.ids, return_inverse=True)
+        tokens = self.corpus.tokens
+        return [tokens[i] for i in self._unique[0].tolist()]
+    def float_mask(self):
+        return (self.corpus.flags[self.ids] & FLOAT) != 0
+    def percent_mask(self):
+        return (self.corpus.flags[self.ids] & PERCENT) != 0
+    def keyword_mask(self, keywords):
+        return self.corpus.vocabulary_mask(keywords)[self.ids]
+    def trigger_masks(self, automaton):
+        if automaton.max_length > 1:
+            return super().trigger_masks(automaton)
+        return {keyword_id: flags[self.ids] for keyword_id, flags in self.corpus.automaton_masks(automaton).items()}
+
+
+class token_corpus():
+    def __init__(self):
+        """
+        Initialize empty corpus.
+        """
+        self.vocabulary = {}
+        self.tokens = []
+        self._flags = array('B')
+        self._ids = array('I')
+        self._offsets = array('q', [0])
+        self._mapped = None  # (ids, offsets, flags) memory mapped by load
+        self._flags_array = np.zeros(0, dtype=np.uint8)
+        self._vocabulary_masks = {}
+        self._automaton_masks = weakref.WeakKeyDictionary()
+        self._masks_lock = threading.Lock()  # Caches of masks may be filled by several threads running the model
+
+    @classmethod
+    def from_texts(cls, list_of_texts: Iterable[str], ishtml: bool = True, html_backend: str = 'bs4', tokenizer: str = 'nltk', verbose: int = 0) -> 'token_corpus':
+        """
+        Preprocess and intern documents, texts are consumed lazily and are not kept.
+
+        :param list_of_texts: Iterable of plain text/HTML strings
+        :param ishtml: If True, texts are HTML
+        :param html_backend: HTML parsing backend (see htmltransform.HTML_BACKENDS)
+        :param tokenizer: Tokenizer (see htmltransform.TOKENIZERS)
+        :param verbose: Verbosity level (1: progress bar)
+        :return: token_corpus
+        """
+        from tqdm import tqdm  # Importing tqdm module for progress bar
+        result = cls()
+        total = len(list_of_texts) if hasattr(list_of_texts, '__len__') else None
+        for intext in tqdm(list_of_texts, total=total, disable=(verbose != 1), desc='cbtbc token corpus'):
+            result.add(corpus.preprocess_text(intext, ishtml, html_backend, tokenizer))
+        return result
+
+    def intern(self, word: str) -> int:
+        """
+        Return id of the word, adding it to the vocabulary if it is new.
+        """
+        token_id = self.vocabulary.get(word)
+        if token_id is None:
+            if self._mapped is not None:
+                raise Exception('token_corpus loaded from file is read only')
+            token_id = self.vocabulary[word] = len(self.tokens)
+            self.tokens.append(word)
+            self._flags.append(token_flags(word))
+        return token_id
+
+    def add(self, words: Iterable[str]) -> int:
+        """
+        Add preprocessed document.
+
+        :param words: Iterable of words (as produced by corpus.preprocess_text)
+        :return: Index of the document
+        """
+        if self._mapped is not None:
+            raise Exception('token_corpus loaded from file is read only')
+        vocabulary = self.vocabulary
+        self._ids.extend(vocabulary[word] if word in vocabulary else self.intern(word) for word in words)
+        self._offsets.append(len(self._ids))
+        return len(self._offsets) - 2
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        Token ids of all documents (a copy unless the corpus is memory mapped).
+        """
+        if self._mapped is not None:
+            return self._mapped[0]
+        return np.array(self._ids, dtype=np.uint32)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._mapped is not None:
+            return self._mapped[1]
+        return np.array(self._offsets, dtype=np.int64)
+
+    @property
+    def flags(self) -> np.ndarray:
+        """
+        Token class flags (FLOAT, PERCENT) of vocabulary entries.
+        """
+        if self._mapped is not None:
+            return self._mapped[2]
+        if len(self._flags_array) != len(self._flags):
+            self._flags_array = np.frombuffer(self._flags.tobytes(), dtype=np.uint8)
+        return self._flags_array
+
+    def document_ids(self, index: int) -> np.ndarray:
+        """
+        Token ids of the document.
+        """
+        if self._mapped is not None:
+            ids, offsets, _ = self._mapped
+            return ids[offsets[index]:offsets[index + 1]]
+        # Slice of array is a copy, so the buffer is not locked by exported views
+        return np.frombuffer(self._ids[self._offsets[index]:self._offsets[index + 1]], dtype=np.uint32)
+
+    def token_classes(self, index: int) -> interned_token_classes:
+        """
+        Token classes of the document for evaluation of conditions (see conditions.check_words_all).
+        """
+        return interned_token_classes(self, self.document_ids(index))
+
+    def document_key(self, index: int) -> bytes:
+        """
+        Key equal for documents with the same words.
+        """
+        return self.document_ids(index).tobytes()
+
+    def __len__(self):
+        if self._mapped is not None:
+            return len(self._mapped[1]) - 1
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> List[str]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('token_corpus index out of range')
+        tokens = self.tokens
+        return [tokens[i] for i in self.document_ids(index).tolist()]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def vocabulary_mask(self, keywords) -> np.ndarray:
+        """
+        Boolean array with one element per vocabulary entry, True for entries in keywords (cached per set of keywords).
+        """
+        key = keywords if isinstance(keywords, frozenset) else frozenset(keywords)
+        with self._masks_lock:
+            mask = self._vocabulary_masks.get(key)
+        if mask is None or len(mask) != len(self.tokens):
+            mask = np.zeros(len(self.tokens), dtype=bool)
+            vocabulary = self.vocabulary
+            if len(key) < len(vocabulary):
+                token_ids = [vocabulary[keyword] for keyword in key if keyword in vocabulary]
+            else:
+                token_ids = [token_id for token, token_id in vocabulary.items() if token in key]
+            mask[token_ids] = True
+            with self._masks_lock:
+                self._vocabulary_masks[key] = mask
+        return mask
+
+    def automaton_masks(self, automaton) -> Dict[object, np.ndarray]:
+        """
+        Per id of the single word keyword automaton: boolean array with one element per vocabulary entry,
+        True for entries which are keywords of this id (cached per automaton).
+        """
+        with self._masks_lock:
+            masks = self._automaton_masks.get(automaton)
+        if masks is None or any(len(mask) != len(self.tokens) for mask in masks.values()):
+            masks = {keyword_id: np.zeros(len(self.tokens), dtype=bool) for keyword_id in automaton.ids}
+            vocabulary = self.vocabulary
+            root = automaton._transitions(0)
+            for word, state in root.items():
+                token_id = vocabulary.get(word)
+                if token_id is not None:
+                    for keyword_id in automaton._output[state]:
+                        masks[keyword_id][token_id] = True
+            with self._masks_lock:
+                self._automaton_masks[automaton] = masks
+        return masks
+
+    def save(self, filename: str):
+        """
+        Save the corpus to a file.
+
+        :param filename: Name of the file
+        """
+        encoded = [token.encode('utf-8', 'surrogatepass') for token in self.tokens]
+        token_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(token) for token in encoded], out=token_offsets[1:])
+        blobs = [('ids', np.ascontiguousarray(self.ids, dtype='<u4').tobytes(), '<u4'),
+                 ('offsets', np.ascontiguousarray(self.offsets, dtype='<i8').tobytes(), '<i8'),
+                 ('flags', np.ascontiguousarray(self.flags, dtype=np.uint8).tobytes(), '|u1'),
+                 ('token_offsets', token_offsets.astype('<i8').tobytes(), '<i8'),
+                 ('tokens', b''.join(encoded), '|u1')]
+        descriptions = {}
+        position = 0
+        for name, data, dtype in blobs:
+            descriptions[name] = {'offset': position, 'length': len(data), 'dtype': dtype}
+            position += len(data) + _padding(len(data))
+        header = json.dumps({'n_documents': len(self), 'n_tokens': len(self.tokens), 'blobs': descriptions}).encode('utf-8')
+        header += b' ' * _padding(_PREFIX.size + len(header))
+        with open(filename, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+            f.write(header)
+            for _, data, _ in blobs:
+                f.write(data)
+                f.write(b'\x00' * _padding(len(data)))
+
+    @classmethod
+    def load(cls, filename: str, mmap: bool = True) -> 'token_corpus':
+        """
+        Load the corpus from a file.
+
+        :param filename: Name of the file
+        :param mmap: If True, token ids, offsets and flags are memory mapped instead of being read into memory,
+                     the loaded corpus is read only
+        :return: token_corpus
+        """
+        with open(filename, 'rb') as f:
+            prefix = f.read(_PREFIX.size)
+            if len(prefix) != _PREFIX.size or prefix[:8] != MAGIC:
+                raise Exception(f'{filename} is not a cbtbc token corpus file')
+            _, version, _, header_length = _PREFIX.unpack(prefix)
+            if version != FORMAT_VERSION:
+                raise Exception(f'Unsupported cbtbc token corpus file format version {version} (supported version is {FORMAT_VERSION})')
+            header = json.loads(f.read(header_length).decode('utf-8'))
+            data_start = _PREFIX.size + header_length
+
+            def blob(name):
+                description = header['blobs'][name]
+                dtype = np.dtype(description['dtype'])
+                count = description['length'] // dtype.itemsize
+                if mmap and name in ('ids', 'offsets', 'flags') and count:
+                    return np.memmap(filename, dtype=dtype, mode='r', offset=data_start + description['offset'], shape=(count,))
+                f.seek(data_start + description['offset'])
+                return np.frombuffer(f.read(description['length']), dtype=dtype)
+
+            ids, offsets, flags = blob('ids'), blob('offsets'), blob('flags')
+            token_offsets = blob('token_offsets').tolist()
+            data = blob('tokens').tobytes()
+        result = cls()
+        result.tokens = [data[start:end].decode('utf-8', 'surrogatepass') for start, end in zip(token_offsets[:-1], token_offsets[1:])]
+        result.vocabulary = {token: token_id for token_id, token in enumerate(result.tokens)}
+        if mmap:
+            result._mapped = (ids, offsets, flags)
+        else:
+            result._ids = array('I', ids.astype(np.uint32).tobytes())
+            result._offsets = array('q', offsets.astype(np.int64).tobytes())
+            result._flags = array('B', flags.tobytes())
+        return result
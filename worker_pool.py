@@ -0,0 +1,61 @@
+'''
+Process pools sharing one object with their workers
+The object (model, objective function, activation matrix) is sent to each worker once by the pool initializer
+and kept in the worker process under a name, tasks take it with worker_object(name) instead of carrying it.
+Names are prefixed with the module using them, e.g. 'cbtbc_model.run_many'.
+'''
+
+import concurrent.futures
+import multiprocessing
+import multiprocessing.pool
+from typing import Callable, Optional
+
+_worker_objects = {}
+
+
+def set_worker_object(name: str, obj):
+    """
+    Keep the object in the current process, tasks run without a pool set it themselves.
+
+    :param name: Name of the object
+    :param obj: The object, None removes it
+    """
+    if obj is None:
+        _worker_objects.pop(name, None)
+    else:
+        _worker_objects[name] = obj
+
+
+def worker_object(name: str):
+    """
+    Object kept in the current process by the pool initializer or set_worker_object.
+
+    :param name: Name of the object
+    """
+    return _worker_objects[name]
+
+
+def _init_worker(name: str, obj, setup: Optional[Callable]):
+    set_worker_object(name, obj)
+    if setup is not None:
+        setup(obj)
+
+
+def pool(processes: int, name: str, obj, setup: Optional[Callable] = None) -> multiprocessing.pool.Pool:
+    """
+    Create multiprocessing.Pool whose workers keep obj under the name.
+
+    :param processes: Number of worker processes
+    :param name: Name of the object in the workers
+    :param obj: Object sent to each worker once
+    :param setup: Optional picklable function called with the object in each worker (e.g. to warm it up)
+    :return: multiprocessing.Pool
+    """
+    return multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(name, obj, setup))
+
+
+def process_pool_executor(max_workers: int, name: str, obj, setup: Optional[Callable] = None) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Create concurrent.futures.ProcessPoolExecutor whose workers keep obj under the name, see pool.
+    """
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(name, obj, setup))